@@ -8,8 +8,15 @@ from pathlib import Path
 from typing import Dict, List, Optional
 
 from nilrt_snac._pre_reqs import verify_prereqs
-from nilrt_snac.opkg import opkg_helper
-from nilrt_snac._configs import CONFIGS
+from nilrt_snac._bundle import create_bundle, load_bundle, unload_bundle
+from nilrt_snac._executor import executor
+from nilrt_snac._feeds import PREFETCH_JOBS
+from nilrt_snac._parallel import run_grouped, run_scheduled
+from nilrt_snac._services import restarts
+from nilrt_snac.opkg import OPKG_UPDATE_MAX_AGE, OpkgTransaction, opkg_helper
+from nilrt_snac._configs import CONFIGS, _BaseConfig, _PackagesConfig, _SettingsConfig
+from nilrt_snac._configs._config_file import config_files
+from nilrt_snac._configs._nirtcfg import NirtcfgTransaction, nirtcfg
 from nilrt_snac import Errors, logger, SNACError, __version__
 
 PROG_NAME = "nilrt-snac"
@@ -54,6 +61,41 @@ def _get_enabled_modules(config_file_path: Path = Path("/etc/snac/snac.conf")) -
     return enabled_modules
 
 
+def _declare_packages(configs: List[_BaseConfig]) -> OpkgTransaction:
+    """Collect the packages declared by the given modules into one transaction."""
+    transaction = OpkgTransaction()
+    for config in configs:
+        transaction.requester = config.name
+        config.declare_packages(transaction)
+    return transaction
+
+
+def _declare_settings(configs: List[_BaseConfig]) -> NirtcfgTransaction:
+    """Collect the NI system settings declared by the given modules into one transaction."""
+    transaction = NirtcfgTransaction()
+    for config in configs:
+        config.declare_settings(transaction)
+    return transaction
+
+
+def _log_commands() -> None:
+    """Log how long the external commands of this run took, and which were the slowest."""
+    logger.info(f"Ran {len(executor.records)} commands in {executor.total():.1f}s")
+    if executor.records:
+        logger.debug(f"Slowest commands:\n{executor.summary()}")
+
+
+def _bundle(args: argparse.Namespace) -> int:
+    """Create an offline package bundle."""
+    print(f"Creating offline SNAC bundle: {args.output}")
+    opkg_helper.update()
+
+    enabled_modules = _get_enabled_modules()
+    configs = [config for config in CONFIGS if enabled_modules.get(config.name, True)]
+    create_bundle(opkg_helper, _declare_packages(configs), args.output, jobs=args.prefetch_jobs)
+    return Errors.EX_OK
+
+
 def _configure(args: argparse.Namespace) -> int:
     """Configure SNAC mode."""
     logger.warning("!! Running this tool will irreversibly alter the state of your system.    !!")
@@ -68,17 +110,50 @@ def _configure(args: argparse.Namespace) -> int:
         return Errors.EX_OK
 
     print("Configuring SNAC mode.")
-    opkg_helper.update()
+    if args.bundle:
+        load_bundle(opkg_helper, args.bundle)
+    else:
+        opkg_helper.set_update_max_age(args.update_max_age)
+        opkg_helper.update(force=args.force_update)
 
     # Read /etc/snac/snac.conf for module enable/disable
     enabled_modules = _get_enabled_modules()
 
+    configs = []
     for config in CONFIGS:
         enabled = enabled_modules.get(config.name, True)
         if not enabled:
             logger.info(f"Skipping configuration for: {config.name} (disabled in config file)")
             continue
-        config.configure(args)
+        configs.append(config)
+
+    try:
+        # The packages for all modules are installed and removed in batched opkg runs, once the
+        # feeds are set up, and before the modules which need them. Modules which don't depend on
+        # each other or share a resource are configured concurrently. Likewise, the NI system
+        # settings for all modules are written at once, after the packages.
+        packages = _PackagesConfig(_declare_packages(configs))
+        settings = _SettingsConfig(_declare_settings(configs))
+        run_scheduled(
+            [packages, settings] + configs, lambda config: config.configure(args), args.jobs
+        )
+    except Exception:
+        pending = restarts.pending()
+        if pending:
+            logger.warning(f"Configuration failed; not restarting: {', '.join(pending)}")
+        raise
+    finally:
+        if args.bundle:
+            unload_bundle(opkg_helper)
+
+    # Services are restarted once all modules are configured, and only if their inputs changed.
+    restarts.run(args.dry_run)
+
+    logger.info(
+        f"Wrote {config_files.files_written} configuration files "
+        f"({config_files.bytes_written} bytes)"
+    )
+    _log_commands()
 
     print("!! A reboot is now required to affect your system configuration. !!")
     print("!! Login with user 'root' and no password.                       !!")
@@ -94,13 +169,19 @@ def _verify(args: argparse.Namespace) -> int:
     # Read /etc/snac/snac.conf for module enable/disable
     enabled_modules = _get_enabled_modules()
 
+    configs = []
     for config in CONFIGS:
         enabled = enabled_modules.get(config.name, True)
         if not enabled:
             logger.info(f"Skipping verification for: {config.name} (disabled in config file)")
             continue
-        new_valid = config.verify(args)
+        configs.append(config)
+
+    # The checks are independent and read-only, so they can run concurrently. Each module's
+    # output is still printed together, in CONFIGS order.
+    for new_valid in run_grouped(configs, lambda config: config.verify(args), args.jobs):
         valid = valid and new_valid
+    _log_commands()
 
     if not valid:
         raise SNACError("SNAC mode is not configured correctly.", Errors.EX_CHECK_FAILURE)
@@ -129,11 +210,71 @@ def _parse_args(argv: List[str]) -> argparse.Namespace:
         type=str,
         help="Email address for audit actions",
     )
+    configure_parser.add_argument(
+        "--force-update",
+        action="store_true",
+        help="Always refresh the package feed indexes, even if they are up to date",
+    )
+    configure_parser.add_argument(
+        "--update-max-age",
+        type=int,
+        default=OPKG_UPDATE_MAX_AGE,
+        metavar="SECONDS",
+        help=f"Refresh package feed indexes older than this (default: {OPKG_UPDATE_MAX_AGE})",
+    )
+    configure_parser.add_argument(
+        "--prefetch-jobs",
+        type=int,
+        default=PREFETCH_JOBS,
+        metavar="N",
+        help=f"Number of concurrent package downloads (default: {PREFETCH_JOBS})",
+    )
+    configure_parser.add_argument(
+        "--bundle",
+        type=Path,
+        metavar="PATH",
+        help="Install packages from an offline bundle created by 'nilrt-snac bundle'",
+    )
+    configure_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of modules to configure concurrently (default: 1)",
+    )
     configure_parser.set_defaults(func=_configure)
 
     verify_parser = subparsers.add_parser("verify", help="Verify SNAC mode configured correctly")
+    verify_parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="Number of modules to verify concurrently (default: 1)",
+    )
     verify_parser.set_defaults(func=_verify)
 
+    bundle_parser = subparsers.add_parser(
+        "bundle", help="Create an offline package bundle for 'configure --bundle'"
+    )
+    bundle_parser.add_argument(
+        "-o",
+        "--output",
+        type=Path,
+        default=Path("nilrt-snac-bundle.tar"),
+        help="Path of the bundle to write (default: nilrt-snac-bundle.tar)",
+    )
+    bundle_parser.add_argument(
+        "--prefetch-jobs",
+        type=int,
+        default=PREFETCH_JOBS,
+        metavar="N",
+        help=f"Number of concurrent package downloads (default: {PREFETCH_JOBS})",
+    )
+    bundle_parser.set_defaults(func=_bundle)
+
     debug_group = parser.add_argument_group("Debug")
     debug_group.add_argument(
         "-v",
@@ -178,18 +319,25 @@ def main(  # noqa: D103 - Missing docstring in public function (auto-generated n
 
     logger.debug("Arguments: %s", args)
     opkg_helper.set_dry_run(args.dry_run)
+    nirtcfg.set_dry_run(args.dry_run)
+    executor.set_dry_run(args.dry_run)
 
     if args.version:
         print(VERSION_DESCRIPTION)
         return Errors.EX_OK
 
     if args.cmd is None:
-        logger.error("Command required: {configure, verify}, see --help for more information.")
+        logger.error(
+            "Command required: {configure, verify, bundle}, see --help for more information."
+        )
         return Errors.EX_USAGE
 
     try:
+        executor.clear()
         if not args.dry_run:
-            verify_prereqs()
+            verify_prereqs(args.cmd)
+        config_files.clear()
+        restarts.clear()
         ret_val = args.func(args)
     except SNACError as e:
         logger.error(e)
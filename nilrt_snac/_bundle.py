@@ -0,0 +1,215 @@
+"""Offline SNAC bundles: the IPKs `configure` installs, together with a prebuilt feed index.
+
+A bundle is a tar archive holding the dependency closure of every package the `_configs` modules
+install, a `Packages.gz` index of those IPKs, and a `SHA256SUMS` manifest of all the files.
+`configure --bundle` extracts it and adds it to opkg as a file:// feed, so that an air-gapped
+target never has to reach the network or build a feed index itself.
+"""
+
+import gzip
+import hashlib
+import io
+import os
+import pathlib
+import shutil
+import tarfile
+import tempfile
+from typing import Dict, List
+
+from nilrt_snac import Errors, SNAC_DATA_DIR, SNACError, logger
+from nilrt_snac._feeds import PREFETCH_JOBS, FeedIndex, fetch_packages
+from nilrt_snac.opkg import OpkgHelper, OpkgTransaction, _format_control, _parse_control
+
+BUNDLE_FEED = "nilrt-snac-bundle"
+BUNDLE_DIR = "/var/cache/nilrt-snac/bundle"
+BUNDLE_INDEX = "Packages.gz"
+BUNDLE_MANIFEST = "SHA256SUMS"
+# Where the other feeds' indexes are moved while a bundle is loaded; beside the lists directory,
+# so that the moves are renames on one filesystem.
+LISTS_ASIDE = "lists.snac-aside"
+CONFLICTS_IPK = SNAC_DATA_DIR / "nilrt-snac-conflicts.ipk"
+
+
+def _sha256(path: pathlib.Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _read_ipk_control(path: pathlib.Path) -> Dict[str, str]:
+    """Read the control fields of an IPK, which is either an ar or a tar.gz archive."""
+    data = path.read_bytes()
+    control_tar = None
+    if data.startswith(b"!<arch>\n"):
+        offset = 8
+        while offset + 60 <= len(data):
+            header = data[offset : offset + 60]
+            name = header[:16].decode().strip().rstrip("/")
+            size = int(header[48:58].decode().strip())
+            if name == "control.tar.gz":
+                control_tar = data[offset + 60 : offset + 60 + size]
+                break
+            offset += 60 + size + (size % 2)
+    else:
+        with tarfile.open(fileobj=io.BytesIO(data)) as outer:
+            for member in outer.getmembers():
+                if os.path.normpath(member.name) == "control.tar.gz":
+                    control_tar = outer.extractfile(member).read()
+                    break
+
+    if control_tar is not None:
+        with tarfile.open(fileobj=io.BytesIO(control_tar)) as tar:
+            for member in tar.getmembers():
+                if os.path.normpath(member.name) == "control":
+                    text = tar.extractfile(member).read().decode()
+                    return next(_parse_control(text))
+    raise SNACError(f"No control file found in {path}", Errors.EX_ERROR)
+
+
+def create_bundle(
+    helper: OpkgHelper,
+    transaction: OpkgTransaction,
+    output: pathlib.Path,
+    jobs: int = PREFETCH_JOBS,
+) -> None:
+    """Write an offline bundle of every package a transaction installs.
+
+    The full dependency closure is included, regardless of what is installed on this system, so
+    that the bundle can be used on a freshly imaged target.
+    """
+    names: List[str] = []
+    local_ipks: List[pathlib.Path] = []
+    for op in transaction.installs:
+        if op.package.endswith(".ipk"):
+            local_ipks.append(pathlib.Path(op.package))
+        else:
+            names.append(op.package)
+    if CONFLICTS_IPK not in local_ipks:
+        local_ipks.append(CONFLICTS_IPK)
+
+    packages = FeedIndex.from_conf(helper.get_conf()).resolve(names)
+    logger.info(f"Bundling {len(packages) + len(local_ipks)} packages")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        staging = pathlib.Path(tmpdir)
+        stanzas: List[Dict[str, str]] = []
+
+        for package, path in zip(packages, fetch_packages(packages, staging, jobs)):
+            fields = dict(package.fields)
+            fields["Filename"] = path.name
+            stanzas.append(fields)
+
+        for ipk in local_ipks:
+            path = staging / ipk.name
+            shutil.copyfile(ipk, path)
+            fields = _read_ipk_control(path)
+            fields["Filename"] = path.name
+            fields["Size"] = str(path.stat().st_size)
+            fields["SHA256sum"] = _sha256(path)
+            stanzas.append(fields)
+
+        index = "\n".join(_format_control(fields) for fields in stanzas)
+        (staging / BUNDLE_INDEX).write_bytes(gzip.compress(index.encode(), mtime=0))
+
+        files = sorted(f["Filename"] for f in stanzas) + [BUNDLE_INDEX]
+        manifest = "".join(f"{_sha256(staging / name)}  {name}\n" for name in files)
+        (staging / BUNDLE_MANIFEST).write_text(manifest)
+
+        with tarfile.open(output, "w") as tar:
+            for name in files + [BUNDLE_MANIFEST]:
+                tar.add(staging / name, arcname=name)
+    logger.info(f"Wrote {output}")
+
+
+def _extract_bundle(archive: pathlib.Path, bundle_dir: pathlib.Path) -> None:
+    """Extract a bundle and check every file against its manifest."""
+    try:
+        with tarfile.open(archive) as tar:
+            members = tar.getmembers()
+            for member in members:
+                if not member.isfile() or "/" in member.name or member.name.startswith("."):
+                    raise SNACError(f"Unexpected entry in bundle: {member.name}", Errors.EX_USAGE)
+            tar.extractall(bundle_dir, members=members)
+    except (OSError, tarfile.TarError) as e:
+        raise SNACError(f"Failed to read bundle {archive}: {e}", Errors.EX_USAGE)
+
+    manifest = bundle_dir / BUNDLE_MANIFEST
+    if not manifest.exists():
+        raise SNACError(f"Bundle {archive} has no {BUNDLE_MANIFEST}", Errors.EX_USAGE)
+    for line in manifest.read_text().splitlines():
+        checksum, name = line.split(maxsplit=1)
+        path = bundle_dir / name
+        if not path.is_file() or _sha256(path) != checksum:
+            raise SNACError(f"Bundle file {name} does not match the manifest", Errors.EX_USAGE)
+
+
+def _hide_lists(lists_dir: pathlib.Path) -> None:
+    """Move every feed index but the bundle's out of the lists directory.
+
+    opkg resolves packages from every index in the lists directory, so a newer version in another
+    feed would otherwise be chosen over the bundle's and fail to download offline.
+    """
+    aside = lists_dir.parent / LISTS_ASIDE
+    aside.mkdir(exist_ok=True)
+    for entry in lists_dir.iterdir():
+        if entry.name != BUNDLE_FEED:
+            entry.rename(aside / entry.name)
+
+
+def _restore_lists(lists_dir: pathlib.Path) -> None:
+    """Move the feed indexes hidden by `_hide_lists` back into the lists directory."""
+    aside = lists_dir.parent / LISTS_ASIDE
+    if not aside.is_dir():
+        return
+    for entry in aside.iterdir():
+        entry.rename(lists_dir / entry.name)
+    aside.rmdir()
+
+
+def load_bundle(
+    helper: OpkgHelper, archive: pathlib.Path, bundle_dir: str = BUNDLE_DIR
+) -> None:
+    """Make the packages in a bundle available to opkg as a file:// feed.
+
+    The bundle's prebuilt index is installed into opkg's lists directory directly, and the helper
+    is switched to the bundle feed, so that neither `opkg update` nor a download ever runs. The
+    indexes of the other feeds are moved aside until `unload_bundle`, so that opkg installs only
+    what the bundle holds.
+    """
+    if helper.dry_run:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            _extract_bundle(archive, pathlib.Path(tmpdir))
+        logger.debug(f"dry-run: not adding {BUNDLE_FEED} feed")
+        helper.set_offline_feed(BUNDLE_FEED)
+        return
+
+    path = pathlib.Path(bundle_dir)
+    shutil.rmtree(path, ignore_errors=True)
+    path.mkdir(parents=True)
+    _extract_bundle(archive, path)
+
+    lists_dir = helper.get_conf().lists_dir
+    lists_dir.mkdir(parents=True, exist_ok=True)
+    # Put back anything left aside by a run which was interrupted before unloading its bundle.
+    _restore_lists(lists_dir)
+    _hide_lists(lists_dir)
+    (lists_dir / BUNDLE_FEED).write_bytes(gzip.decompress((path / BUNDLE_INDEX).read_bytes()))
+    (pathlib.Path(helper.conf_dir) / f"{BUNDLE_FEED}.conf").write_text(
+        "# NILRT SNAC offline package bundle. Do not hand-edit.\n"
+        f"src/gz {BUNDLE_FEED} file://{path}\n"
+    )
+    helper.set_offline_feed(BUNDLE_FEED)
+
+
+def unload_bundle(helper: OpkgHelper, bundle_dir: str = BUNDLE_DIR) -> None:
+    """Remove the bundle feed added by `load_bundle`, and restore the other feeds' indexes."""
+    helper.set_offline_feed(None)
+    if helper.dry_run:
+        return
+    lists_dir = helper.get_conf().lists_dir
+    (pathlib.Path(helper.conf_dir) / f"{BUNDLE_FEED}.conf").unlink(missing_ok=True)
+    (lists_dir / BUNDLE_FEED).unlink(missing_ok=True)
+    _restore_lists(lists_dir)
+    shutil.rmtree(bundle_dir, ignore_errors=True)
@@ -1,41 +1,105 @@
+import functools
 import grp
 import os
 import pathlib
+import pwd
 import stat
-import subprocess
+from typing import Dict, List, Optional, Union
 
+from nilrt_snac._executor import executor
 
-def _check_group_ownership(path: str, group: str) -> bool:
-    "Checks if the group ownership of a file or directory matches the specified group."
-    stat_info = os.stat(path)
-    gid = stat_info.st_gid
-    group_info = grp.getgrgid(gid)
+OS_RELEASE = pathlib.Path("/etc/os-release")
+PASSWD = pathlib.Path("/etc/passwd")
+GROUP = pathlib.Path("/etc/group")
 
-    return group_info.gr_name == group
 
-def _check_owner(path: str, owner: str) -> bool:
-    "Checks if the owner of a file or directory matches the specified owner."
-    stat_info = os.stat(path)
-    uid = stat_info.st_uid
-    owner_info = grp.getgrgid(uid)
-    return owner_info.gr_name == owner
+@functools.lru_cache(maxsize=None)
+def _read_ids(path: pathlib.Path) -> Dict[str, int]:
+    "Parses a passwd or group file into a name -> id map, once per path."
+    ids: Dict[str, int] = {}
+    try:
+        text = path.read_text()
+    except OSError:
+        return ids
+    for line in text.splitlines():
+        fields = line.split(":")
+        if len(fields) < 3 or line.startswith("#"):
+            continue
+        try:
+            # The first entry for a name is the one the system uses.
+            ids.setdefault(fields[0], int(fields[2]))
+        except ValueError:
+            continue
+    return ids
+
+def user_id(name: str) -> Optional[int]:
+    "Returns the ID of a user, or None if there is no such user."
+    uid = _read_ids(PASSWD).get(name)
+    if uid is None:
+        # Users which aren't in /etc/passwd (e.g. from another NSS source).
+        try:
+            uid = pwd.getpwnam(name).pw_uid
+        except KeyError:
+            pass
+    return uid
+
+def group_id(name: str) -> Optional[int]:
+    "Returns the ID of a group, or None if there is no such group."
+    gid = _read_ids(GROUP).get(name)
+    if gid is None:
+        try:
+            gid = grp.getgrnam(name).gr_gid
+        except KeyError:
+            pass
+    return gid
+
+def check_metadata(
+    path: Union[pathlib.Path, str],
+    owner: Optional[str] = None,
+    group: Optional[str] = None,
+    mode: Optional[int] = None,
+    nonempty: bool = False,
+) -> List[str]:
+    """Compares the owner, group and permissions of a file or directory against the given ones.
 
-def _check_permissions(path: str, expected_mode: int) -> bool:
-    "Checks if the permissions of a file or directory match the expected mode."
-    stat_info = os.stat(path)
-    return stat.S_IMODE(stat_info.st_mode) == expected_mode
+    The path is stat'ed once, and every mismatch is reported. If `nonempty`, an empty file is
+    reported too.
+
+    Returns: A description of each mismatch, in the style of verify's log messages.
+    """
+    try:
+        stat_info = os.stat(path)
+    except FileNotFoundError:
+        return [f"MISSING: {path} not found"]
+    problems = []
+    if owner is not None and user_id(owner) != stat_info.st_uid:
+        problems.append(f"ERROR: {path} is not owned by '{owner}'.")
+    if group is not None and group_id(group) != stat_info.st_gid:
+        problems.append(f"ERROR: {path} is not owned by the '{group}' group.")
+    if mode is not None and stat.S_IMODE(stat_info.st_mode) != mode:
+        problems.append(f"ERROR: {path} does not have {mode:o} permissions.")
+    if nonempty and stat_info.st_size == 0:
+        problems.append(f"ERROR: {path} is empty.")
+    return problems
 
 def _cmd(*args: str):
     "Syntactic sugar for running shell commands."
-    subprocess.run(args, check=True)
+    executor.run(args)
 
-def get_distro():
+@functools.lru_cache(maxsize=None)
+def read_os_release(path: pathlib.Path = OS_RELEASE) -> Dict[str, str]:
+    "Parses os-release into its fields, once per path; it doesn't change while SNAC runs."
+    fields: Dict[str, str] = {}
     try:
-        os_release = pathlib.Path("/etc/os-release")
-        if os_release.exists():
-            with open(os_release, "r") as f:
-                for line in f:
-                    if line.startswith("ID="):
-                        return line.split("=")[1].strip()
-    except NameError:
-        return None
+        text = path.read_text()
+    except OSError:
+        return fields
+    for line in text.splitlines():
+        key, separator, value = line.partition("=")
+        if separator and not key.lstrip().startswith("#"):
+            fields[key.strip()] = value.strip().strip("\"'")
+    return fields
+
+def get_distro() -> Optional[str]:
+    "Returns the ID of the running distribution (e.g. nilrt), or None if it is unknown."
+    return read_os_release().get("ID")
@@ -8,9 +8,10 @@ from typing import List
 
 from nilrt_snac import logger
 from nilrt_snac._configs._base_config import _BaseConfig
-from nilrt_snac._common import _check_group_ownership, _check_owner, _check_permissions, _cmd
+from nilrt_snac._common import _cmd, check_metadata
 from nilrt_snac._configs._config_file import EqualsDelimitedConfigFile, _ConfigFile
 from nilrt_snac.opkg import opkg_helper
+from nilrt_snac._services import restarts
 
 
 def ensure_groups_exist(groups: List[str]) -> None:
@@ -75,19 +76,29 @@ def is_valid_email(email: str) -> bool:
 
 class _AuditdConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("auditd")
+        super().__init__(
+            "auditd",
+            depends=["packages"],
+            resources=["/etc/audit", "/etc/group", "update-rc.d", "auditd"],
+        )
         self._opkg_helper = opkg_helper
         self.log_path = os.path.realpath("/var/log")
         self.audit_config_path = "/etc/audit/auditd.conf"
 
+    def declare_packages(self, opkg) -> None:
+        opkg.install("auditd")
+        # The email alert packages are declared before the audit email address is known (and
+        # bundled for targets whose address isn't known at all), so they are always installed,
+        # even in the rare case that configure ends up without a valid address.
+        # Install recommended SMTP package dependency
+        opkg.install("perl-module-net-smtp")
+        # Install auditd plugin package to allow for watch scripts to be used
+        opkg.install("audispd-plugins")
+
     def configure(self, args: argparse.Namespace) -> None:
         print("Configuring auditd...")
         dry_run: bool = args.dry_run
 
-        # Check if auditd is already installed
-        if not self._opkg_helper.is_installed("auditd"):
-            self._opkg_helper.install("auditd")
-
         # Ensure proper groups exist
         groups_required = ["adm", "sudo"]
         ensure_groups_exist(groups_required)
@@ -105,18 +116,10 @@ class _AuditdConfig(_BaseConfig):
             # Use local default e-mail
             audit_email = f"root@{socket.gethostname()}"
 
+        # What changed, i.e. why auditd needs a restart.
+        changes = []
         if is_valid_email(audit_email):
-            auditd_config_file.update(
-                r"^action_mail_acct\s*=.*$", f"action_mail_acct = {audit_email}"
-            )
-
-            # Install recommended SMTP package dependency
-            if not self._opkg_helper.is_installed("perl-module-net-smtp"):
-                self._opkg_helper.install("perl-module-net-smtp")
-
-            # Install auditd plugin package to allow for watch scripts to be used
-            if not self._opkg_helper.is_installed("audispd-plugins"):
-                self._opkg_helper.install("audispd-plugins")
+            auditd_config_file.set("action_mail_acct", audit_email)
 
             # Create template audit rule script to send email alerts
             audit_rule_script_path = "/etc/audit/audit_email_alert.pl"
@@ -125,6 +128,7 @@ class _AuditdConfig(_BaseConfig):
 
                 with open(audit_rule_script_path, "w") as file:
                     file.write(audit_rule_script)
+                changes.append(f"{audit_rule_script_path} created")
 
                 # Set the appropriate permissions
                 _cmd("chmod", "700", audit_rule_script_path)
@@ -142,6 +146,7 @@ class _AuditdConfig(_BaseConfig):
 
                 with open(audit_email_conf_path, "w") as file:
                     file.write(audit_email_config)
+                changes.append(f"{audit_email_conf_path} created")
 
                 # Set the appropriate permissions
                 audit_email_file = _ConfigFile(audit_email_conf_path)
@@ -152,12 +157,15 @@ class _AuditdConfig(_BaseConfig):
         # Set the appropriate permissions to allow only root and the 'sudo' group to read/write
         auditd_config_file.chown("root", "sudo")
         auditd_config_file.chmod(0o660)
-        auditd_config_file.save(dry_run)
+        if auditd_config_file.save(dry_run):
+            changes.append(f"{auditd_config_file.path} changed")
 
         # Enable and start auditd service
         if not os.path.exists("/etc/rc2.d/S20auditd"):
             _cmd("update-rc.d", "auditd", "defaults")
-        _cmd("/etc/init.d/auditd", "restart")
+            changes.append("enabled at boot")
+        for change in changes:
+            restarts.request("auditd", change)
 
         # Set the appropriate permissions to allow only root and the 'adm' group to write/read
         init_log_permissions_path = "/etc/init.d/set_log_permissions.sh"
@@ -199,25 +207,15 @@ class _AuditdConfig(_BaseConfig):
                 logger.error("MISSING: expected action_mail_acct value")
 
             # Check group ownership and permissions of auditd.conf
-            if not _check_group_ownership(self.audit_config_path, "sudo"):
-                logger.error(f"ERROR: {self.audit_config_path} is not owned by the 'sudo' group.")
-                valid = False
-            if not _check_permissions(self.audit_config_path, 0o660):
-                logger.error(f"ERROR: {self.audit_config_path} does not have 660 permissions.")
-                valid = False
-            if not _check_owner(self.audit_config_path, "root"):
-                logger.error(f"ERROR: {self.audit_config_path} is not owned by 'root'.")
+            for problem in check_metadata(
+                self.audit_config_path, owner="root", group="sudo", mode=0o660
+            ):
+                logger.error(problem)
                 valid = False
 
         # Check group ownership and permissions of /var/log
-        if not _check_group_ownership(self.log_path, "adm"):
-            logger.error(f"ERROR: {self.log_path} is not owned by the 'adm' group.")
-            valid = False
-        if not _check_permissions(self.log_path, 0o770):
-            logger.error(f"ERROR: {self.log_path} does not have 770 permissions.")
-            valid = False
-        if not _check_owner(self.log_path, "root"):
-            logger.error(f"ERROR: {self.log_path} is not owned by 'root'.")
+        for problem in check_metadata(self.log_path, owner="root", group="adm", mode=0o770):
+            logger.error(problem)
             valid = False
 
         return valid
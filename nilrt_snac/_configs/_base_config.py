@@ -1,11 +1,20 @@
 import argparse
 from abc import ABC, abstractmethod
+from typing import Sequence, Union
+
+from nilrt_snac._configs._nirtcfg import Nirtcfg, NirtcfgTransaction
+from nilrt_snac.opkg import OpkgHelper, OpkgTransaction
 
 
 class _BaseConfig(ABC):
 
-    def __init__(self, name: str):
+    def __init__(self, name: str, depends: Sequence[str] = (), resources: Sequence[str] = ()):
         self.name = name
+        # Names of the modules which must be configured before this one.
+        self.depends = tuple(depends)
+        # What this module changes that no other module may change at the same time: file paths,
+        # services, and shared tools like "opkg" and "nirtcfg".
+        self.resources = tuple(resources)
 
     @abstractmethod
     def configure(self, args: argparse.Namespace) -> None:
@@ -14,3 +23,21 @@ class _BaseConfig(ABC):
     @abstractmethod
     def verify(self, args: argparse.Namespace) -> bool:
         raise NotImplementedError
+
+    def declare_packages(self, opkg: Union[OpkgHelper, OpkgTransaction]) -> None:
+        """Declare the packages this module installs or removes.
+
+        Args:
+            opkg: Either the OpkgHelper, to apply the changes immediately, or an OpkgTransaction
+                which collects them into a batched opkg run.
+        """
+        pass
+
+    def declare_settings(self, nirtcfg: Union[Nirtcfg, NirtcfgTransaction]) -> None:
+        """Declare the NI system settings (ni-rt.ini tokens) this module sets.
+
+        Args:
+            nirtcfg: Either the Nirtcfg helper, to apply the settings immediately, or a
+                NirtcfgTransaction which collects them into one write of the settings file.
+        """
+        pass
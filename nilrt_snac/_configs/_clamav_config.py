@@ -12,7 +12,7 @@ class _ClamAVConfig(_BaseConfig):
     """ClamAV configuration handler."""
 
     def __init__(self):
-        super().__init__("clamav")
+        super().__init__("clamav", depends=["packages"])
         self.clamd_config_path = "/etc/clamav/clamd.conf"
         self.freshclam_config_path = "/etc/clamav/freshclam.conf"
         self.virus_db_path = "/var/lib/clamav/"
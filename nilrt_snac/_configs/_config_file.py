@@ -1,15 +1,122 @@
 """Helper class to read/write and update configuration files."""
 
+import functools
 import grp
 import os
 import pathlib
 import pwd
 import re
-from typing import Union
+import stat
+import tempfile
+import threading
+from typing import Dict, Iterable, List, NamedTuple, Optional, Pattern, Union
 
 from nilrt_snac import logger
 
 
+class _FileSnapshot(NamedTuple):
+    """The content and metadata of a file, as read from disk."""
+
+    exists: bool
+    content: str
+    mode: int
+    uid: Optional[int]
+    gid: Optional[int]
+
+
+class _ConfigFileStore:
+    """Per-run cache of configuration files, so that each path is stat'ed and read only once.
+
+    Every `_ConfigFile` for a path starts from the same snapshot, while keeping its own edits.
+    The cache assumes the files only change through `_ConfigFile.save` (which updates them)
+    during a run, or are dropped with `forget` when a tool changes them, and is cleared at the
+    start of each run. It is safe to use from concurrently
+    running config modules.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty store."""
+        self._lock = threading.Lock()
+        self._snapshots: Dict[pathlib.Path, _FileSnapshot] = {}
+        self.files_written = 0
+        self.bytes_written = 0
+
+    def get(self, path: pathlib.Path) -> _FileSnapshot:
+        """Return the snapshot of a file, reading it if it isn't cached."""
+        with self._lock:
+            snapshot = self._snapshots.get(path)
+            if snapshot is None:
+                snapshot = self._snapshots[path] = self._read(path)
+            return snapshot
+
+    @staticmethod
+    def _read(path: pathlib.Path) -> _FileSnapshot:
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return _FileSnapshot(False, "", 0o600, None, None)
+        return _FileSnapshot(True, path.read_text(), st.st_mode, st.st_uid, st.st_gid)
+
+    def update(self, path: pathlib.Path, snapshot: _FileSnapshot) -> None:
+        """Replace the cached snapshot of a file which was just written."""
+        with self._lock:
+            self._snapshots[path] = snapshot
+
+    def forget(self, path: pathlib.Path) -> None:
+        """Drop a file which was changed other than through `_ConfigFile.save`."""
+        with self._lock:
+            self._snapshots.pop(path, None)
+
+    def record_write(self, size: int) -> None:
+        """Count a file written during this run."""
+        with self._lock:
+            self.files_written += 1
+            self.bytes_written += size
+
+    def clear(self) -> None:
+        """Drop all files from the cache, and reset the write counts."""
+        with self._lock:
+            self._snapshots.clear()
+            self.files_written = 0
+            self.bytes_written = 0
+
+
+config_files = _ConfigFileStore()
+
+# Files larger than this (in characters) are not logged in full when saved.
+DEBUG_CONTENT_LIMIT = 64 * 1024
+
+# Number of compiled patterns kept by `_compile`.
+PATTERN_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _compile(pattern: str, flags: int = 0) -> Pattern[str]:
+    """Compile a pattern, sharing the result across `_ConfigFile` instances."""
+    return re.compile(pattern, flags)
+
+
+def exact_line(key: str) -> str:
+    """Return a pattern matching a line which is exactly `key`, ignoring surrounding whitespace.
+
+    `contains(exact_line(key))` is the same as `contains_exact(key)`, so that exact-line checks
+    can be batched with other patterns in `_ConfigFile.match_all`.
+    """
+    return rf"(?m:^\s*{re.escape(key)}\s*$)"
+
+
+@functools.lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _combine(patterns: tuple) -> Optional[Pattern[str]]:
+    """Compile an alternation of `patterns`, with one named group (p0, p1, ...) per pattern.
+
+    Returns: None if the patterns can't be combined, e.g. because one sets global flags.
+    """
+    try:
+        return re.compile("|".join(f"(?P<p{i}>{pattern})" for i, pattern in enumerate(patterns)))
+    except re.error:
+        return None
+
+
 class _ConfigFile:
     """Helper class to read/write and update configuration files."""
 
@@ -22,22 +129,78 @@ class _ConfigFile:
             path = pathlib.Path(path)
 
         self.path = path
-        self._config = path.read_text() if path.exists() else ""
-        self._mode = path.stat().st_mode if path.exists() else 0o600
-        self._uid = path.stat().st_uid if path.exists() else None
-        self._gid = path.stat().st_gid if path.exists() else None
+        snapshot = config_files.get(path)
+        self._original = snapshot
+        self._exists = snapshot.exists
+        self._config = snapshot.content
+        self._mode = snapshot.mode
+        self._uid = snapshot.uid
+        self._gid = snapshot.gid
+
+    def save(self, dry_run: bool) -> bool:
+        """Save the configuration file, if it was changed.
+
+        The content is written to a temporary file in the same directory, synced, and renamed
+        over the original, so that the file is never seen half-written, even after a power loss.
+        A change to only the mode or ownership is applied in place.
+
+        Returns: True if the file was (or in a dry run, would have been) changed.
+        """
+        original = self._original
+        content_changed = not original.exists or self._config != original.content
+        mode_changed = stat.S_IMODE(self._mode) != stat.S_IMODE(original.mode)
+        owner_changed = self._uid is not None and (self._uid, self._gid) != (
+            original.uid,
+            original.gid,
+        )
+        if not (content_changed or mode_changed or owner_changed):
+            logger.debug(f"{self.path} unchanged")
+            return False
 
-    def save(self, dry_run: bool) -> None:
-        """Save the configuration file."""
         if dry_run:
             print("dry-run: Not saved")
+        elif content_changed:
+            self._write()
         else:
-            self.path.write_text(self._config)
-            self.path.chmod(self._mode)
-            if self._uid is not None and self._gid is not None:
+            if mode_changed:
+                self.path.chmod(self._mode)
+            if owner_changed:
                 os.chown(self.path, self._uid, self._gid)
-        logger.debug(f"Contents of {self.path}:")
-        logger.debug(self._config)
+        if not dry_run:
+            self._exists = True
+            self._original = _FileSnapshot(True, self._config, self._mode, self._uid, self._gid)
+            config_files.update(self.path, self._original)
+        if len(self._config) <= DEBUG_CONTENT_LIMIT:
+            logger.debug(f"Contents of {self.path}:")
+            logger.debug(self._config)
+        else:
+            logger.debug(f"Contents of {self.path}: {len(self._config)} characters, not shown")
+        return True
+
+    def _write(self) -> None:
+        data = self._config.encode()
+        # Replace the file a symlink points to, not the link itself.
+        target = pathlib.Path(os.path.realpath(self.path))
+        fd, tmp_name = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+                os.fchmod(f.fileno(), stat.S_IMODE(self._mode))
+                if self._uid is not None and self._gid is not None:
+                    os.fchown(f.fileno(), self._uid, self._gid)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_name, target)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+        # Make the rename itself durable.
+        dir_fd = os.open(target.parent, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        config_files.record_write(len(data))
 
     def update(self, key: str, value: str) -> None:
         """Update the configuration file with the given key and value.
@@ -48,7 +211,7 @@ class _ConfigFile:
 
         Uses the re.sub() method to replace the key with the value.
         """
-        self._config = re.sub(key, value, self._config, flags=re.MULTILINE)
+        self._config = _compile(key, re.MULTILINE).sub(value, self._config)
 
     def add(self, value: str) -> None:
         """Add the value string to the config file.
@@ -59,7 +222,7 @@ class _ConfigFile:
         self._config += value
 
     def exists(self) -> bool:
-        return self.path.exists()
+        return self._exists
 
     def chmod(self, mode: int) -> None:
         self._mode = mode
@@ -81,7 +244,7 @@ class _ConfigFile:
 
         Returns: True if the key is found, False otherwise.
         """
-        return bool(re.search(key, self._config))
+        return bool(_compile(key).search(self._config))
     
     def contains_exact(self, key: str) -> bool:
         """Check if the configuration file contains a line with the exact given key.
@@ -90,12 +253,85 @@ class _ConfigFile:
 
         Returns: True if the key is found, False otherwise.
         """
-      
-        exact_pattern = re.compile(rf'^\s*{re.escape(key)}\s*$', re.MULTILINE)
-        return bool(exact_pattern.search(self._config))
-    
- 
+        return self.contains(exact_line(key))
+
+    def match_all(self, patterns: Iterable[str]) -> Dict[str, bool]:
+        """Check which of several patterns the configuration file contains.
+
+        The patterns are searched for in a single pass over the file, which stops as soon as all
+        of them have been found. Use `exact_line` for `contains_exact` checks.
+
+        Args: patterns: RE patterns, as for `contains`.
+
+        Returns: For each pattern, True if it is found, False otherwise.
+        """
+        found = {pattern: False for pattern in patterns}
+        # Capture groups would be renumbered (breaking backreferences), so those patterns are
+        # searched for on their own.
+        combinable = tuple(pattern for pattern in found if _compile(pattern).groups == 0)
+        combined = _combine(combinable) if len(combinable) > 1 else None
+        if combined is not None:
+            remaining = set(combinable)
+            for match in combined.finditer(self._config):
+                pattern = combinable[int(match.lastgroup[1:])]
+                found[pattern] = True
+                remaining.discard(pattern)
+                if not remaining:
+                    break
+        # Matches of the combined pattern don't overlap, so a pattern which wasn't found may just
+        # have been shadowed by another one.
+        for pattern, is_found in found.items():
+            if not is_found:
+                found[pattern] = self.contains(pattern)
+        return found
+
+
 class EqualsDelimitedConfigFile(_ConfigFile):
+    """A configuration file of `key = value` lines, such as auditd.conf.
+
+    The file is split into lines once, with an index from each key to the lines which set it, so
+    that lookups don't rescan the file. `set` and `delete` only change the lines of their key;
+    comments, spacing, and the order of the other lines are kept, and an unchanged file is saved
+    back exactly as it was read.
+    """
+
+    # The text of the file, or None if it must be rebuilt from the (edited) lines.
+    _text: Optional[str]
+    # The lines of the file, with deleted lines set to None; None if not parsed yet.
+    _lines: Optional[List[Optional[str]]]
+    # Line numbers of each key, in file order; None if not parsed yet.
+    _index: Optional[Dict[str, List[int]]]
+
+    @property
+    def _config(self) -> str:
+        if self._text is None:
+            self._text = "".join(line for line in self._lines if line is not None)
+        return self._text
+
+    @_config.setter
+    def _config(self, text: str) -> None:
+        # Edits through the _ConfigFile methods replace the whole text, and invalidate the index.
+        self._text = text
+        self._lines = None
+        self._index = None
+
+    @staticmethod
+    def _key(line: str) -> Optional[str]:
+        parts = line.split("=", 1)
+        if len(parts) > 1:
+            return parts[0].replace(" ", "").replace("\t", "")
+        return None
+
+    def _parse(self) -> Dict[str, List[int]]:
+        if self._index is None:
+            self._lines = self._text.splitlines(keepends=True)
+            self._index = {}
+            for i, line in enumerate(self._lines):
+                key = self._key(line)
+                if key is not None:
+                    self._index.setdefault(key, []).append(i)
+        return self._index
+
     def get(self, key: str) -> str:
         """
         Return the value for the first line where the left side of '=' matches the key (ignoring whitespace).
@@ -106,8 +342,62 @@ class EqualsDelimitedConfigFile(_ConfigFile):
         Returns:
             The value (right side of equals) for the first matching line, or an empty string if not found.
         """
-        for line in self._config.splitlines():
-            parts = line.split("=", 1)
-            if len(parts) > 1 and parts[0].replace(" ","").replace("\t","") == key:
-                return parts[1].strip()
-        return ""
+        lines = self._parse().get(key)
+        if not lines:
+            return ""
+        return self._lines[lines[0]].split("=", 1)[1].strip()
+
+    def set(self, key: str, value: str) -> None:
+        """Set the value of a key.
+
+        The first line for the key is changed in place, keeping its spacing around the '=', and any
+        later lines for the same key are removed. A missing key is appended to the file.
+
+        Args:
+            key: The key to set (left side of equals).
+            value: The new value.
+        """
+        index = self._parse()
+        lines = index.get(key)
+        if lines:
+            line = self._lines[lines[0]]
+            name, rest = line.split("=", 1)
+            spacing = rest[: len(rest) - len(rest.lstrip(" \t"))]
+            ending = line[len(line.rstrip("\r\n")) :]
+            new_line = f"{name}={spacing}{value}{ending}"
+            if new_line == line and len(lines) == 1:
+                return
+            self._lines[lines[0]] = new_line
+            for i in lines[1:]:
+                self._lines[i] = None
+            del lines[1:]
+        else:
+            new_line = f"{key}{self._separator()}{value}\n"
+            last = next((line for line in reversed(self._lines) if line is not None), "\n")
+            if not last.endswith("\n"):
+                self._lines.append("\n")
+            index[key] = [len(self._lines)]
+            self._lines.append(new_line)
+        self._text = None
+
+    def delete(self, key: str) -> bool:
+        """Remove every line for a key.
+
+        Args: key: The key to remove (left side of equals).
+
+        Returns: True if the key was found, False otherwise.
+        """
+        lines = self._parse().pop(key, None)
+        if not lines:
+            return False
+        for i in lines:
+            self._lines[i] = None
+        self._text = None
+        return True
+
+    def _separator(self) -> str:
+        """Return the '=' and surrounding spacing used by the file's first key, for new lines."""
+        for lines in self._index.values():
+            name, rest = self._lines[lines[0]].split("=", 1)
+            return name[len(name.rstrip()) :] + "=" + rest[: len(rest) - len(rest.lstrip(" \t"))]
+        return " = "
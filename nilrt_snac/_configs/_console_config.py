@@ -1,7 +1,7 @@
 import argparse
-import subprocess
 
 from nilrt_snac._configs._base_config import _BaseConfig
+from nilrt_snac._configs._nirtcfg import nirtcfg
 from nilrt_snac.opkg import opkg_helper as opkg
 
 from nilrt_snac import logger
@@ -9,29 +9,23 @@ from nilrt_snac import logger
 
 class _ConsoleConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("console")
+        super().__init__("console", depends=["packages", "settings"])
 
-    def configure(self, args: argparse.Namespace) -> None:
-        print("Deconfiguring console access...")
+    def declare_packages(self, opkg) -> None:
+        opkg.remove("sysconfig-settings-console", force_depends=True)
 
-        if not args.dry_run:
-            logger.debug("Disabling console access...")
-            subprocess.run(
-                ["nirtcfg", "--set", "section=systemsettings,token=consoleout.enabled,value=False"],
-                check=True,
-            )
+    def declare_settings(self, nirtcfg) -> None:
+        nirtcfg.set("systemsettings", "consoleout.enabled", "False")
 
-        opkg.remove("sysconfig-settings-console", force_depends=True)
+    def configure(self, args: argparse.Namespace) -> None:
+        print("Deconfiguring console access...")
+        # The packages and settings are applied by the "packages" and "settings" modules, with
+        # those of the other modules.
 
     def verify(self, args: argparse.Namespace) -> bool:
         print("Verifying console access configuration...")
         valid = True
-        result = subprocess.run(
-            ["nirtcfg", "--get", "section=systemsettings,token=consoleout.enabled"],
-            check=True,
-            stdout=subprocess.PIPE,
-        )
-        if result.stdout.decode().strip() != "False":
+        if nirtcfg.get("systemsettings", "consoleout.enabled") != "False":
             valid = False
             logger.error("FOUND: console access not diabled")
         if opkg.is_installed("sysconfig-settings-console"):
@@ -8,14 +8,15 @@ from nilrt_snac.opkg import opkg_helper
 
 class _CryptSetupConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("cryptsetup")
+        super().__init__("cryptsetup", depends=["packages"])
         self._opkg_helper = opkg_helper
 
+    def declare_packages(self, opkg) -> None:
+        opkg.install("cryptsetup")
+
     def configure(self, args: argparse.Namespace) -> None:
         print("Configuring cryptsetup...")
 
-        self._opkg_helper.install("cryptsetup")
-
     def verify(self, args: argparse.Namespace) -> bool:
         print("Verifying cryptsetup configuration...")
         valid = True
@@ -8,12 +8,14 @@ from nilrt_snac.opkg import opkg_helper
 
 class _FaillockConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("faillock")
+        super().__init__("faillock", depends=["packages"])
         self._opkg_helper = opkg_helper
 
+    def declare_packages(self, opkg) -> None:
+        opkg.install("pam-plugin-faillock")
+
     def configure(self, args: argparse.Namespace) -> None:
         print("Configuring PAM faillock...")
-        self._opkg_helper.install("pam-plugin-faillock")
 
     def verify(self, args: argparse.Namespace) -> bool:
         print("Verifying PAM faillock...")
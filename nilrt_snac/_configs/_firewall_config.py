@@ -2,181 +2,179 @@ import argparse
 import subprocess
 
 from nilrt_snac._configs._base_config import _BaseConfig
-
-from nilrt_snac import logger
+from nilrt_snac._firewalld import (
+    FirewallPolicy,
+    FirewallService,
+    FirewallSpec,
+    FirewallZone,
+    diff_config,
+    global_state,
+    load_config,
+    load_runtime,
+    runtime_delta,
+    undefined_references,
+    write_policies,
+    write_zones,
+)
+
+from nilrt_snac import SNACError, logger
+from nilrt_snac._executor import executor
 from nilrt_snac.opkg import opkg_helper
 
+_ICMP = frozenset({"icmp", "ipv6-icmp"})
+
+SNAC_ZONES = [
+    FirewallZone("work", interfaces=frozenset({"wglv0"})),
+    FirewallZone("public"),
+]
+
+# NI services, which are only reachable over the work zone (i.e. through wireguard).
+_NI_SERVICES = frozenset(
+    {
+        "ni-labview-realtime",
+        "ni-labview-viserver",
+        "ni-logos-xt",
+        "ni-mxs",
+        "ni-rpc-server",
+        "ni-service-locator",
+    }
+)
+
+SNAC_POLICIES = [
+    FirewallPolicy(
+        "work-in",
+        ingress_zones=frozenset({"work"}),
+        egress_zones=frozenset({"HOST"}),
+        protocols=_ICMP,
+        services=frozenset({"ssh", "mdns"}) | _NI_SERVICES,
+        # Temporary port add; see x-niroco-static-port.ini
+        ports=frozenset({"55184/tcp"}),
+    ),
+    FirewallPolicy(
+        "work-out",
+        ingress_zones=frozenset({"HOST"}),
+        egress_zones=frozenset({"work"}),
+        target="REJECT",
+        protocols=_ICMP,
+        services=frozenset(
+            {"ssh", "http", "https", "syslog", "ni-logos-xt", "amqp", "salt-master"}
+        ),
+    ),
+    FirewallPolicy(
+        "public-in",
+        ingress_zones=frozenset({"public"}),
+        egress_zones=frozenset({"HOST"}),
+        protocols=_ICMP,
+        services=frozenset({"ssh", "wireguard"}),
+    ),
+    FirewallPolicy(
+        "public-out",
+        ingress_zones=frozenset({"HOST"}),
+        egress_zones=frozenset({"public"}),
+        target="REJECT",
+        protocols=_ICMP,
+        services=frozenset({"dhcp", "dhcpv6", "http", "https", "wireguard", "dns", "ntp"}),
+    ),
+]
+
+SNAC_FIREWALL = FirewallSpec(
+    policies=SNAC_POLICIES,
+    zones=SNAC_ZONES,
+    # Installed by ni-firewalld-servicedefs.
+    services=[FirewallService("ni-labview-realtime", ports=frozenset({"3079/tcp"}))],
+    forbidden_zone_services={"public": _NI_SERVICES},
+)
+
 
 def _cmd(*args: str):
     "Syntactic sugar for firewall-cmd -q."
-    subprocess.run(["firewall-cmd", "-q"] + list(args), check=True)
+    executor.run(["firewall-cmd", "-q"] + list(args))
 
 
 def _offlinecmd(*args: str):
     "Syntactic sugar for firewall-offline-cmd -q."
-    subprocess.run(["firewall-offline-cmd", "-q"] + list(args), check=True)
-
-
-def _check_target(policy: str, expected: str = "REJECT") -> bool:
-    "Verifies firewall-cmd --policy=POLICY --get-target matches what is expected."
-
-    actual: str = subprocess.getoutput(f"firewall-cmd --permanent --policy={policy} --get-target")
-    if expected == actual:
-        return True
-    logger.error(f"ERROR: policy {policy} target: expected {expected}, observed {actual}")
-    return False
-
-
-def _check_service(Q: str, service: str, expected: str = "yes") -> bool:
-    """Verifies firewall-cmd (--policy=POLICY/--zone=ZONE/etc.) --query-service=SERVICE
-    matches what is expected.
-    """
-
-    actual: str = subprocess.getoutput(f"firewall-cmd --permanent {Q} --query-service={service}")
-    if expected == actual:
-        return True
-    logger.error(f"ERROR: {Q} service {service}: expected {expected}, observed {actual}")
-    return False
-
-
-def _check_service_info(service: str, Q: str, expected: str) -> bool:
-    """Verifies firewall-cmd --service=SERVICE (--get-ports/--get-description/etc.)
-    matches what is expected.
-    """
-
-    actual: str = subprocess.getoutput(f"firewall-cmd --permanent --service={service} {Q}")
-    if expected == actual:
-        return True
-    logger.error(f"ERROR: service {service} {Q}: expected {expected}, observed {actual}")
-    return False
+    executor.run(["firewall-offline-cmd", "-q"] + list(args))
 
 
 class _FirewallConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("firewall")
+        super().__init__("firewall", depends=["packages", "wireguard"], resources=["firewalld"])
         self._opkg_helper = opkg_helper
 
+    def declare_packages(self, opkg) -> None:
+        # nftables installed via deps
+        opkg.install("firewalld")
+        opkg.install("firewalld-offline-cmd")
+        opkg.install("firewalld-log-rotate")
+        opkg.install("ni-firewalld-servicedefs")
+
     def configure(self, args: argparse.Namespace) -> None:
         print("Configuring firewall...")
         dry_run: bool = args.dry_run
         if dry_run:
             return
 
-        # nftables installed via deps
-        self._opkg_helper.install("firewalld")
-        self._opkg_helper.install("firewalld-offline-cmd")
-        self._opkg_helper.install("firewalld-log-rotate")
-        self._opkg_helper.install("ni-firewalld-servicedefs")
-
+        # Start over from the defaults, then write the SNAC zones and policies in one pass.
+        before = global_state()
         _offlinecmd("--reset-to-defaults")
+        write_zones(SNAC_FIREWALL.zones)
+        write_policies(SNAC_FIREWALL.policies)
+
+        self._apply_runtime(reload=global_state() != before)
+
+    def _apply_runtime(self, reload: bool) -> None:
+        """Bring the running firewall in line with the permanent configuration.
+
+        Only the difference is applied, so that traffic is not interrupted by rebuilding the whole
+        ruleset. A full reload is the fallback for changes that can't be made at runtime.
+        """
+        delta = None
+        if not reload:
+            try:
+                delta = runtime_delta(load_config(), load_runtime())
+            except SNACError as e:
+                logger.debug(e)
+        if delta is None:
+            logger.debug("Reloading firewalld")
+            _cmd("--reload")
+            return
 
-        _offlinecmd("--zone=work", "--add-interface=wglv0")
-        _offlinecmd("--zone=work", "--remove-forward")
-        _offlinecmd("--zone=public", "--remove-forward")
-
-        _offlinecmd("--new-policy=work-in")
-        _offlinecmd("--policy=work-in", "--add-ingress-zone=work")
-        _offlinecmd("--policy=work-in", "--add-egress-zone=HOST")
-        _offlinecmd("--policy=work-in", "--add-protocol=icmp")
-        _offlinecmd("--policy=work-in", "--add-protocol=ipv6-icmp")
-        _offlinecmd(
-            "--policy=work-in",
-            "--add-service=ssh",
-            "--add-service=mdns",
-        )
-
-        _offlinecmd("--new-policy=work-out")
-        _offlinecmd("--policy=work-out", "--add-ingress-zone=HOST")
-        _offlinecmd("--policy=work-out", "--add-egress-zone=work")
-        _offlinecmd("--policy=work-out", "--add-protocol=icmp")
-        _offlinecmd("--policy=work-out", "--add-protocol=ipv6-icmp")
-        _offlinecmd(
-            "--policy=work-out",
-            "--add-service=ssh",
-            "--add-service=http",
-            "--add-service=https",
-            "--add-service=syslog",
-            "--add-service=ni-logos-xt",
-        )
-        _offlinecmd("--policy=work-out", "--set-target=REJECT")
-
-        _offlinecmd("--new-policy=public-in")
-        _offlinecmd("--policy=public-in", "--add-ingress-zone=public")
-        _offlinecmd("--policy=public-in", "--add-egress-zone=HOST")
-        _offlinecmd("--policy=public-in", "--add-protocol=icmp")
-        _offlinecmd("--policy=public-in", "--add-protocol=ipv6-icmp")
-        _offlinecmd(
-            "--policy=public-in",
-            "--add-service=ssh",
-            "--add-service=wireguard",
-        )
-
-        _offlinecmd("--new-policy=public-out")
-        _offlinecmd("--policy=public-out", "--add-ingress-zone=HOST")
-        _offlinecmd("--policy=public-out", "--add-egress-zone=public")
-        _offlinecmd("--policy=public-out", "--add-protocol=icmp")
-        _offlinecmd("--policy=public-out", "--add-protocol=ipv6-icmp")
-        _offlinecmd(
-            "--policy=public-out",
-            "--add-service=dhcp",
-            "--add-service=dhcpv6",
-            "--add-service=http",
-            "--add-service=https",
-            "--add-service=wireguard",
-            "--add-service=dns",
-            "--add-service=ntp",
-        )
-        _offlinecmd("--policy=public-out", "--set-target=REJECT")
-
-        _offlinecmd(
-            "--policy=work-in",
-            "--add-service=ni-labview-realtime",
-            "--add-service=ni-labview-viserver",
-            "--add-service=ni-logos-xt",
-            "--add-service=ni-mxs",
-            "--add-service=ni-rpc-server",
-            "--add-service=ni-service-locator",
-        )
-        _offlinecmd(
-            "--policy=work-in",
-            # Temporary port add; see x-niroco-static-port.ini
-            "--add-port=55184/tcp",
-        )
-        _offlinecmd(
-            "--policy=work-out",
-            "--add-service=amqp",
-            "--add-service=salt-master",
-        )
-
-        _cmd("--reload")
+        try:
+            for args in delta:
+                logger.debug(f"Applying runtime firewall change: {' '.join(args)}")
+                _cmd(*args)
+        except (OSError, SNACError, subprocess.CalledProcessError) as e:
+            logger.warning(
+                f"Could not apply the firewall changes at runtime ({e}); reloading firewalld"
+            )
+            _cmd("--reload")
 
     def verify(self, args: argparse.Namespace) -> bool:
         print("Verifying firewall configuration...")
         valid: bool = True
 
         try:
-            pid: int = int(subprocess.getoutput("pidof -x /usr/sbin/firewalld"))
+            result = executor.run(
+                ["pidof", "-x", "/usr/sbin/firewalld"],
+                check=False,
+                capture=True,
+                changes_system=False,
+            )
+            pid: int = int(result.stdout)
         except ValueError:
             logger.error(f"MISSING: running firewalld")
             valid = False
 
         try:
-            _cmd("--check-config")
-        except FileNotFoundError:
-            logger.error(f"MISSING: firewall-cmd")
-            valid = False
-
-        valid = all(
-            [
-                _check_target("work-in", "CONTINUE"),
-                _check_target("work-out"),
-                _check_target("public-in", "CONTINUE"),
-                _check_target("public-out"),
-                _check_service("--policy=work-in", "ni-labview-realtime"),
-                _check_service("--policy=public-in", "ni-labview-realtime", "no"),
-                _check_service("--zone=public", "ni-labview-realtime", "no"),
-                _check_service_info("ni-labview-realtime", "--get-ports", "3079/tcp"),
-            ]
-        )
+            config = load_config()
+        except SNACError as e:
+            logger.error(f"ERROR: {e}")
+            return False
+
+        # firewall-cmd --check-config would also reject the undefined references.
+        problems = undefined_references(config) + diff_config(config, SNAC_FIREWALL)
+        for problem in problems:
+            logger.error(problem)
+        valid = valid and not problems
 
         return valid
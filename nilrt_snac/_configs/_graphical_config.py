@@ -1,5 +1,4 @@
 from argparse import Namespace
-from subprocess import run
 
 from nilrt_snac._configs._base_config import _BaseConfig
 from nilrt_snac.opkg import opkg_helper as opkg
@@ -11,20 +10,20 @@ class _GraphicalConfig(_BaseConfig):
     """The graphical configuration for SNAC is to deconfigure the X11, embedded UI, and other components that are useful only when using the graphical UI."""
 
     def __init__(self):
-        super().__init__("graphical")
-
-    def configure(self, args: Namespace) -> None:
-        print("Deconfiguring the graphical UI...")
-        if not args.dry_run:
-            logger.debug("Disabling the embedded UI...")
-            run(
-                ["nirtcfg", "--set", "section=systemsettings,token=ui.enabled,value=False"],
-                check=True,
-            )
+        super().__init__("graphical", depends=["packages", "settings"])
 
+    def declare_packages(self, opkg) -> None:
         opkg.remove("packagegroup-ni-graphical", autoremove=True)
         opkg.remove("packagegroup-core-x11", autoremove=True)
 
+    def declare_settings(self, nirtcfg) -> None:
+        nirtcfg.set("systemsettings", "ui.enabled", "False")
+
+    def configure(self, args: Namespace) -> None:
+        print("Deconfiguring the graphical UI...")
+        # The packages and settings are applied by the "packages" and "settings" modules, with
+        # those of the other modules.
+
     def verify(self, args: Namespace) -> bool:
         print("Verifying Graphical configuration...")
         valid = True
@@ -1,28 +1,29 @@
 import argparse
-import subprocess
 
 from nilrt_snac._configs._base_config import _BaseConfig
 
 from nilrt_snac import logger, SNAC_DATA_DIR
+from nilrt_snac._executor import executor
 from nilrt_snac.opkg import opkg_helper
 
 
 class _NIAuthConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("niauth")
+        super().__init__("niauth", depends=["packages"], resources=["/etc/shadow"])
         self._opkg_helper = opkg_helper
 
+    def declare_packages(self, opkg) -> None:
+        opkg.remove("ni-auth", force_essential=True, force_depends=True)
+        opkg.remove("niacctbase-sudo")
+        opkg.install(str(SNAC_DATA_DIR / "nilrt-snac-conflicts.ipk"))
+
     def configure(self, args: argparse.Namespace) -> None:
         print("Removing NIAuth...")
         dry_run: bool = args.dry_run
-        self._opkg_helper.remove("ni-auth", force_essential=True, force_depends=True)
-        self._opkg_helper.remove("niacctbase-sudo")
-        if not self._opkg_helper.is_installed("nilrt-snac-conflicts"):
-            self._opkg_helper.install(str(SNAC_DATA_DIR / "nilrt-snac-conflicts.ipk"))
 
         if not dry_run:
             logger.debug("Removing root password")
-            subprocess.run(["passwd", "-d", "root"], check=True)
+            executor.run(["passwd", "-d", "root"])
 
     def verify(self, args: argparse.Namespace) -> bool:
         print("Verifying NIAuth...")
@@ -0,0 +1,213 @@
+"""Read and write the NI system settings file (ni-rt.ini) in-process, like `nirtcfg` does."""
+
+import pathlib
+import re
+import subprocess
+import threading
+from typing import Dict, List, Optional, Set, Tuple, Union
+
+from nilrt_snac._configs._config_file import _ConfigFile, config_files
+
+from nilrt_snac import logger
+from nilrt_snac._executor import executor
+
+NIRT_INI = pathlib.Path("/etc/natinst/share/ni-rt.ini")
+
+# Values which can be written between quotes as they are. Anything else is left to nirtcfg,
+# which knows how to escape it.
+_PLAIN_VALUE = re.compile(r'[^"\\\r\n]*')
+
+
+class _NirtIniFile(_ConfigFile):
+    """ni-rt.ini, parsed into sections and tokens.
+
+    Section and token names are case-insensitive, and the first line for a token is the one which
+    applies. Values are stored quoted, as `token = "value"`. Edits only touch the line of their
+    token, so that the rest of the file is kept as is.
+    """
+
+    def __init__(self, path: Union[pathlib.Path, str]) -> None:
+        """Initialize the _NirtIniFile object.
+
+        Args: path: The path to the INI file.
+        """
+        super().__init__(path)
+        self._parsed_from: Optional[str] = None
+        # Line number and raw value of each (section, token), by lowercase names.
+        self._tokens: Dict[Tuple[str, str], Tuple[int, str]] = {}
+        # Line number of the last line of each section (its header if it is empty).
+        self._sections: Dict[str, int] = {}
+
+    def _parse(self) -> None:
+        # Reparse whenever the text was edited.
+        if self._parsed_from is self._config:
+            return
+        self._tokens = {}
+        self._sections = {}
+        section = ""
+        for number, line in enumerate(self._config.splitlines()):
+            stripped = line.strip()
+            if not stripped or stripped[0] in ";#":
+                continue
+            if stripped.startswith("[") and stripped.endswith("]"):
+                section = stripped[1:-1].strip().lower()
+            else:
+                token, separator, value = line.partition("=")
+                if separator:
+                    key = (section, token.strip().lower())
+                    self._tokens.setdefault(key, (number, value.strip()))
+            self._sections[section] = number
+        self._parsed_from = self._config
+
+    def get(self, section: str, token: str) -> Optional[str]:
+        """Return the value of a token, without its quotes.
+
+        Returns: None if the token isn't set, or its value has escapes which only nirtcfg reads.
+        """
+        self._parse()
+        found = self._tokens.get((section.lower(), token.lower()))
+        if found is None:
+            return None
+        value = found[1]
+        if len(value) >= 2 and value[0] == value[-1] == '"':
+            value = value[1:-1]
+        return value if _PLAIN_VALUE.fullmatch(value) else None
+
+    def set(self, section: str, token: str, value: str) -> None:
+        """Set a plain value (see `_PLAIN_VALUE`) for a token, adding the section if needed."""
+        self._parse()
+        lines = self._config.splitlines(keepends=True)
+        found = self._tokens.get((section.lower(), token.lower()))
+        if found is not None:
+            number = found[0]
+            line = lines[number]
+            name, _, old_value = line.partition("=")
+            spacing = old_value[: len(old_value) - len(old_value.lstrip(" \t"))]
+            ending = line[len(line.rstrip("\r\n")) :]
+            lines[number] = f'{name}={spacing}"{value}"{ending}'
+        else:
+            new_line = f'{token} = "{value}"\n'
+            last = self._sections.get(section.lower())
+            if lines and not lines[-1].endswith("\n"):
+                lines[-1] += "\n"
+            if last is not None:
+                lines.insert(last + 1, new_line)
+            else:
+                if lines and lines[-1].strip():
+                    lines.append("\n")
+                lines.append(f"[{section}]\n")
+                lines.append(new_line)
+        self._config = "".join(lines)
+
+
+class NirtcfgTransaction:
+    """A set of NI system settings, written in one go by `Nirtcfg.commit`.
+
+    set() takes the same arguments as that of Nirtcfg, so that modules can declare their settings
+    against either.
+    """
+
+    def __init__(self) -> None:
+        """Initialize an empty transaction."""
+        # (section, token, value), by lowercase (section, token); the last value set wins.
+        self.settings: Dict[Tuple[str, str], Tuple[str, str, str]] = {}
+
+    def set(self, section: str, token: str, value: str) -> None:
+        """Plan to set a token."""
+        self.settings[(section.lower(), token.lower())] = (section, token, value)
+
+
+class Nirtcfg:
+    """Reads and writes NI system settings, as `nirtcfg --get` and `nirtcfg --set` do.
+
+    The settings file is read once per run (see `config_files`), and all the settings of a
+    transaction are written in one atomic rewrite, only if something changed. Tokens which are
+    missing from the file are added to it in-process too. The nirtcfg binary is only run to read
+    tokens which aren't in the file (nirtcfg knows their defaults) or have escaped values, and to
+    write values which need escaping, or any value if the file doesn't exist yet.
+    """
+
+    def __init__(self, path: Union[pathlib.Path, str] = NIRT_INI) -> None:
+        """Initialize the helper for the given settings file."""
+        self.path = pathlib.Path(path)
+        self._dry_run = False
+        self._lock = threading.Lock()
+        # Held for the whole of a commit, which can call get().
+        self._commit_lock = threading.Lock()
+        self._ini: Optional[_NirtIniFile] = None
+        # Lowercase (section, token) of the settings changed by this process.
+        self._changed: Set[Tuple[str, str]] = set()
+
+    def set_dry_run(self, dry_run: bool) -> None:
+        """If set, changes are only reported, not written."""
+        self._dry_run = dry_run
+
+    def _parsed(self) -> _NirtIniFile:
+        # Reuse the parsed file for as long as it is the current version.
+        if self._ini is None or config_files.get(self.path) is not self._ini._original:
+            self._ini = _NirtIniFile(self.path)
+        return self._ini
+
+    def changed(self, section: str, token: str) -> bool:
+        """Return True if a token was changed (or, in a dry run, would have been) by `commit`."""
+        return (section.lower(), token.lower()) in self._changed
+
+    def _run(self, *args: str) -> str:
+        result = executor.run(["nirtcfg", *args], capture=True, changes_system=args[0] == "--set")
+        return result.stdout.strip()
+
+    def get(self, section: str, token: str) -> str:
+        """Return the value of a token, as `nirtcfg --get` prints it."""
+        with self._lock:
+            value = self._parsed().get(section, token)
+        if value is None:
+            logger.debug(f"Reading {section}.{token} with nirtcfg")
+            return self._run("--get", f"section={section},token={token}")
+        return value
+
+    def set(self, section: str, token: str, value: str) -> None:
+        """Set a token, as `nirtcfg --set` does."""
+        transaction = NirtcfgTransaction()
+        transaction.set(section, token, value)
+        self.commit(transaction)
+
+    def _current(self, section: str, token: str) -> Optional[str]:
+        try:
+            return self.get(section, token)
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def commit(self, transaction: NirtcfgTransaction) -> None:
+        """Apply all the settings of a transaction, skipping those which are already set.
+
+        Commits from concurrently running modules are applied one at a time.
+        """
+        with self._commit_lock:
+            ini = _NirtIniFile(self.path)
+            fallback: List[Tuple[Tuple[str, str], str, str, str]] = []
+            for key, (section, token, value) in transaction.settings.items():
+                if ini.exists() and _PLAIN_VALUE.fullmatch(value):
+                    if ini.get(section, token) != value:
+                        ini.set(section, token, value)
+                        self._changed.add(key)
+                else:
+                    fallback.append((key, section, token, value))
+            if ini.exists():
+                ini.save(self._dry_run)
+
+            ran = False
+            for key, section, token, value in fallback:
+                if self._current(section, token) == value:
+                    continue
+                self._changed.add(key)
+                if self._dry_run:
+                    logger.debug(f"dry-run: Not setting {section}.{token} with nirtcfg")
+                    continue
+                self._run("--set", f"section={section},token={token},value={value}")
+                ran = True
+            if ran:
+                # nirtcfg rewrote the file, so the cached copy is stale.
+                config_files.forget(self.path)
+
+
+nirtcfg = Nirtcfg()
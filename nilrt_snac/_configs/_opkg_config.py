@@ -1,18 +1,18 @@
 import argparse
 import pathlib
-import subprocess
 import textwrap
 
 from nilrt_snac._configs._base_config import _BaseConfig
 from nilrt_snac._configs._config_file import _ConfigFile
 
 from nilrt_snac import logger
+from nilrt_snac._executor import executor
 from nilrt_snac.opkg import OPKG_SNAC_CONF, opkg_helper
 
 
 class _OPKGConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("opkg")
+        super().__init__("opkg", resources=["opkg"])
         self._opkg_helper = opkg_helper
 
     def configure(self, args: argparse.Namespace) -> None:
@@ -34,7 +34,7 @@ class _OPKGConfig(_BaseConfig):
         if pathlib.Path("/etc/opkg/NI-dist.conf").exists():
             logger.debug("Removing unsupported package feeds...")
             if not dry_run:
-                subprocess.run(["rm", "-fv", "/etc/opkg/NI-dist.conf"], check=True)
+                executor.run(["rm", "-fv", "/etc/opkg/NI-dist.conf"])
 
         snac_config_file.save(dry_run)
         self._opkg_helper.update()
@@ -0,0 +1,35 @@
+import argparse
+import shutil
+
+from nilrt_snac._configs._base_config import _BaseConfig
+from nilrt_snac._feeds import PREFETCH_DIR, prefetch
+
+from nilrt_snac.opkg import OpkgTransaction, opkg_helper
+
+
+class _PackagesConfig(_BaseConfig):
+    """Installs and removes the packages declared by all the other modules, in batched opkg runs.
+
+    This is not one of CONFIGS; `configure` schedules it after the opkg feeds are set up, and the
+    modules which need their packages depend on it by the name "packages".
+    """
+
+    def __init__(self, transaction: OpkgTransaction):
+        super().__init__("packages", depends=["opkg"], resources=["opkg"])
+        self._opkg_helper = opkg_helper
+        self._transaction = transaction
+
+    def configure(self, args: argparse.Namespace) -> None:
+        print("Configuring packages...")
+        # Everything to be installed is downloaded first, so that a network failure stops the
+        # run before any package is changed. opkg then installs the downloaded files, rather than
+        # fetching the packages again.
+        ipks = prefetch(self._opkg_helper, self._transaction, jobs=args.prefetch_jobs)
+        self._opkg_helper.commit(self._transaction, local_ipks=ipks)
+        # The downloads are kept if the install fails, to be reused by the next run.
+        if ipks:
+            shutil.rmtree(PREFETCH_DIR, ignore_errors=True)
+
+    def verify(self, args: argparse.Namespace) -> bool:
+        # The packages are verified by the modules which declare them.
+        return True
@@ -0,0 +1,229 @@
+"""Parsed model of PAM configuration files (/etc/pam.d)."""
+
+import pathlib
+import re
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+from nilrt_snac._configs._config_file import _ConfigFile, config_files
+
+# type, control (possibly a [value=action ...] list), module path, and arguments.
+_RULE = re.compile(r"^\s*(-?\w+)\s+(\[[^\]]*\]|\S+)\s+(\S+)[ \t]*(.*?)\s*$")
+_INCLUDE = re.compile(r"^\s*@include\s+(\S+)")
+# Arguments are separated by whitespace, except within brackets.
+_ARG = re.compile(r"\[[^\]]*\]|\S+")
+
+# PAM stops expanding @include at this depth, to break include loops.
+_MAX_INCLUDE_DEPTH = 16
+
+
+class PamRule(NamedTuple):
+    """One rule line of a PAM file."""
+
+    type: str
+    control: str
+    module: str
+    args: Tuple[str, ...]
+    # The file and line number (from 0) of the rule.
+    path: pathlib.Path
+    line: int
+
+
+class PamExpectation(NamedTuple):
+    """A rule which a PAM stack must have, for `PamConfigFile.check`."""
+
+    type: str
+    module: str
+    # The control, if it matters.
+    control: Optional[str] = None
+    # Arguments the rule must have; `key=value` arguments must have that value.
+    args: Tuple[str, ...] = ()
+    # A module which the rule must come before, in the stack of the same type.
+    before: Optional[str] = None
+
+
+def _arg_key(arg: str) -> str:
+    return arg.split("=", 1)[0]
+
+
+class PamConfigFile(_ConfigFile):
+    """A PAM configuration file, parsed into rules.
+
+    Rules are looked up by type and module, and edited in place, so that each edit is idempotent
+    and other lines (including comments) are kept as they are. The stack of a file, as PAM runs
+    it, also includes the rules of the files it `@include`s.
+    """
+
+    def __init__(self, path: Union[pathlib.Path, str]) -> None:
+        """Initialize the PamConfigFile object.
+
+        Args: path: The path to the PAM file.
+        """
+        super().__init__(path)
+        self._parsed_from: Optional[str] = None
+        self._rules: List[PamRule] = []
+
+    def rules(self) -> List[PamRule]:
+        """Return the rules of this file (without its includes), in order."""
+        # Reparse whenever the text was edited.
+        if self._parsed_from is not self._config:
+            self._rules = self._parse(self._config, self.path)
+            self._parsed_from = self._config
+        return self._rules
+
+    @staticmethod
+    def _parse(text: str, path: pathlib.Path) -> List[PamRule]:
+        rules = []
+        for number, line in enumerate(text.splitlines()):
+            if line.lstrip().startswith("#"):
+                continue
+            match = _RULE.match(line)
+            if match is not None:
+                type, control, module, args = match.groups()
+                rules.append(PamRule(type, control, module, tuple(_ARG.findall(args)), path, number))
+        return rules
+
+    def stack(self, type: Optional[str] = None) -> List[PamRule]:
+        """Return the rules which PAM runs for this file, with `@include`s expanded, in order.
+
+        Args: type: Only return the rules of this type (e.g. "password").
+        """
+        rules: List[PamRule] = []
+        self._expand(self._config, self.path, rules, 0)
+        if type is not None:
+            rules = [rule for rule in rules if rule.type.lstrip("-") == type]
+        return rules
+
+    def _expand(self, text: str, path: pathlib.Path, rules: List[PamRule], depth: int) -> None:
+        parsed = iter(self.rules() if path == self.path else self._parse(text, path))
+        rule = next(parsed, None)
+        for number, line in enumerate(text.splitlines()):
+            include = _INCLUDE.match(line)
+            if include is not None and depth < _MAX_INCLUDE_DEPTH:
+                included = self.path.parent / include.group(1)
+                self._expand(config_files.get(included).content, included, rules, depth + 1)
+            elif rule is not None and rule.line == number:
+                rules.append(rule)
+                rule = next(parsed, None)
+
+    def find(self, type: str, module: str) -> Optional[PamRule]:
+        """Return the first rule of this file with the given type and module, if any."""
+        for rule in self.rules():
+            if rule.type.lstrip("-") == type and rule.module == module:
+                return rule
+        return None
+
+    def _replace_rule(self, rule: PamRule, control: str, args: Sequence[str]) -> None:
+        lines = self._config.splitlines(keepends=True)
+        line = lines[rule.line]
+        match = _RULE.match(line)
+        ending = line[len(line.rstrip("\r\n")) :]
+        lines[rule.line] = (
+            line[: match.start(2)]
+            + control
+            + line[match.end(2) : match.end(3)]
+            + "".join(f" {arg}" for arg in args)
+            + ending
+        )
+        self._config = "".join(lines)
+
+    def ensure_arg(self, type: str, module: str, arg: str) -> bool:
+        """Make sure a rule has an argument.
+
+        A `key=value` argument replaces any other value of the same key.
+
+        Returns: False if there is no such rule in this file.
+        """
+        rule = self.find(type, module)
+        if rule is None:
+            return False
+        if arg not in rule.args:
+            key = _arg_key(arg)
+            args = [a for a in rule.args if "=" not in arg or _arg_key(a) != key]
+            self._replace_rule(rule, rule.control, args + [arg])
+        return True
+
+    def ensure_rule(
+        self,
+        type: str,
+        control: str,
+        module: str,
+        args: Sequence[str] = (),
+        before: Optional[str] = None,
+        comment: Optional[str] = None,
+    ) -> None:
+        """Make sure this file has a rule, with the given control and arguments.
+
+        Args:
+            type, control, module: The rule.
+            args: Arguments the rule must have (see `ensure_arg`); others are kept.
+            before: A module of the same type which the rule must come before. A new (or moved)
+                rule is put right before the first rule for it, or else after the last rule of
+                the same type, or else at the end of the file.
+            comment: A comment line to add above a new rule.
+        """
+        rule = self.find(type, module)
+        target = self.find(type, before) if before is not None else None
+        if rule is not None and (target is None or rule.line < target.line):
+            if rule.control != control:
+                self._replace_rule(rule, control, rule.args)
+            for arg in args:
+                self.ensure_arg(type, module, arg)
+            return
+
+        lines = self._config.splitlines(keepends=True)
+        new_args = list(args)
+        if rule is not None:
+            # Move the rule, keeping its other arguments.
+            keys = {_arg_key(arg) for arg in args if "=" in arg}
+            new_args = [a for a in rule.args if a not in args and _arg_key(a) not in keys] + new_args
+            del lines[rule.line]
+        new_lines = [f"# {comment}\n"] if comment else []
+        new_lines.append("\t".join([type, control, " ".join([module] + new_args)]) + "\n")
+
+        self._config = "".join(lines)
+        target = self.find(type, before) if before is not None else None
+        same_type = [r for r in self.rules() if r.type.lstrip("-") == type]
+        if target is not None:
+            position = target.line
+        elif same_type:
+            position = same_type[-1].line + 1
+        else:
+            position = len(lines)
+        if position == len(lines) and lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+        lines[position:position] = new_lines
+        self._config = "".join(lines)
+
+    def check(self, expectations: Sequence[PamExpectation]) -> List[str]:
+        """Compare the stack against the rules it must have.
+
+        The stack is read once, and each expectation is then checked against its first rule for
+        the type and module.
+
+        Returns: A description of each problem, in the style of verify's log messages.
+        """
+        first: Dict[Tuple[str, str], Tuple[int, PamRule]] = {}
+        for position, rule in enumerate(self.stack()):
+            first.setdefault((rule.type.lstrip("-"), rule.module), (position, rule))
+
+        problems = []
+        for expected in expectations:
+            found = first.get((expected.type, expected.module))
+            if found is None:
+                problems.append(f"MISSING: {expected.type} {expected.module} rule in {self.path}")
+                continue
+            position, rule = found
+            if expected.control is not None and rule.control != expected.control:
+                problems.append(
+                    f"MISSING: '{expected.control}' control for {expected.module} configuration"
+                )
+            for arg in expected.args:
+                if arg not in rule.args:
+                    problems.append(f"MISSING: '{arg}' for {expected.module} configuration")
+            if expected.before is not None:
+                other = first.get((expected.type, expected.before))
+                if other is not None and other[0] < position:
+                    problems.append(
+                        f"FOUND: {expected.module} after {expected.before} in {self.path}"
+                    )
+        return problems
@@ -1,53 +1,65 @@
 import argparse
-import textwrap
 
 from nilrt_snac._configs._base_config import _BaseConfig
 from nilrt_snac._configs._config_file import _ConfigFile
+from nilrt_snac._configs._pam_config_file import PamConfigFile, PamExpectation
 
 from nilrt_snac import logger
 from nilrt_snac.opkg import opkg_helper
 
+_PASSWORD_RULES = [
+    PamExpectation(
+        "password",
+        "pam_pwquality.so",
+        control="requisite",
+        args=("retry=3",),
+        before="pam_unix.so",
+    ),
+    PamExpectation("password", "pam_unix.so", args=("remember=5",)),
+]
+
 
 class _PWQualityConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("pwquality")
+        super().__init__(
+            "pwquality",
+            depends=["packages"],
+            resources=["/etc/pam.d/common-password", "/etc/security/opasswd"],
+        )
         self._opkg_helper = opkg_helper
 
+    def declare_packages(self, opkg) -> None:
+        opkg.install("libpwquality")
+
     def configure(self, args: argparse.Namespace) -> None:
         print("Configuring Password quality...")
         opasswd_file = _ConfigFile("/etc/security/opasswd")  # contains password history
-        config_file = _ConfigFile("/etc/pam.d/common-password")
+        config_file = PamConfigFile("/etc/pam.d/common-password")
         dry_run: bool = args.dry_run
-        self._opkg_helper.install("libpwquality")
 
         if not opasswd_file.exists():
             opasswd_file.save(dry_run)
-        if not config_file.contains("remember=5"):
-            config_file.update(r"(password.*pam_unix.so.*)", r"\1 remember=5")
-        if not config_file.contains("password.*requisite.*pam_pwquality.so.*retry=3"):
-            config_file.update(
-                r"(.*here are the per-package modules.*)",
-                textwrap.dedent(
-                    r"""
-                    # check for password complexity
-                    password	requisite	pam_pwquality.so retry=3
-                    \1"""
-                ),
-            )
+        config_file.ensure_rule(
+            "password",
+            "requisite",
+            "pam_pwquality.so",
+            ["retry=3"],
+            before="pam_unix.so",
+            comment="check for password complexity",
+        )
+        if not config_file.ensure_arg("password", "pam_unix.so", "remember=5"):
+            logger.warning(f"No pam_unix.so password rule in {config_file.path}")
 
         config_file.save(dry_run)
 
     def verify(self, args: argparse.Namespace) -> bool:
         print("Verifying Password quality...")
-        config_file = _ConfigFile("/etc/pam.d/common-password")
+        config_file = PamConfigFile("/etc/pam.d/common-password")
         valid = True
         if not self._opkg_helper.is_installed("libpwquality"):
             valid = False
             logger.error("MISSING: libpwquality not installed")
-        if not config_file.contains("remember=5"):
-            valid = False
-            logger.error("MISSING: 'remember=5' for pam_unix.so configuration")
-        if not config_file.contains("password.*requisite.*pam_pwquality.so.*retry=3"):
+        for problem in config_file.check(_PASSWORD_RULES):
             valid = False
-            logger.error("MISSING: entry to add quality check")
+            logger.error(problem)
         return valid
@@ -0,0 +1,26 @@
+import argparse
+
+from nilrt_snac._configs._base_config import _BaseConfig
+from nilrt_snac._configs._nirtcfg import NirtcfgTransaction, nirtcfg
+
+
+class _SettingsConfig(_BaseConfig):
+    """Applies the NI system settings declared by all the other modules, in one write.
+
+    This is not one of CONFIGS; `configure` schedules it after the packages are installed and
+    removed (as their scripts may change the settings), and the modules which need their settings
+    in place depend on it by the name "settings".
+    """
+
+    def __init__(self, transaction: NirtcfgTransaction):
+        super().__init__("settings", depends=["packages"], resources=["nirtcfg"])
+        self._nirtcfg = nirtcfg
+        self._transaction = transaction
+
+    def configure(self, args: argparse.Namespace) -> None:
+        print("Configuring system settings...")
+        self._nirtcfg.commit(self._transaction)
+
+    def verify(self, args: argparse.Namespace) -> bool:
+        # The settings are verified by the modules which declare them.
+        return True
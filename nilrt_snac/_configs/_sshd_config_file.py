@@ -0,0 +1,199 @@
+"""Parsed model of sshd_config, with Match scopes and Include expansion."""
+
+import functools
+import glob
+import pathlib
+import re
+import subprocess
+from typing import Dict, List, NamedTuple, Optional, Union
+
+from nilrt_snac._configs._config_file import _ConfigFile, config_files
+
+from nilrt_snac import SNACError, logger
+from nilrt_snac._executor import QUERY_TIMEOUT, executor
+
+SSHD = "/usr/sbin/sshd"
+
+# sshd refuses to nest Includes deeper than this.
+_MAX_INCLUDE_DEPTH = 16
+
+# A keyword and its arguments, separated by whitespace and/or a single '='.
+_DIRECTIVE = re.compile(r"\s*([^\s=]+)(?:\s*=\s*|\s+|$)(.*?)\s*$")
+
+
+class SshdDirective(NamedTuple):
+    """One keyword line of sshd_config, or of a file it includes."""
+
+    keyword: str
+    value: str
+    # The file and line number (from 0) of the directive.
+    path: pathlib.Path
+    line: int
+    # The criteria of the enclosing Match block, or None for the global scope.
+    match: Optional[str]
+    # The line of the main file which the directive comes from: its own, or that of the Include.
+    origin: int
+
+
+@functools.lru_cache(maxsize=None)
+def _sshd_test(path: str) -> Optional[Dict[str, str]]:
+    """Return sshd's effective global settings (`sshd -T`), by lowercase keyword.
+
+    The output is cached, as running sshd is slow; `SshdConfigFile.save` clears the cache.
+
+    Returns: None if sshd can't report its settings (e.g. it isn't installed or has no host keys).
+    """
+    try:
+        result = executor.run(
+            [SSHD, "-T", "-f", path], capture=True, timeout=QUERY_TIMEOUT, changes_system=False
+        )
+    except (OSError, SNACError, subprocess.CalledProcessError) as e:
+        logger.debug(f"Could not read the effective sshd configuration: {e}")
+        return None
+    settings: Dict[str, str] = {}
+    for line in result.stdout.splitlines():
+        keyword, _, value = line.partition(" ")
+        settings.setdefault(keyword, value)
+    return settings
+
+
+class SshdConfigFile(_ConfigFile):
+    """sshd_config, parsed into directives.
+
+    As with sshd, directives before the first Match line are global, Include lines are expanded in
+    place (relative paths are relative to the directory of the main file), and the first value
+    given for a keyword is the one which applies. Keywords are case-insensitive. Only the main file
+    is edited.
+    """
+
+    def __init__(self, path: Union[pathlib.Path, str] = "/etc/ssh/sshd_config") -> None:
+        """Initialize the SshdConfigFile object.
+
+        Args: path: The path to sshd_config.
+        """
+        super().__init__(path)
+        self._parsed_from: Optional[str] = None
+        self._directives: List[SshdDirective] = []
+        self._first_match: Optional[int] = None
+        self._last_global: Optional[int] = None
+
+    def _parse(self) -> List[SshdDirective]:
+        # Reparse whenever the text was edited.
+        if self._parsed_from is not self._config:
+            self._directives = []
+            self._first_match = None
+            self._last_global = None
+            self._parse_lines(self._config, self.path, None, None, 0)
+            self._parsed_from = self._config
+        return self._directives
+
+    def _parse_lines(
+        self,
+        text: str,
+        path: pathlib.Path,
+        match: Optional[str],
+        origin: Optional[int],
+        depth: int,
+    ) -> None:
+        for number, line in enumerate(text.splitlines()):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            directive = _DIRECTIVE.match(line)
+            if directive is None:
+                # sshd rejects such a line too; it can't be a setting this module looks for.
+                logger.warning(f"{path}:{number + 1}: Ignoring line without a keyword: {line}")
+                continue
+            keyword, value = directive.groups()
+            line_origin = number if origin is None else origin
+            if origin is None and match is None and keyword.lower() != "match":
+                self._last_global = number
+            if keyword.lower() == "match":
+                # A Match block lasts until the next Match line, or the end of the file.
+                match = value
+                if origin is None and self._first_match is None:
+                    self._first_match = number
+            elif keyword.lower() == "include":
+                if depth >= _MAX_INCLUDE_DEPTH:
+                    logger.warning(f"{path}: Include nested too deeply; ignoring {value}")
+                    continue
+                for pattern in value.split():
+                    for included in sorted(glob.glob(str(self.path.parent / pattern))):
+                        included_path = pathlib.Path(included)
+                        self._parse_lines(
+                            config_files.get(included_path).content,
+                            included_path,
+                            match,
+                            line_origin,
+                            depth + 1,
+                        )
+            else:
+                self._directives.append(
+                    SshdDirective(keyword, value, path, number, match, line_origin)
+                )
+
+    def directives(self, keyword: str) -> List[SshdDirective]:
+        """Return every directive for a keyword, global or in a Match block, in file order."""
+        keyword = keyword.lower()
+        return [d for d in self._parse() if d.keyword.lower() == keyword]
+
+    def get(self, keyword: str) -> Optional[str]:
+        """Return the global value of a keyword, as configured.
+
+        Returns: The first global value for the keyword, or None if it isn't set.
+        """
+        for directive in self.directives(keyword):
+            if directive.match is None:
+                return directive.value
+        return None
+
+    def effective(self, keyword: str) -> Optional[str]:
+        """Return the global value of a keyword which sshd uses.
+
+        This is sshd's own view of the saved file (`sshd -T`), which includes the defaults of
+        unset keywords. If sshd can't report it, or the file has unsaved edits, this falls back
+        to `get`.
+        """
+        if self._config == self._original.content:
+            settings = _sshd_test(str(self.path))
+            if settings is not None:
+                return settings.get(keyword.lower())
+        return self.get(keyword)
+
+    def set(self, keyword: str, value: str) -> None:
+        """Set the global value of a keyword.
+
+        The first global line for the keyword is changed in place if it is in the main file.
+        Otherwise, a new line is added where it takes precedence: before the Include which sets
+        the keyword, or else after the last global line (before any Match block). Commented-out
+        lines and Match blocks are left alone.
+        """
+        current = next((d for d in self.directives(keyword) if d.match is None), None)
+        if current is not None and current.value == value:
+            return
+
+        lines = self._config.splitlines(keepends=True)
+        new_line = f"{keyword} {value}\n"
+        if current is not None and current.path == self.path:
+            old_line = lines[current.line]
+            indent = old_line[: len(old_line) - len(old_line.lstrip())]
+            ending = old_line[len(old_line.rstrip("\r\n")) :]
+            lines[current.line] = f"{indent}{keyword} {value}{ending}"
+        elif current is not None:
+            lines.insert(current.origin, new_line)
+        elif self._first_match is not None:
+            if self._last_global is not None:
+                lines.insert(self._last_global + 1, new_line)
+            else:
+                lines.insert(self._first_match, new_line)
+        else:
+            if lines and not lines[-1].endswith("\n"):
+                lines[-1] += "\n"
+            lines.append(new_line)
+        self._config = "".join(lines)
+
+    def save(self, dry_run: bool) -> bool:
+        """Save the configuration file, if it was changed. See `_ConfigFile.save`."""
+        changed = super().save(dry_run)
+        if changed and not dry_run:
+            _sshd_test.cache_clear()
+        return changed
@@ -9,7 +9,7 @@ from nilrt_snac import logger
 
 class _SudoConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("sudo")
+        super().__init__("sudo", depends=["niauth"], resources=["/etc/sudoers.d/snac"])
 
     def configure(self, args: argparse.Namespace) -> None:
         print("Configuring sudo...")
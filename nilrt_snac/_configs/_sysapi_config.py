@@ -8,12 +8,14 @@ from nilrt_snac.opkg import opkg_helper
 
 class _SysAPIConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("sysapi")
+        super().__init__("sysapi", depends=["packages"])
         self._opkg_helper = opkg_helper
 
+    def declare_packages(self, opkg) -> None:
+        opkg.install("ni-sysapi-sshcli")
+
     def configure(self, args: argparse.Namespace) -> None:
         print("Configuring SysAPI...")
-        self._opkg_helper.install("ni-sysapi-sshcli")
 
     def verify(self, args: argparse.Namespace) -> bool:
         print("Verifying SysAPI configuration...")
@@ -2,36 +2,35 @@ import argparse
 
 from nilrt_snac import logger
 from nilrt_snac._configs._base_config import _BaseConfig
-from nilrt_snac._common import _check_owner, _cmd
+from nilrt_snac._configs._nirtcfg import nirtcfg
+from nilrt_snac._common import check_metadata
 from nilrt_snac.opkg import opkg_helper
+from nilrt_snac._services import restarts
 
 
 class _SyslogConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("syslog")
+        super().__init__(
+            "syslog",
+            depends=["packages", "settings"],
+            resources=["/etc/syslog-ng", "syslog"],
+        )
         self._opkg_helper = opkg_helper
         self.syslog_conf_path = "/etc/syslog-ng/syslog-ng.conf"
 
-    def configure(self, args: argparse.Namespace) -> None:
-        print("Configuring syslog-ng...")
-        dry_run: bool = args.dry_run
+    def declare_packages(self, opkg) -> None:
+        opkg.install("syslog-ng")
 
-        # Check if syslog-ng is already installed
-        if not self._opkg_helper.is_installed("syslog-ng"):
-            self._opkg_helper.install("syslog-ng")
+    def declare_settings(self, nirtcfg) -> None:
+        # Enable persistent storage
+        nirtcfg.set("SystemSettings", "PersistentLogs.enabled", "True")
 
-        if not dry_run:
-            # Enable persistent storage
-            logger.debug("Enabling persistent log storage...")
-            _cmd(
-                "nirtcfg",
-                "--set",
-                'section=SystemSettings,token=PersistentLogs.enabled,value="True"',
-            )
+    def configure(self, args: argparse.Namespace) -> None:
+        print("Configuring syslog-ng...")
 
-            # Restart syslog-ng service
-            logger.debug("Restarting syslog-ng service...")
-            _cmd("/etc/init.d/syslog", "restart")
+        # Persistent log storage is enabled by the "settings" module, which runs first.
+        if nirtcfg.changed("SystemSettings", "PersistentLogs.enabled"):
+            restarts.request("syslog", "PersistentLogs.enabled changed")
 
     def verify(self, args: argparse.Namespace) -> bool:
         print("Verifying syslog-ng configuration...")
@@ -43,8 +42,8 @@ class _SyslogConfig(_BaseConfig):
             valid = False
 
         # Check ownership of syslog.conf
-        if not _check_owner(self.syslog_conf_path, "root"):
-            logger.error(f"ERROR: {self.syslog_conf_path} is not owned by 'root'.")
+        for problem in check_metadata(self.syslog_conf_path, owner="root"):
+            logger.error(problem)
             valid = False
 
         return valid
@@ -10,9 +10,16 @@ from nilrt_snac.opkg import opkg_helper
 
 class _TmuxConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("tmux")
+        super().__init__(
+            "tmux",
+            depends=["packages"],
+            resources=["/usr/share/tmux/conf.d/snac.conf", "/etc/profile.d/tmux.sh"],
+        )
         self._opkg_helper = opkg_helper
 
+    def declare_packages(self, opkg) -> None:
+        opkg.install("tmux")
+
     def configure(self, args: argparse.Namespace) -> None:
         print("Configuring tmux...")
         snac_config_file = _ConfigFile("/usr/share/tmux/conf.d/snac.conf")
@@ -20,7 +27,6 @@ class _TmuxConfig(_BaseConfig):
         profile_file = _ConfigFile("/etc/profile.d/tmux.sh")
         profile_file.chmod(0o644)
         dry_run: bool = args.dry_run
-        self._opkg_helper.install("tmux")
 
         if not snac_config_file.exists():
             snac_config_file.add(
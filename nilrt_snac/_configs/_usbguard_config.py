@@ -2,7 +2,7 @@ import argparse
 import pathlib
 
 from nilrt_snac._configs._base_config import _BaseConfig
-from nilrt_snac._common import _check_group_ownership, _check_owner, _check_permissions
+from nilrt_snac._common import check_metadata
 from nilrt_snac._configs._config_file import EqualsDelimitedConfigFile
 
 from nilrt_snac import logger
@@ -13,7 +13,7 @@ class _USBGuardConfig(_BaseConfig):
     """USBGuard configuration handler."""
 
     def __init__(self):
-        super().__init__("usbguard")
+        super().__init__("usbguard", depends=["packages"])
         self.config_file_path = "/etc/usbguard/usbguard-daemon.conf"
         self.package_name = "usbguard"
         self._opkg_helper = opkg_helper
@@ -37,24 +37,14 @@ class _USBGuardConfig(_BaseConfig):
                 logger.error(f"USBGuard RuleFile not specified in {self.config_file_path}")
                 return False
             rules_file = pathlib.Path(rule_file_path)
-            if not rules_file.exists():
-                logger.error(f"USBGuard rules file missing: {rules_file}")
-                return False
-            if rules_file.stat().st_size == 0:
-                logger.error(f"USBGuard rules file is empty: {rules_file}")
-                return False
-            # Check group ownership and permissions of rules.conf
-            if not _check_group_ownership(str(rules_file), "root"):
-                logger.error(f"ERROR: {rules_file} is not owned by the 'root' group.")
-                return False
-            if not _check_permissions(str(rules_file), 0o600):
-                logger.error(f"ERROR: {rules_file} does not have 600 permissions.")
-                return False
-            if not _check_owner(str(rules_file), "root"):
-                logger.error(f"ERROR: {rules_file} is not owned by 'root'.")
-                return False
-
-            return True
+            # Check that rules.conf exists and isn't empty, and its ownership and permissions
+            problems = check_metadata(
+                rules_file, owner="root", group="root", mode=0o600, nonempty=True
+            )
+            for problem in problems:
+                logger.error(problem)
+
+            return not problems
         else:
             print("USBGuard is not installed; skipping verification.")
             return True
@@ -1,16 +1,18 @@
 import argparse
-import subprocess
 import textwrap
 
 from nilrt_snac._configs._base_config import _BaseConfig
 from nilrt_snac._configs._config_file import _ConfigFile
 
 from nilrt_snac import logger
+from nilrt_snac._executor import executor
 
 
 class _WIFIConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("wifi")
+        super().__init__(
+            "wifi", depends=["packages"], resources=["/etc/modprobe.d/snac_blacklist.conf"]
+        )
 
     def configure(self, args: argparse.Namespace) -> None:
         print("Disabling WiFi support...")
@@ -34,7 +36,7 @@ class _WIFIConfig(_BaseConfig):
         if not dry_run:
             logger.debug("Removing any WiFi modules in memory")
             # We do not check for success. If the modules are not loaded, this will return an error
-            subprocess.run(["rmmod", "cfg80211", "mac80211"], check=False)
+            executor.run(["rmmod", "cfg80211", "mac80211"], check=False)
 
     def verify(self, args: argparse.Namespace) -> bool:
         print("Verifying WiFi support disabled...")
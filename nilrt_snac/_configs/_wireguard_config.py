@@ -1,21 +1,39 @@
 import argparse
 import pathlib
-import subprocess
 import textwrap
 
 from nilrt_snac._configs._base_config import _BaseConfig
 from nilrt_snac._configs._config_file import _ConfigFile
 
 from nilrt_snac import logger
+from nilrt_snac._executor import executor
 from nilrt_snac.opkg import opkg_helper
+from nilrt_snac._services import restarts
+
+# The links `update-rc.d` makes to start the service in runlevels 3-5 and stop it in 0 and 6.
+_RC_LINKS = [pathlib.Path(f"/etc/rc{level}.d/S03ni-wireguard-labview") for level in "345"] + [
+    pathlib.Path(f"/etc/rc{level}.d/K05ni-wireguard-labview") for level in "06"
+]
 
 
 class _WireguardConfig(_BaseConfig):
     def __init__(self):
-        super().__init__("wireguard")
+        super().__init__(
+            "wireguard",
+            depends=["packages"],
+            resources=[
+                "/etc/wireguard",
+                "/etc/ifplugd/ifplugd.conf",
+                "update-rc.d",
+                "ni-wireguard-labview",
+            ],
+        )
         self._sysconnf_path = pathlib.Path("/etc/wireguard")
         self._opkg_helper = opkg_helper
 
+    def declare_packages(self, opkg) -> None:
+        opkg.install("wireguard-tools")
+
     def configure(self, args: argparse.Namespace) -> None:
         print("Installing wireguard-tools...")
         config_file = _ConfigFile(self._sysconnf_path / "wglv0.conf")
@@ -24,8 +42,6 @@ class _WireguardConfig(_BaseConfig):
         ifplug_conf = _ConfigFile("/etc/ifplugd/ifplugd.conf")
         dry_run: bool = args.dry_run
 
-        self._opkg_helper.install("wireguard-tools")
-
         if not ifplug_conf.contains("^ARGS_wglv0.*"):
             ifplug_conf.add(
                 textwrap.dedent(
@@ -40,24 +56,22 @@ class _WireguardConfig(_BaseConfig):
 
         if not config_file.contains("^PrivateKey = .+") and not private_key.exists():
             logger.debug("Generating wireguard keypair....")
-            result = subprocess.run(["wg", "genkey"], stdout=subprocess.PIPE, check=True)
-            priv_key = result.stdout.decode().strip()
+            result = executor.run(["wg", "genkey"], capture=True)
+            priv_key = result.stdout.strip()
             private_key.add(priv_key)
             private_key.chmod(0o600)
-            result = subprocess.run(
-                ["wg", "pubkey"], input=priv_key, text=True, stdout=subprocess.PIPE, check=True
-            )
+            result = executor.run(["wg", "pubkey"], capture=True, input=priv_key)
             pub_key = result.stdout.strip()
             public_key.add(pub_key)
             public_key.chmod(0o600)
 
-        config_file.save(dry_run)
-        private_key.save(dry_run)
-        public_key.save(dry_run)
-        ifplug_conf.save(dry_run)
-        if not dry_run:
-            logger.debug("Restating wireguard service")
-            subprocess.run(
+        for changed_file in (config_file, private_key, public_key, ifplug_conf):
+            if changed_file.save(dry_run):
+                restarts.request("ni-wireguard-labview", f"{changed_file.path} changed")
+        # update-rc.d leaves existing links alone, so it only needs to run if one is missing.
+        if not dry_run and not all(link.exists() for link in _RC_LINKS):
+            logger.debug("Enabling wireguard service")
+            executor.run(
                 [
                     "update-rc.d",
                     "ni-wireguard-labview",
@@ -72,10 +86,8 @@ class _WireguardConfig(_BaseConfig):
                     "0",
                     "6",
                     ".",
-                ],
-                check=True,
+                ]
             )
-            subprocess.run(["/etc/init.d/ni-wireguard-labview", "restart"], check=True)
 
     def verify(self, args: argparse.Namespace) -> bool:
         print("Verifying wireguard configuration...")
@@ -0,0 +1,142 @@
+"""Run external commands, recording how long each one takes."""
+
+import resource
+import subprocess
+import threading
+import time
+from typing import List, NamedTuple, Optional, Sequence
+
+from nilrt_snac import Errors, SNACError, logger
+
+# Timeout (in seconds) for commands which only query the system, and should answer quickly.
+QUERY_TIMEOUT = 60
+
+
+class CommandRecord(NamedTuple):
+    """Timing of one command run by the executor."""
+
+    command: str
+    # Wall-clock time, in seconds.
+    wall: float
+    # User + system CPU time of the command, in seconds; None if another command ran at the same
+    # time, as the CPU time of concurrent commands can't be told apart.
+    cpu: Optional[float]
+    # None if the command timed out.
+    returncode: Optional[int]
+
+
+def _children_cpu() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class _Running:
+    """A command in progress, which is marked if any other command overlaps with it."""
+
+    def __init__(self) -> None:
+        self.overlapped = False
+
+
+class Executor:
+    """Runs the external commands of all modules.
+
+    Every command is timed, and can be given a timeout. In a dry run, commands which change the
+    system are logged instead of run. `summary` reports the slowest commands of the run.
+    """
+
+    def __init__(self) -> None:
+        """Initialize the executor, with no commands run."""
+        self._dry_run = False
+        self._lock = threading.Lock()
+        self._running: List[_Running] = []
+        self.records: List[CommandRecord] = []
+
+    def set_dry_run(self, dry_run: bool) -> None:
+        """If set, commands which change the system are not run."""
+        self._dry_run = dry_run
+
+    def clear(self) -> None:
+        """Forget the commands run so far."""
+        with self._lock:
+            self.records = []
+
+    def run(
+        self,
+        args: Sequence[str],
+        check: bool = True,
+        capture: bool = False,
+        input: Optional[str] = None,
+        timeout: Optional[float] = None,
+        changes_system: bool = True,
+    ) -> subprocess.CompletedProcess:
+        """Run a command, like subprocess.run, in text mode.
+
+        Args:
+            args: The command and its arguments.
+            check: Raise CalledProcessError if the command fails.
+            capture: Capture stdout (as `.stdout` of the result) instead of passing it through.
+            input: Text to pass to the command on stdin.
+            timeout: Seconds after which the command is killed.
+            changes_system: False for commands which only query the system, which are run even in
+                a dry run.
+
+        Raises:
+            CalledProcessError: If `check` and the command fails.
+            SNACError: If the command times out.
+        """
+        command = " ".join(args)
+        if self._dry_run and changes_system:
+            print(f"dry-run: Not running: {command}")
+            return subprocess.CompletedProcess(list(args), 0, "" if capture else None)
+
+        logger.debug(f"Running: {command}")
+        running = _Running()
+        with self._lock:
+            for other in self._running:
+                other.overlapped = True
+            running.overlapped = bool(self._running)
+            self._running.append(running)
+        cpu_start, start = _children_cpu(), time.monotonic()
+        returncode = None
+        try:
+            result = subprocess.run(
+                list(args),
+                check=check,
+                stdout=subprocess.PIPE if capture else None,
+                input=input,
+                text=True,
+                timeout=timeout,
+            )
+            returncode = result.returncode
+            return result
+        except subprocess.CalledProcessError as e:
+            returncode = e.returncode
+            raise
+        except subprocess.TimeoutExpired:
+            raise SNACError(f"Command timed out after {timeout}s: {command}", Errors.EX_ERROR)
+        finally:
+            wall, cpu = time.monotonic() - start, _children_cpu() - cpu_start
+            with self._lock:
+                self._running.remove(running)
+                self.records.append(
+                    CommandRecord(command, wall, None if running.overlapped else cpu, returncode)
+                )
+
+    def summary(self, limit: int = 10) -> str:
+        """Return a table of the slowest commands run so far."""
+        with self._lock:
+            records = sorted(self.records, key=lambda record: record.wall, reverse=True)
+        lines = [f"{'Wall (s)':>9} {'CPU (s)':>8} {'Exit':>5}  Command"]
+        for record in records[:limit]:
+            cpu = "-" if record.cpu is None else f"{record.cpu:.2f}"
+            returncode = "-" if record.returncode is None else str(record.returncode)
+            lines.append(f"{record.wall:9.2f} {cpu:>8} {returncode:>5}  {record.command}")
+        return "\n".join(lines)
+
+    def total(self) -> float:
+        """Return the total wall-clock time of the commands run so far, in seconds."""
+        with self._lock:
+            return sum(record.wall for record in self.records)
+
+
+executor = Executor()
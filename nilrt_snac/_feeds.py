@@ -0,0 +1,275 @@
+"""Resolve and download packages from the opkg feeds ahead of `opkg install`.
+
+Packages are downloaded with urllib, which does not use opkg's `http_proxy`, `https_proxy`,
+`ftp_proxy`, `proxy_user`, or `proxy_passwd` options (nor any other opkg download option). The
+proxy environment variables (`http_proxy` and so on) are honoured by both.
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import pathlib
+import tempfile
+import urllib.request
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from nilrt_snac import Errors, SNACError, logger
+from nilrt_snac.opkg import (
+    OpkgConf,
+    OpkgHelper,
+    OpkgTransaction,
+    _package_name,
+    _parse_control,
+    compare_versions,
+)
+
+# Where packages are downloaded; `opkg install` is given the paths of the downloaded IPKs.
+PREFETCH_DIR = pathlib.Path("/var/cache/nilrt-snac/ipks")
+PREFETCH_JOBS = 4
+DOWNLOAD_TIMEOUT = 60
+
+
+class FeedPackage(NamedTuple):
+    """A package available from one of the configured feeds."""
+
+    name: str
+    version: str
+    architecture: str
+    # Each entry is a list of alternatives ("a | b"), any one of which satisfies the dependency.
+    depends: Tuple[Tuple[str, ...], ...]
+    provides: Tuple[str, ...]
+    filename: str
+    size: int
+    sha256: str
+    md5: str
+    feed_url: str
+    # All fields of the package's stanza in the feed index.
+    fields: Dict[str, str] = {}
+
+    @property
+    def url(self) -> str:
+        """Download location of the package."""
+        return f"{self.feed_url.rstrip('/')}/{self.filename}"
+
+
+def _parse_depends(*fields: str) -> Tuple[Tuple[str, ...], ...]:
+    """Parse Depends-style fields into groups of alternative package names."""
+    groups = []
+    for field in fields:
+        for group in field.split(","):
+            names = tuple(alt.split("(")[0].strip() for alt in group.split("|") if alt.strip())
+            if names:
+                groups.append(names)
+    return tuple(groups)
+
+
+def _feed_package(fields: Dict[str, str], feed_url: str) -> FeedPackage:
+    return FeedPackage(
+        name=fields["Package"],
+        version=fields.get("Version", ""),
+        architecture=fields.get("Architecture", ""),
+        # opkg installs recommended packages by default, so they are part of the closure too.
+        depends=_parse_depends(
+            fields.get("Pre-Depends", ""), fields.get("Depends", ""), fields.get("Recommends", "")
+        ),
+        provides=tuple(
+            p.split("(")[0].strip() for p in fields.get("Provides", "").split(",") if p.strip()
+        ),
+        filename=fields.get("Filename", ""),
+        size=int(fields.get("Size", "0") or 0),
+        sha256=fields.get("SHA256sum", ""),
+        md5=fields.get("MD5Sum", ""),
+        feed_url=feed_url,
+        fields=fields,
+    )
+
+
+class FeedIndex:
+    """The packages available from the configured feeds, as of the last `opkg update`."""
+
+    def __init__(self, packages: Iterable[FeedPackage] = ()) -> None:
+        """Initialize the index with the given packages."""
+        self._packages: Dict[str, FeedPackage] = {}
+        self._providers: Dict[str, List[str]] = {}
+        for package in packages:
+            self.add(package)
+
+    @classmethod
+    def from_conf(cls, conf: OpkgConf, only: Optional[str] = None) -> "FeedIndex":
+        """Read the downloaded indexes of the feeds in the opkg configuration.
+
+        Args:
+            conf: The opkg configuration.
+            only: If given, read only the index of the feed with this name.
+        """
+        index = cls()
+        for feed in conf.feeds:
+            if only is not None and feed.name != only:
+                continue
+            list_file = conf.lists_dir / feed.name
+            try:
+                text = list_file.read_text()
+            except OSError:
+                logger.debug(f"No index for feed {feed.name} at {list_file}")
+                continue
+            for fields in _parse_control(text):
+                if "Package" in fields:
+                    index.add(_feed_package(fields, feed.url))
+        return index
+
+    def add(self, package: FeedPackage) -> None:
+        """Add a package, keeping only the newest version of each name."""
+        current = self._packages.get(package.name)
+        if current is not None and compare_versions(current.version, package.version) >= 0:
+            return
+        self._packages[package.name] = package
+        for virtual in package.provides:
+            providers = self._providers.setdefault(virtual, [])
+            if package.name not in providers:
+                providers.append(package.name)
+
+    def __iter__(self):
+        return iter(self._packages.values())
+
+    def find(self, name: str) -> Optional[FeedPackage]:
+        """Find the package with the given name, or else the first package providing it."""
+        if name in self._packages:
+            return self._packages[name]
+        for provider in self._providers.get(name, []):
+            return self._packages[provider]
+        return None
+
+    def resolve(
+        self, names: Iterable[str], is_installed: Callable[[str], bool] = lambda name: False
+    ) -> List[FeedPackage]:
+        """Resolve the dependency closure of the named packages.
+
+        Args:
+            names: Packages to be installed.
+            is_installed: Returns True for names (real or provided) which are already satisfied on
+                the system; their dependencies are not followed.
+
+        Returns: The packages which need to be fetched, in resolution order.
+        """
+        closure: Dict[str, FeedPackage] = {}
+        pending: List[Tuple[str, ...]] = [(name,) for name in names]
+        while pending:
+            alternatives = pending.pop(0)
+            if any(is_installed(name) for name in alternatives):
+                continue
+            if any(
+                name in closure or any(name in p.provides for p in closure.values())
+                for name in alternatives
+            ):
+                continue
+            for name in alternatives:
+                package = self.find(name)
+                if package is not None:
+                    break
+            else:
+                logger.warning(f"Cannot resolve {' | '.join(alternatives)} from the package feeds")
+                continue
+            closure[package.name] = package
+            pending.extend(package.depends)
+        return list(closure.values())
+
+
+def _checksum_ok(path: pathlib.Path, package: FeedPackage) -> bool:
+    if package.sha256:
+        digest, expected = hashlib.sha256(), package.sha256
+    elif package.md5:
+        digest, expected = hashlib.md5(), package.md5
+    else:
+        return not package.size or path.stat().st_size == package.size
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest() == expected
+
+
+def fetch_package(package: FeedPackage, dest_dir: pathlib.Path) -> pathlib.Path:
+    """Download a package into a directory and verify its checksum.
+
+    A verified copy which is already present is reused. Downloads go to a temporary file which is
+    only renamed into place once verified.
+
+    Raises: SNACError if the download fails or the checksum does not match.
+    """
+    dest = dest_dir / os.path.basename(package.filename)
+    if dest.exists() and _checksum_ok(dest, package):
+        logger.debug(f"{dest} already fetched")
+        return dest
+
+    fd, tmp_name = tempfile.mkstemp(dir=dest_dir, prefix=f".{dest.name}.")
+    tmp = pathlib.Path(tmp_name)
+    try:
+        with os.fdopen(fd, "wb") as out, urllib.request.urlopen(
+            package.url, timeout=DOWNLOAD_TIMEOUT
+        ) as response:
+            for chunk in iter(lambda: response.read(1 << 16), b""):
+                out.write(chunk)
+        if not _checksum_ok(tmp, package):
+            raise SNACError(f"Checksum mismatch for {package.url}", Errors.EX_ERROR)
+        tmp.replace(dest)
+    except OSError as e:
+        raise SNACError(f"Failed to fetch {package.url}: {e}", Errors.EX_ERROR)
+    finally:
+        tmp.unlink(missing_ok=True)
+    logger.debug(f"Fetched {package.url}")
+    return dest
+
+
+def fetch_packages(
+    packages: List[FeedPackage], dest_dir: pathlib.Path, jobs: int = PREFETCH_JOBS
+) -> List[pathlib.Path]:
+    """Download packages concurrently, with at most `jobs` downloads in flight.
+
+    Raises: SNACError naming every package which could not be fetched.
+    """
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    paths: List[pathlib.Path] = []
+    errors: List[str] = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        futures = [pool.submit(fetch_package, package, dest_dir) for package in packages]
+        for future in futures:
+            try:
+                paths.append(future.result())
+            except SNACError as e:
+                errors.append(str(e))
+    if errors:
+        raise SNACError("\n".join(errors), Errors.EX_ERROR)
+    return paths
+
+
+def prefetch(
+    helper: OpkgHelper,
+    transaction: OpkgTransaction,
+    jobs: int = PREFETCH_JOBS,
+    dest_dir: pathlib.Path = PREFETCH_DIR,
+) -> Dict[str, pathlib.Path]:
+    """Download the packages a transaction will install, with their dependencies.
+
+    This runs before the transaction is committed, so that a download failure aborts
+    `configure` before anything on the system has changed.
+
+    Returns: The downloaded IPK of each package, by name, to be passed to `OpkgHelper.commit`.
+        This is empty in a dry run.
+    """
+    conf = helper.get_conf()
+    names = [
+        op.package
+        for op in transaction.installs
+        if not op.package.endswith(".ipk") and not helper.is_installed(_package_name(op.package))
+    ]
+    if not names:
+        return {}
+
+    index = FeedIndex.from_conf(conf, only=helper.offline_feed)
+    packages = index.resolve(names, helper.is_provided)
+    logger.info(f"Prefetching {len(packages)} packages into {dest_dir}")
+    if helper.dry_run:
+        for package in packages:
+            logger.debug(f"dry-run: not fetching {package.url}")
+        return {}
+    paths = fetch_packages(packages, dest_dir, jobs)
+    return {package.name: path for package, path in zip(packages, paths)}
@@ -0,0 +1,596 @@
+"""A declarative model of firewalld policies and zones, read and written as firewalld's own XML.
+
+Writing the permanent configuration directly replaces a long series of `firewall-offline-cmd`
+calls, each of which starts a Python interpreter and loads and rewrites the whole configuration
+tree. Likewise, reading it once answers any number of checks without a `firewall-cmd` query each.
+
+The running firewall is brought in line with the permanent configuration by applying only the
+difference between the two, rather than with `firewall-cmd --reload`, which rebuilds the whole
+nftables ruleset and briefly interrupts traffic.
+"""
+
+import os
+import pathlib
+import shlex
+import tempfile
+import xml.etree.ElementTree as ET
+from typing import Dict, FrozenSet, Iterable, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+from nilrt_snac import Errors, SNACError, logger
+from nilrt_snac._executor import QUERY_TIMEOUT, executor
+
+FIREWALLD_CONFIG_DIR = "/etc/firewalld"
+FIREWALLD_SYSTEM_DIR = "/usr/lib/firewalld"
+
+
+class FirewallPolicy(NamedTuple):
+    """A firewalld policy, which filters traffic from its ingress zones to its egress zones."""
+
+    name: str
+    ingress_zones: FrozenSet[str] = frozenset()
+    egress_zones: FrozenSet[str] = frozenset()
+    target: str = "CONTINUE"
+    services: FrozenSet[str] = frozenset()
+    # "port/protocol", e.g. "55184/tcp"
+    ports: FrozenSet[str] = frozenset()
+    protocols: FrozenSet[str] = frozenset()
+    masquerade: bool = False
+
+
+class FirewallZone(NamedTuple):
+    """A firewalld zone, which groups interfaces and sources.
+
+    When writing zones, only `interfaces` and `forward` are applied; the other settings are kept
+    as they are in the zone's system default.
+    """
+
+    name: str
+    interfaces: FrozenSet[str] = frozenset()
+    # Whether traffic may be forwarded between the interfaces and sources of the zone.
+    forward: bool = False
+    target: str = "default"
+    sources: FrozenSet[str] = frozenset()
+    services: FrozenSet[str] = frozenset()
+    ports: FrozenSet[str] = frozenset()
+    protocols: FrozenSet[str] = frozenset()
+    masquerade: bool = False
+
+
+class FirewallService(NamedTuple):
+    """A firewalld service definition."""
+
+    name: str
+    ports: FrozenSet[str] = frozenset()
+    protocols: FrozenSet[str] = frozenset()
+
+
+class FirewallConfig(NamedTuple):
+    """A firewalld configuration, by name."""
+
+    policies: Dict[str, FirewallPolicy]
+    zones: Dict[str, FirewallZone]
+    services: Dict[str, FirewallService]
+    # Policies and zones ("policy NAME", "zone NAME") with settings that the model does not cover,
+    # like rich rules or forward ports.
+    unmodeled: FrozenSet[str] = frozenset()
+    # Those settings, by the same names, in a form which compares equal between the permanent and
+    # runtime configuration, e.g. ("rule", ...) or ("priority", "-15000").
+    unmodeled_settings: Mapping[str, FrozenSet[Tuple[str, str]]] = {}
+
+
+class FirewallSpec(NamedTuple):
+    """The expected firewall configuration, used both to apply it and to verify it.
+
+    Policies and services are expected to match exactly. Zones are expected to have at least the
+    listed interfaces (and to allow forwarding only if `forward` is set), and none of the
+    services in `forbidden_zone_services`; their other settings are left to the system defaults.
+    """
+
+    policies: List[FirewallPolicy]
+    zones: List[FirewallZone]
+    services: List[FirewallService] = []
+    forbidden_zone_services: Mapping[str, FrozenSet[str]] = {}
+
+
+def _write_xml(root: ET.Element, path: pathlib.Path) -> None:
+    """Write an XML document the way firewalld does, replacing any existing file atomically."""
+    ET.indent(root, space="  ")
+    data = b'<?xml version="1.0" encoding="utf-8"?>\n' + ET.tostring(root) + b"\n"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp_name, 0o644)
+        os.replace(tmp_name, path)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+    logger.debug(f"Wrote {path}")
+
+
+def policy_element(policy: FirewallPolicy) -> ET.Element:
+    """Build the XML element firewalld stores a policy as."""
+    root = ET.Element("policy", target=policy.target)
+    for zone in sorted(policy.ingress_zones):
+        ET.SubElement(root, "ingress-zone", name=zone)
+    for zone in sorted(policy.egress_zones):
+        ET.SubElement(root, "egress-zone", name=zone)
+    for service in sorted(policy.services):
+        ET.SubElement(root, "service", name=service)
+    for port in sorted(policy.ports):
+        number, protocol = port.split("/")
+        ET.SubElement(root, "port", port=number, protocol=protocol)
+    for protocol in sorted(policy.protocols):
+        ET.SubElement(root, "protocol", value=protocol)
+    if policy.masquerade:
+        ET.SubElement(root, "masquerade")
+    return root
+
+
+def zone_element(zone: FirewallZone, base: Optional[ET.Element] = None) -> ET.Element:
+    """Apply changes to a zone's XML element.
+
+    Args:
+        zone: The changes to make.
+        base: The zone as it is now, usually the system default; an empty zone if not given.
+    """
+    root = ET.Element("zone") if base is None else base
+    interfaces = {e.get("name") for e in root.findall("interface")}
+    # firewalld keeps interfaces right after the description.
+    index = len([e for e in root if e.tag in ("short", "description")])
+    for interface in sorted(zone.interfaces - interfaces):
+        root.insert(index, ET.Element("interface", name=interface))
+        index += 1
+
+    forward = root.find("forward")
+    if zone.forward and forward is None:
+        ET.SubElement(root, "forward")
+    elif not zone.forward and forward is not None:
+        root.remove(forward)
+    return root
+
+
+def write_policies(
+    policies: Iterable[FirewallPolicy], config_dir: str = FIREWALLD_CONFIG_DIR
+) -> None:
+    """Write policies to the permanent firewalld configuration, replacing any with the same name."""
+    for policy in policies:
+        path = pathlib.Path(config_dir) / "policies" / f"{policy.name}.xml"
+        _write_xml(policy_element(policy), path)
+
+
+def write_zones(
+    zones: Iterable[FirewallZone],
+    config_dir: str = FIREWALLD_CONFIG_DIR,
+    system_dir: str = FIREWALLD_SYSTEM_DIR,
+) -> None:
+    """Apply zone changes to the permanent firewalld configuration.
+
+    Each zone is based on its current permanent configuration: the copy in `config_dir` if there
+    is one, or else the system default from `system_dir`.
+    """
+    for zone in zones:
+        path = pathlib.Path(config_dir) / "zones" / f"{zone.name}.xml"
+        base_path = path if path.exists() else pathlib.Path(system_dir) / "zones" / path.name
+        base = ET.parse(base_path).getroot() if base_path.exists() else None
+        _write_xml(zone_element(zone, base), path)
+
+
+def _names(root: ET.Element, tag: str, attribute: str = "name") -> FrozenSet[str]:
+    return frozenset(e.get(attribute, "") for e in root.findall(tag))
+
+
+def _ports(root: ET.Element) -> FrozenSet[str]:
+    return frozenset(f"{e.get('port')}/{e.get('protocol')}" for e in root.findall("port"))
+
+
+def _parse_policy(name: str, root: ET.Element) -> FirewallPolicy:
+    return FirewallPolicy(
+        name,
+        ingress_zones=_names(root, "ingress-zone"),
+        egress_zones=_names(root, "egress-zone"),
+        target=root.get("target", "CONTINUE"),
+        services=_names(root, "service"),
+        ports=_ports(root),
+        protocols=_names(root, "protocol", "value"),
+        masquerade=root.find("masquerade") is not None,
+    )
+
+
+def _parse_zone(name: str, root: ET.Element) -> FirewallZone:
+    return FirewallZone(
+        name,
+        interfaces=_names(root, "interface"),
+        forward=root.find("forward") is not None,
+        target=root.get("target", "default"),
+        sources=_names(root, "source", "address") | _names(root, "source", "mac"),
+        services=_names(root, "service"),
+        ports=_ports(root),
+        protocols=_names(root, "protocol", "value"),
+        masquerade=root.find("masquerade") is not None,
+    )
+
+
+def _parse_service(name: str, root: ET.Element) -> FirewallService:
+    return FirewallService(name, ports=_ports(root), protocols=_names(root, "protocol", "value"))
+
+
+_MODELED_TAGS = {
+    "short",
+    "description",
+    "ingress-zone",
+    "egress-zone",
+    "interface",
+    "source",
+    "service",
+    "port",
+    "protocol",
+    "forward",
+    "masquerade",
+}
+
+
+# The fields of a forward port, as firewall-cmd prints them (port=80:proto=tcp:toport=8080:toaddr=),
+# and their XML attributes.
+_FORWARD_PORT = (
+    ("port", "port"),
+    ("proto", "protocol"),
+    ("toport", "to-port"),
+    ("toaddr", "to-addr"),
+)
+
+
+def _rule_key(tokens: Iterable[str]) -> str:
+    """The tokens of a rich rule, in an order which doesn't depend on how it was written."""
+    return " ".join(sorted(tokens))
+
+
+def _xml_rule_tokens(element: ET.Element) -> List[str]:
+    # <source invert="true" address="..."/> is `source NOT address="..."` in a rich rule.
+    tokens = [element.tag]
+    for name, value in element.attrib.items():
+        if name == "invert":
+            if value.lower() in ("true", "yes"):
+                tokens.append("NOT")
+        else:
+            tokens.append(f"{name}={value}")
+    for child in element:
+        tokens += _xml_rule_tokens(child)
+    return tokens
+
+
+def _unmodeled_items(root: ET.Element) -> FrozenSet[Tuple[str, str]]:
+    """The settings of a policy or zone file which are not part of the model."""
+    items: Set[Tuple[str, str]] = set()
+    if root.get("priority", "-1") != "-1":
+        items.add(("priority", root.get("priority", "")))
+    for name in sorted(set(root.attrib) - {"target", "version", "priority"}):
+        # Not compared with the runtime, so that any such setting needs a reload.
+        items.add(("attribute", f"{name}={root.get(name)}"))
+    for element in root:
+        if element.tag in _MODELED_TAGS:
+            continue
+        if element.tag == "rule":
+            items.add(("rule", _rule_key(_xml_rule_tokens(element))))
+        elif element.tag == "forward-port":
+            value = ":".join(f"{key}={element.get(name, '')}" for key, name in _FORWARD_PORT)
+            items.add(("forward-port", value))
+        elif element.tag == "source-port":
+            items.add(("source-port", f"{element.get('port')}/{element.get('protocol')}"))
+        elif element.tag == "icmp-block":
+            items.add(("icmp-block", element.get("name", "")))
+        elif element.tag == "icmp-block-inversion":
+            items.add(("icmp-block-inversion", "yes"))
+        else:
+            items.add(("element", element.tag))
+    return frozenset(items)
+
+
+def _load_files(config_dir: str, system_dir: str, kind: str) -> Dict[str, ET.Element]:
+    """Parse the XML files of one kind, with the files in `config_dir` overriding the defaults."""
+    roots: Dict[str, ET.Element] = {}
+    for directory in (system_dir, config_dir):
+        for path in sorted((pathlib.Path(directory) / kind).glob("*.xml")):
+            try:
+                roots[path.stem] = ET.parse(path).getroot()
+            except (OSError, ET.ParseError) as e:
+                raise SNACError(f"Invalid firewalld configuration {path}: {e}", Errors.EX_ERROR)
+    return roots
+
+
+def load_config(
+    config_dir: str = FIREWALLD_CONFIG_DIR, system_dir: str = FIREWALLD_SYSTEM_DIR
+) -> FirewallConfig:
+    """Read the permanent firewalld configuration from disk, as firewalld itself would.
+
+    Raises: SNACError if a configuration file cannot be parsed.
+    """
+    policies = _load_files(config_dir, system_dir, "policies")
+    zones = _load_files(config_dir, system_dir, "zones")
+    services = _load_files(config_dir, system_dir, "services")
+    unmodeled = {
+        f"{kind} {name}": items
+        for kind, roots in (("policy", policies), ("zone", zones))
+        for name, root in roots.items()
+        for items in [_unmodeled_items(root)]
+        if items
+    }
+    return FirewallConfig(
+        policies={name: _parse_policy(name, root) for name, root in policies.items()},
+        zones={name: _parse_zone(name, root) for name, root in zones.items()},
+        services={name: _parse_service(name, root) for name, root in services.items()},
+        unmodeled=frozenset(unmodeled),
+        unmodeled_settings=unmodeled,
+    )
+
+
+def undefined_references(config: FirewallConfig) -> List[str]:
+    """List the zones and services which policies and zones use but which are not defined.
+
+    firewalld refuses to load a configuration with any of these.
+    """
+    # Symbolic zones which policies may use without a definition.
+    zones = set(config.zones) | {"HOST", "ANY"}
+    problems: List[str] = []
+    for policy in config.policies.values():
+        for zone in sorted((policy.ingress_zones | policy.egress_zones) - zones):
+            problems.append(f"policy {policy.name} uses undefined zone {zone}")
+    for kind, items in (("policy", config.policies), ("zone", config.zones)):
+        for item in items.values():
+            for service in sorted(item.services - set(config.services)):
+                problems.append(f"{kind} {item.name} uses undefined service {service}")
+    return problems
+
+
+# A single setting of a policy, zone or service: (kind, value), e.g. ("service", "ssh").
+_Item = Tuple[str, str]
+
+
+def _items(rules: NamedTuple) -> Set[_Item]:
+    """Flatten a policy, zone or service into its settings."""
+    items: Set[_Item] = set()
+    for field, value in rules._asdict().items():
+        if field == "name":
+            continue
+        if isinstance(value, frozenset):
+            # "ingress_zones" -> "ingress-zone"
+            kind = field[:-1].replace("_", "-")
+            items.update((kind, v) for v in value)
+        elif isinstance(value, bool):
+            if value:
+                items.add((field, "yes"))
+        else:
+            items.add((field, value))
+    return items
+
+
+def _report(kind: str, name: str, missing: Set[_Item], found: Set[_Item]) -> List[str]:
+    problems = [f"MISSING: {kind} {name} {k} {v}" for k, v in sorted(missing)]
+    problems += [f"FOUND: {kind} {name} {k} {v}" for k, v in sorted(found)]
+    return problems
+
+
+def diff_config(config: FirewallConfig, spec: FirewallSpec) -> List[str]:
+    """Compare a firewall configuration to its spec.
+
+    Returns: One line for every missing or unexpected setting; empty if the configuration matches.
+    """
+    problems: List[str] = []
+    for kind, expected, actual in (
+        ("policy", spec.policies, config.policies),
+        ("service", spec.services, config.services),
+    ):
+        for rules in expected:
+            if rules.name not in actual:
+                problems.append(f"MISSING: {kind} {rules.name}")
+                continue
+            want, have = _items(rules), _items(actual[rules.name])
+            problems += _report(kind, rules.name, want - have, have - want)
+
+    for zone in spec.zones:
+        if zone.name not in config.zones:
+            problems.append(f"MISSING: zone {zone.name}")
+            continue
+        have = _items(config.zones[zone.name])
+        required = _items(zone._replace(target=config.zones[zone.name].target))
+        forbidden = {("service", s) for s in spec.forbidden_zone_services.get(zone.name, ())}
+        if not zone.forward:
+            forbidden.add(("forward", "yes"))
+        problems += _report("zone", zone.name, required - have, forbidden & have)
+    return problems
+
+
+def global_state(config_dir: str = FIREWALLD_CONFIG_DIR) -> Dict[str, bytes]:
+    """Snapshot the permanent configuration which only a reload applies to the runtime.
+
+    This is firewalld.conf and the service, ipset, ICMP type and helper definitions.
+    """
+    state: Dict[str, bytes] = {}
+    root = pathlib.Path(config_dir)
+    for path in [root / "firewalld.conf"] + [
+        path
+        for kind in ("services", "ipsets", "icmptypes", "helpers")
+        for path in sorted((root / kind).glob("*.xml"))
+    ]:
+        try:
+            state[str(path)] = path.read_bytes()
+        except OSError:
+            pass
+    return state
+
+
+# Runtime settings which are not part of the model, and their values when unset.
+_UNMODELED_RUNTIME = {
+    "priority": "-1",
+    "icmp-block-inversion": "no",
+    "forward-ports": "",
+    "source-ports": "",
+    "icmp-blocks": "",
+    "rich rules": "",
+}
+
+
+def _parse_list_all(output: str) -> Dict[str, Dict[str, str]]:
+    """Parse the output of `firewall-cmd --list-all-zones` or `--list-all-policies`."""
+    blocks: Dict[str, Dict[str, str]] = {}
+    settings: Dict[str, str] = {}
+    key = ""
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        if not line[0].isspace():
+            # e.g. "work (active)"
+            settings = blocks.setdefault(line.split()[0], {})
+        elif line.startswith("\t") or line.startswith("   "):
+            # Continuation of a multi-line setting, like rich rules.
+            settings[key] = f"{settings[key]}\n{line.strip()}".strip()
+        else:
+            key, _, value = line.strip().partition(":")
+            settings[key] = value.strip()
+    return blocks
+
+
+def _split(settings: Dict[str, str], key: str) -> FrozenSet[str]:
+    return frozenset(settings.get(key, "").split())
+
+
+def _runtime_unmodeled(settings: Dict[str, str]) -> FrozenSet[Tuple[str, str]]:
+    """The settings of a runtime policy or zone which are not part of the model.
+
+    They are in the same form as the `_unmodeled_items` of a policy or zone file.
+    """
+    items: Set[Tuple[str, str]] = set()
+    for key, unset in _UNMODELED_RUNTIME.items():
+        value = settings.get(key, unset)
+        if value == unset:
+            continue
+        if key == "rich rules":
+            items.update(("rule", _rule_key(shlex.split(line))) for line in value.splitlines())
+        elif key in ("priority", "icmp-block-inversion"):
+            items.add((key, value))
+        else:
+            # "forward-ports" -> "forward-port"
+            items.update((key[:-1], v) for v in value.split())
+    return frozenset(items)
+
+
+def load_runtime() -> FirewallConfig:
+    """Read the runtime configuration of the running firewalld.
+
+    Service definitions are not read.
+
+    Raises: SNACError if firewalld cannot be queried.
+    """
+    outputs = []
+    for option in ("--list-all-policies", "--list-all-zones"):
+        result = executor.run(
+            ["firewall-cmd", option],
+            check=False,
+            capture=True,
+            timeout=QUERY_TIMEOUT,
+            changes_system=False,
+        )
+        if result.returncode != 0:
+            raise SNACError(
+                f"firewall-cmd {option} failed with return code {result.returncode}",
+                Errors.EX_ERROR,
+            )
+        outputs.append(_parse_list_all(result.stdout))
+    policies, zones = outputs
+
+    unmodeled = {
+        f"{kind} {name}": items
+        for kind, blocks in (("policy", policies), ("zone", zones))
+        for name, s in blocks.items()
+        for items in [_runtime_unmodeled(s)]
+        if items
+    }
+    return FirewallConfig(
+        policies={
+            name: FirewallPolicy(
+                name,
+                ingress_zones=_split(s, "ingress-zones"),
+                egress_zones=_split(s, "egress-zones"),
+                target=s.get("target", "CONTINUE"),
+                services=_split(s, "services"),
+                ports=_split(s, "ports"),
+                protocols=_split(s, "protocols"),
+                masquerade=s.get("masquerade") == "yes",
+            )
+            for name, s in policies.items()
+        },
+        zones={
+            name: FirewallZone(
+                name,
+                interfaces=_split(s, "interfaces"),
+                forward=s.get("forward") == "yes",
+                target=s.get("target", "default"),
+                sources=_split(s, "sources"),
+                services=_split(s, "services"),
+                ports=_split(s, "ports"),
+                protocols=_split(s, "protocols"),
+                masquerade=s.get("masquerade") == "yes",
+            )
+            for name, s in zones.items()
+        },
+        services={},
+        unmodeled=frozenset(unmodeled),
+        unmodeled_settings=unmodeled,
+    )
+
+
+def _delta_args(have: Set[_Item], want: Set[_Item]) -> List[str]:
+    args = []
+    for action, items in (("remove", have - want), ("add", want - have)):
+        for setting, value in sorted(items):
+            if setting in ("forward", "masquerade"):
+                args.append(f"--{action}-{setting}")
+            elif setting in ("interface", "source"):
+                # Interfaces and sources bound at runtime survive a reload too, so they're left
+                # alone; added ones are moved over if another zone has them.
+                if action == "add":
+                    args.append(f"--change-{setting}={value}")
+            else:
+                args.append(f"--{action}-{setting}={value}")
+    return args
+
+
+def runtime_delta(permanent: FirewallConfig, runtime: FirewallConfig) -> Optional[List[List[str]]]:
+    """Work out the `firewall-cmd` calls which bring the runtime in line with the permanent config.
+
+    Each call changes one policy or zone, which firewalld applies as a single nftables update.
+
+    Policies and zones with settings outside the model (like the rich rules of the stock
+    allow-host-ipv6 policy) are fine as long as they are the same in both.
+
+    Returns: The arguments of each call, or None if the difference cannot be applied at runtime
+        (e.g. a policy was created, a target changed, or a policy or zone with unmodeled settings
+        differs) and a full reload is needed.
+    """
+    if set(permanent.policies) != set(runtime.policies):
+        return None
+    if set(permanent.zones) != set(runtime.zones):
+        return None
+
+    calls: List[List[str]] = []
+    for kind, wanted, current in (
+        ("zone", permanent.zones, runtime.zones),
+        ("policy", permanent.policies, runtime.policies),
+    ):
+        for name in sorted(wanted):
+            want, have = _items(wanted[name]), _items(current[name])
+            key = f"{kind} {name}"
+            if key in permanent.unmodeled or key in runtime.unmodeled:
+                # Only the modeled settings can be changed at runtime.
+                new = permanent.unmodeled_settings.get(key, frozenset())
+                old = runtime.unmodeled_settings.get(key, frozenset())
+                if want != have or old != new:
+                    return None
+                continue
+            if {i for i in want if i[0] == "target"} != {i for i in have if i[0] == "target"}:
+                return None
+            args = _delta_args(have, want)
+            if args:
+                calls.append([f"--{kind}={name}"] + args)
+    return calls
@@ -0,0 +1,246 @@
+"""Run the `_configs` modules concurrently, keeping each module's output together."""
+
+import concurrent.futures
+import logging
+import sys
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple, TypeVar, Union
+
+from nilrt_snac import Errors, SNACError
+from nilrt_snac._configs import _BaseConfig
+
+T = TypeVar("T")
+
+# Output captured from one module: text written to stdout, or a log record.
+_Event = Union[str, logging.LogRecord]
+
+
+class _OutputCapture:
+    """Buffers stdout writes and log records per thread, for threads which have opted in.
+
+    Output from any other thread (e.g. the main thread) is passed straight through.
+    """
+
+    def __init__(self, stdout, handlers: List[logging.Handler]) -> None:
+        """Initialize the capture, forwarding uncaptured output to the given stdout and handlers."""
+        self._stdout = stdout
+        self._handlers = handlers
+        self._local = threading.local()
+
+    def _buffer(self) -> Optional[List[_Event]]:
+        return getattr(self._local, "events", None)
+
+    def start(self) -> None:
+        """Start capturing the current thread's output."""
+        self._local.events = []
+
+    def stop(self) -> List[_Event]:
+        """Stop capturing the current thread's output and return it."""
+        events = self._local.events
+        del self._local.events
+        return events
+
+    def replay(self, events: List[_Event]) -> None:
+        """Emit captured output, in the order it was produced."""
+        for event in events:
+            if isinstance(event, str):
+                self._stdout.write(event)
+            else:
+                self._emit(event)
+        self._stdout.flush()
+
+    def _emit(self, record: logging.LogRecord) -> None:
+        for handler in self._handlers:
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+    # File-like interface, for use as sys.stdout.
+    def write(self, text: str) -> int:
+        buffer = self._buffer()
+        if buffer is None:
+            return self._stdout.write(text)
+        buffer.append(text)
+        return len(text)
+
+    def flush(self) -> None:
+        if self._buffer() is None:
+            self._stdout.flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self._stdout, name)
+
+
+class _CaptureHandler(logging.Handler):
+    """Root logging handler which routes records through an `_OutputCapture`."""
+
+    def __init__(self, capture: _OutputCapture) -> None:
+        """Initialize the handler."""
+        super().__init__()
+        self._capture = capture
+
+    def emit(self, record: logging.LogRecord) -> None:
+        """Buffer the record for its thread, or pass it to the original handlers."""
+        buffer = self._capture._buffer()
+        if buffer is None:
+            self._capture._emit(record)
+        else:
+            buffer.append(record)
+
+
+def schedule_order(configs: Sequence[_BaseConfig]) -> List[_BaseConfig]:
+    """Order config modules so that every module comes after the modules it depends on.
+
+    Modules otherwise keep their order in `configs`. Dependencies on modules which are not in
+    `configs` (e.g. because they are disabled) are ignored.
+
+    Raises: SNACError if the dependencies are circular.
+    """
+    names = {config.name for config in configs}
+    order: List[_BaseConfig] = []
+    placed: Set[str] = set()
+    remaining = list(configs)
+    while remaining:
+        for config in remaining:
+            if all(dep in placed or dep not in names for dep in config.depends):
+                break
+        else:
+            cycle = ", ".join(config.name for config in remaining)
+            raise SNACError(f"Circular module dependencies between: {cycle}", Errors.EX_ERROR)
+        remaining.remove(config)
+        order.append(config)
+        placed.add(config.name)
+    return order
+
+
+def _run_pool(
+    order: List[_BaseConfig],
+    func: Callable[[_BaseConfig], T],
+    jobs: int,
+    constrained: bool,
+) -> Dict[str, T]:
+    """Run `func` over the modules on a thread pool, replaying their output in `order`.
+
+    If `constrained`, a module only starts once the modules it depends on have finished, and while
+    no running module holds any of its resources. `order` must list dependencies first.
+    """
+    names = {config.name for config in order}
+    root = logging.getLogger()
+    handlers = root.handlers[:]
+    capture = _OutputCapture(sys.stdout, handlers)
+
+    def run(config: _BaseConfig) -> Tuple[List[_Event], Optional[T], Optional[BaseException]]:
+        capture.start()
+        try:
+            result, error = func(config), None
+        except Exception as e:
+            result, error = None, e
+        return capture.stop(), result, error
+
+    def can_start(config: _BaseConfig) -> bool:
+        if failed.intersection(config.depends):
+            return False
+        if not constrained:
+            return True
+        if any(dep in names and dep not in finished for dep in config.depends):
+            return False
+        return not held.intersection(config.resources)
+
+    pending = list(order)
+    running: Dict[concurrent.futures.Future, _BaseConfig] = {}
+    finished: Dict[str, Tuple[List[_Event], Optional[T], Optional[BaseException]]] = {}
+    # Modules which raised; nothing new is started once there is one.
+    failed: Set[str] = set()
+    held: Set[str] = set()
+    results: Dict[str, T] = {}
+    replayed = 0
+    first_error: Optional[BaseException] = None
+
+    sys.stdout = capture
+    root.handlers = [_CaptureHandler(capture)]
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            while pending or running:
+                for config in list(pending):
+                    if len(running) >= jobs:
+                        break
+                    if can_start(config):
+                        pending.remove(config)
+                        held.update(config.resources)
+                        running[executor.submit(run, config)] = config
+
+                done, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                for future in done:
+                    config = running.pop(future)
+                    held.difference_update(config.resources)
+                    finished[config.name] = future.result()
+                    if finished[config.name][2] is not None:
+                        failed.add(config.name)
+                        # Don't start anything new; let the running modules finish.
+                        pending.clear()
+
+                # Emit output as soon as every module before it in the order has finished.
+                while replayed < len(order) and order[replayed].name in finished:
+                    events, result, error = finished[order[replayed].name]
+                    capture.replay(events)
+                    if error is not None:
+                        first_error = first_error or error
+                    else:
+                        results[order[replayed].name] = result
+                    replayed += 1
+    finally:
+        root.handlers = handlers
+        sys.stdout = capture._stdout
+
+    # Modules which finished after the run was stopped, or after a module which never started.
+    for config in order[replayed:]:
+        if config.name in finished:
+            events, _, error = finished[config.name]
+            capture.replay(events)
+            first_error = first_error or error
+    if first_error is not None:
+        raise first_error
+    return results
+
+
+def run_grouped(
+    configs: Sequence[_BaseConfig], func: Callable[[_BaseConfig], T], jobs: int
+) -> List[T]:
+    """Call `func` on each config module, with up to `jobs` modules running at a time.
+
+    The stdout and log output of each module is held back until the module finishes, and is then
+    emitted in the order of `configs`, so that the output is the same as a sequential run's no
+    matter how the modules are scheduled.
+
+    Returns: The result of `func` for each module, in the order of `configs`.
+
+    Raises: The first exception (in the order of `configs`) raised by `func`, after the output of
+        every module before it has been emitted.
+    """
+    if jobs <= 1 or len(configs) <= 1:
+        return [func(config) for config in configs]
+    results = _run_pool(list(configs), func, jobs, constrained=False)
+    return [results[config.name] for config in configs]
+
+
+def run_scheduled(
+    configs: Sequence[_BaseConfig], func: Callable[[_BaseConfig], T], jobs: int
+) -> List[T]:
+    """Call `func` on each config module, respecting their dependencies and resources.
+
+    A module starts once all of the modules it depends on have finished, and never while another
+    module which uses one of the same resources is running. Up to `jobs` modules run at a time.
+    Output is grouped per module as with `run_grouped`, in `schedule_order`.
+
+    Returns: The result of `func` for each module, in the order of `configs`.
+
+    Raises: SNACError if the dependencies are circular; otherwise the first exception (in
+        `schedule_order`) raised by `func`. No further modules are started after a failure.
+    """
+    order = schedule_order(configs)
+    if jobs <= 1 or len(order) <= 1:
+        results = {config.name: func(config) for config in order}
+    else:
+        results = _run_pool(order, func, jobs, constrained=True)
+    return [results[config.name] for config in configs]
@@ -1,12 +1,36 @@
 import os
 import pathlib
-import subprocess
+import time
+from typing import Callable, Dict, List, Tuple
 
 from nilrt_snac._common import get_distro
+from nilrt_snac._executor import executor
 from nilrt_snac.opkg import opkg_helper
 
 from nilrt_snac import Errors, SNACError, logger
 
+# Kernel modules, loaded or built in, as sysfs lists them.
+SYS_MODULE_DIR = pathlib.Path("/sys/module")
+# Loaded kernel modules, as lsmod lists them.
+PROC_MODULES = pathlib.Path("/proc/modules")
+
+
+def kernel_module_loaded(
+    name: str,
+    sys_module_dir: pathlib.Path = SYS_MODULE_DIR,
+    proc_modules: pathlib.Path = PROC_MODULES,
+) -> bool:
+    """Return True if a kernel module is loaded or built into the kernel."""
+    if (sys_module_dir / name).is_dir():
+        return True
+    # sysfs may not be mounted, e.g. in a chroot.
+    try:
+        text = proc_modules.read_text()
+    except OSError:
+        return False
+    return any(line.split(" ", 1)[0] == name for line in text.splitlines())
+
+
 # Check that the effective UID of this bash script is root (UID 0)
 def _check_euid_root():
     print("Checking EUID")
@@ -15,23 +39,22 @@ def _check_euid_root():
 
 
 # Check that iptables is available.
-# NOTE: The ip_tables kernel module is only loaded once the first call to iptables has
-#   been made, (inlcuding rule creation).
+# NOTE: The ip_tables kernel module is only loaded once it is first needed, so it is loaded here
+#   if it isn't already.
 def _check_iptables():
     print("Checking iptables")
     if not opkg_helper.is_installed("iptables"):
         logger.debug("  Installing iptables")
         opkg_helper.install("iptables")
 
-    logger.debug("  Ensuring iptables is loaded")
+    logger.debug("  Ensuring ip_tables is loaded")
+    if kernel_module_loaded("ip_tables"):
+        return
     try:
-        subprocess.run(["iptables", "-L"])
+        executor.run(["modprobe", "ip_tables"])
     except Exception:
         raise SNACError("Failed to load iptables.", Errors.EX_CHECK_FAILURE)
-
-    logger.debug("  Ensuring iptables is installed")
-    result = subprocess.run(["lsmod"], stdout=subprocess.PIPE)
-    if "ip_tables" not in result.stdout.decode():
+    if not kernel_module_loaded("ip_tables"):
         raise SNACError("Failed to find ip_tables module.", Errors.EX_CHECK_FAILURE)
 
 
@@ -48,8 +71,30 @@ def _check_nilrt():
         raise SNACError("This script must be run on a NILRT system.", Errors.EX_BAD_ENVIRONMENT)
 
 
-def verify_prereqs():  # noqa: D103 - Missing docstring in public function (auto-generated noqa)
-    _check_euid_root()
-    _check_iptables()
-    _check_runmode()
-    _check_nilrt()
+_Check = Tuple[str, Callable[[], None]]
+
+_EUID: _Check = ("euid", _check_euid_root)
+_RUNMODE: _Check = ("runmode", _check_runmode)
+_NILRT: _Check = ("nilrt", _check_nilrt)
+_IPTABLES: _Check = ("iptables", _check_iptables)
+
+# The checks for each subcommand, in order. The cheap checks come first, and iptables (which may
+# install a package) is only needed by configure.
+PREREQS: Dict[str, List[_Check]] = {
+    "configure": [_EUID, _RUNMODE, _NILRT, _IPTABLES],
+    "verify": [_EUID, _RUNMODE, _NILRT],
+    "bundle": [_EUID, _RUNMODE, _NILRT],
+}
+
+
+def verify_prereqs(cmd: str = "configure") -> None:
+    """Check that the system can run a subcommand.
+
+    Raises: SNACError from the first check which fails.
+    """
+    for name, check in PREREQS[cmd]:
+        start = time.monotonic()
+        try:
+            check()
+        finally:
+            logger.debug(f"Prerequisite {name} checked in {(time.monotonic() - start) * 1000:.1f}ms")
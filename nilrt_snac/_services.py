@@ -0,0 +1,115 @@
+"""Restart services once, at the end of configure, and only if their inputs changed."""
+
+import concurrent.futures
+import pathlib
+import re
+import subprocess
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from nilrt_snac import Errors, SNACError, logger
+from nilrt_snac._executor import executor
+
+INIT_DIR = pathlib.Path("/etc/init.d")
+# Start links of the default runlevel, which give the order services are started in at boot.
+RC_DIR = pathlib.Path("/etc/rc5.d")
+# Priority of services which aren't started at boot; they are restarted last.
+_UNORDERED = 100
+
+_START_LINK = re.compile(r"S(\d+)(.+)")
+
+
+def start_priority(service: str, rc_dir: pathlib.Path = RC_DIR) -> int:
+    """Return the boot start priority (the NN of SNNservice) of a service."""
+    try:
+        names = [path.name for path in rc_dir.iterdir()]
+    except FileNotFoundError:
+        return _UNORDERED
+    for name in names:
+        match = _START_LINK.fullmatch(name)
+        if match is not None and match.group(2) == service:
+            return int(match.group(1))
+    return _UNORDERED
+
+
+class RestartQueue:
+    """Service restarts requested by the config modules, run together at the end of configure.
+
+    Each service is restarted once, however many changes were requested for it. Services are
+    restarted in boot order; those with the same start priority are restarted concurrently.
+    """
+
+    def __init__(self, init_dir: pathlib.Path = INIT_DIR, rc_dir: pathlib.Path = RC_DIR) -> None:
+        """Initialize an empty queue."""
+        self._init_dir = init_dir
+        self._rc_dir = rc_dir
+        self._lock = threading.Lock()
+        # The reasons for restarting each service, in the order they were requested.
+        self._requests: Dict[str, List[str]] = {}
+
+    def request(self, service: str, reason: str) -> None:
+        """Ask for a service to be restarted.
+
+        Args:
+            service: The name of the init script, e.g. "ntpd".
+            reason: What changed, e.g. "/etc/ntp.conf changed".
+        """
+        with self._lock:
+            self._requests.setdefault(service, []).append(reason)
+
+    def pending(self) -> Dict[str, List[str]]:
+        """Return the requested restarts, with their reasons."""
+        with self._lock:
+            return {service: list(reasons) for service, reasons in self._requests.items()}
+
+    def clear(self) -> None:
+        """Drop all requested restarts."""
+        with self._lock:
+            self._requests.clear()
+
+    def _restart(self, service: str) -> Tuple[float, Optional[Exception]]:
+        start = time.monotonic()
+        try:
+            executor.run([str(self._init_dir / service), "restart"])
+            error = None
+        except (OSError, SNACError, subprocess.CalledProcessError) as e:
+            error = e
+        return time.monotonic() - start, error
+
+    def run(self, dry_run: bool) -> None:
+        """Restart the requested services, and empty the queue.
+
+        Raises: SNACError if any service failed to restart, after trying all of them.
+        """
+        with self._lock:
+            requests, self._requests = self._requests, {}
+        if not requests:
+            logger.debug("No services to restart")
+            return
+
+        groups: Dict[int, List[str]] = {}
+        for service in requests:
+            groups.setdefault(start_priority(service, self._rc_dir), []).append(service)
+
+        failed = []
+        for _, services in sorted(groups.items()):
+            if dry_run:
+                for service in services:
+                    print(f"dry-run: Not restarting {service} ({'; '.join(requests[service])})")
+                continue
+            with concurrent.futures.ThreadPoolExecutor(max_workers=len(services)) as pool:
+                results = list(pool.map(self._restart, services))
+            for service, (elapsed, error) in zip(services, results):
+                reasons = "; ".join(requests[service])
+                if error is None:
+                    logger.info(f"Restarted {service} in {elapsed:.1f}s ({reasons})")
+                else:
+                    logger.error(f"Failed to restart {service} after {elapsed:.1f}s: {error}")
+                    failed.append(service)
+
+        if failed:
+            raise SNACError(f"Failed to restart: {', '.join(failed)}", Errors.EX_ERROR)
+
+
+restarts = RestartQueue()
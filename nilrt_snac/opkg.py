@@ -1,59 +1,445 @@
 """Class to help with managing opkg install/uninstall."""
 
-import subprocess
-from typing import List
+import contextlib
+import glob
+import json
+import pathlib
+import threading
+import time
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
 
-from nilrt_snac import logger
+from nilrt_snac import Errors, SNACError, logger
 from nilrt_snac._common import get_distro
+from nilrt_snac._executor import executor
 
+OPKG_CONF_DIR = "/etc/opkg"
 OPKG_SNAC_CONF = "/etc/opkg/snac.conf"
+OPKG_LISTS_DIR = "/var/lib/opkg/lists"
+OPKG_STATUS_FILES = ["/var/lib/opkg/status", "/usr/lib/opkg/status"]
+# Record of the feeds and feed indexes as of the last `opkg update` run by this tool.
+OPKG_UPDATE_STAMP = "/var/lib/nilrt-snac/opkg-update.json"
+# Feed indexes older than this (in seconds) are refreshed, even if the feeds are unchanged.
+OPKG_UPDATE_MAX_AGE = 24 * 60 * 60
 
+# opkg reports packages in these states from `opkg list-installed`.
+_INSTALLED_STATES = ("installed", "unpacked")
+
+
+class OpkgPackage(NamedTuple):
+    """An entry from the opkg package database."""
+
+    name: str
+    version: str
+    architecture: str
+    status: str
+    provides: Tuple[str, ...] = ()
+
+
+def _order(c: str) -> int:
+    """Sort weight of a non-digit version character, as used by opkg and dpkg."""
+    if c.isascii() and c.isalpha():
+        return ord(c)
+    if c == "~":
+        return -1
+    return ord(c) + 256
+
+
+def _verrevcmp(a: str, b: str) -> int:
+    """Compare two upstream-version or revision strings using the dpkg algorithm."""
+    i = j = 0
+    while i < len(a) or j < len(b):
+        first_diff = 0
+        while (i < len(a) and not a[i].isdigit()) or (j < len(b) and not b[j].isdigit()):
+            ac = _order(a[i]) if i < len(a) and not a[i].isdigit() else 0
+            bc = _order(b[j]) if j < len(b) and not b[j].isdigit() else 0
+            if ac != bc:
+                return ac - bc
+            i += 1
+            j += 1
+        while i < len(a) and a[i] == "0":
+            i += 1
+        while j < len(b) and b[j] == "0":
+            j += 1
+        while i < len(a) and a[i].isdigit() and j < len(b) and b[j].isdigit():
+            if not first_diff:
+                first_diff = ord(a[i]) - ord(b[j])
+            i += 1
+            j += 1
+        if i < len(a) and a[i].isdigit():
+            return 1
+        if j < len(b) and b[j].isdigit():
+            return -1
+        if first_diff:
+            return first_diff
+    return 0
+
+
+def _split_version(version: str) -> Tuple[int, str, str]:
+    """Split a version into its (epoch, upstream version, revision) parts."""
+    epoch = 0
+    if ":" in version:
+        epoch_str, version = version.split(":", 1)
+        epoch = int(epoch_str) if epoch_str.isdigit() else 0
+    revision = ""
+    if "-" in version:
+        version, revision = version.rsplit("-", 1)
+    return epoch, version, revision
+
+
+def compare_versions(a: str, b: str) -> int:
+    """Compare two opkg version strings.
+
+    Returns: a negative number, zero or a positive number when `a` is older than, the same as or
+    newer than `b`.
+    """
+    a_epoch, a_version, a_revision = _split_version(a)
+    b_epoch, b_version, b_revision = _split_version(b)
+    if a_epoch != b_epoch:
+        return a_epoch - b_epoch
+    return _verrevcmp(a_version, b_version) or _verrevcmp(a_revision, b_revision)
+
+
+def _parse_provides(provides: str) -> Tuple[str, ...]:
+    """Parse a `Provides:` field into bare package names, dropping any version constraints."""
+    return tuple(p.split("(")[0].strip() for p in provides.split(",") if p.strip())
+
+
+def _package_name(package: str) -> str:
+    """Return the package name for an opkg install argument, which may be a path to an IPK."""
+    if package.endswith(".ipk"):
+        return pathlib.Path(package).name[: -len(".ipk")].split("_")[0]
+    return package
+
+
+class OpkgFeed(NamedTuple):
+    """A package feed (`src` or `src/gz` line) from the opkg configuration."""
+
+    name: str
+    url: str
+    compressed: bool
+
+
+class OpkgConf(NamedTuple):
+    """The settings of interest from the opkg configuration files."""
+
+    options: Dict[str, str]
+    feeds: List[OpkgFeed]
+
+    @property
+    def lists_dir(self) -> pathlib.Path:
+        """Directory holding the downloaded feed indexes."""
+        return pathlib.Path(self.options.get("lists_dir", OPKG_LISTS_DIR))
+
+
+def _read_opkg_conf(conf_dir: str = OPKG_CONF_DIR) -> OpkgConf:
+    """Collect the `option` (and legacy `lists_dir`) settings and feeds from the opkg configuration.
+
+    Later files override earlier ones, matching the order opkg loads them in.
+    """
+    options: Dict[str, str] = {}
+    feeds: List[OpkgFeed] = []
+    for conf in sorted(glob.glob(f"{conf_dir}/*.conf")):
+        try:
+            lines = pathlib.Path(conf).read_text().splitlines()
+        except OSError:
+            continue
+        for line in lines:
+            words = line.split()
+            if len(words) >= 3 and words[0] == "option":
+                options[words[1]] = words[2]
+            elif len(words) >= 3 and words[0] == "lists_dir":
+                # Legacy form: lists_dir <type> <path>
+                options["lists_dir"] = words[2]
+            elif len(words) >= 3 and words[0] in ("src", "src/gz"):
+                feeds.append(OpkgFeed(words[1], words[2], words[0] == "src/gz"))
+    return OpkgConf(options, feeds)
+
+
+def _find_status_file(conf_dir: str = OPKG_CONF_DIR) -> Optional[pathlib.Path]:
+    """Locate the opkg status database, or None if it cannot be found."""
+    options = _read_opkg_conf(conf_dir).options
+    candidates: List[str] = []
+    if "status_file" in options:
+        candidates.append(options["status_file"])
+    if "lists_dir" in options:
+        candidates.append(str(pathlib.Path(options["lists_dir"]).parent / "status"))
+    candidates.extend(OPKG_STATUS_FILES)
+
+    for candidate in candidates:
+        path = pathlib.Path(candidate)
+        if path.is_file():
+            return path
+    return None
+
+
+def _parse_control(text: str) -> Iterator[Dict[str, str]]:
+    """Parse a Debian-style control file into one dict of fields per stanza.
+
+    Continuation lines (those starting with whitespace) are folded into the preceding field.
+    """
+    fields: Dict[str, str] = {}
+    key = None
+    for line in text.splitlines():
+        if not line.strip():
+            if fields:
+                yield fields
+            fields = {}
+            key = None
+        elif line[0] in " \t":
+            if key is not None:
+                fields[key] += "\n" + line.strip()
+        elif ":" in line:
+            key, value = line.split(":", 1)
+            fields[key] = value.strip()
+    if fields:
+        yield fields
+
+
+def _format_control(fields: Dict[str, str]) -> str:
+    """Format one stanza of a control file; the inverse of `_parse_control`."""
+    lines: List[str] = []
+    for key, value in fields.items():
+        first, *rest = value.split("\n")
+        lines.append(f"{key}: {first}")
+        lines.extend(f" {line}" for line in rest)
+    return "\n".join(lines) + "\n"
+
+
+def _read_status_file(path: pathlib.Path) -> Dict[str, OpkgPackage]:
+    """Read the installed packages out of an opkg status database."""
+    packages: Dict[str, OpkgPackage] = {}
+    for fields in _parse_control(path.read_text()):
+        name = fields.get("Package")
+        status = fields.get("Status", "").split()
+        if not name or not status or status[-1] not in _INSTALLED_STATES:
+            continue
+        packages[name] = OpkgPackage(
+            name=name,
+            version=fields.get("Version", ""),
+            architecture=fields.get("Architecture", ""),
+            status=status[-1],
+            provides=_parse_provides(fields.get("Provides", "")),
+        )
+    return packages
+
+
+def _install_flags(force_reinstall: bool = False) -> Tuple[str, ...]:
+    return ("--force-reinstall",) if force_reinstall else ()
+
+
+def _remove_flags(
+    autoremove: bool = False, force_essential: bool = False, force_depends: bool = False
+) -> Tuple[str, ...]:
+    flags: List[str] = []
+    if autoremove:
+        flags.append("--autoremove")
+    if force_essential:
+        flags.append("--force-removal-of-essential-packages")
+    if force_depends:
+        flags.append("--force-depends")
+    return tuple(flags)
+
+
+class _PlannedOperation(NamedTuple):
+    package: str
+    flags: Tuple[str, ...]
+    requester: str
+
+
+class OpkgTransaction:
+    """A plan of package installs and removals, executed in batches by `OpkgHelper.commit`.
+
+    The install() and remove() methods take the same arguments as those of OpkgHelper, so a
+    `_configs` module can declare its packages against either one.
+    """
 
-class OpkgHelper:  # noqa: D101 - Missing docstring in public class (auto-generated noqa)
     def __init__(self) -> None:  # noqa: D107 - Missing docstring in __init__ (auto-generated noqa)
-        self._installed_packages: List[str] = []
-        # This runs before the prereqs are checked
-        if get_distro() != "nilrt":
-            logger.warning("Not running on nilrt, can't get list of installed packages.")
-            return
+        # Name of the module on whose behalf packages are currently being declared.
+        self.requester = ""
+        self.installs: List[_PlannedOperation] = []
+        self.removals: List[_PlannedOperation] = []
+
+    def install(self, package: str, force_reinstall: bool = False) -> None:
+        """Plan to install a package (a feed package name or a path to an IPK)."""
+        self.installs.append(
+            _PlannedOperation(package, _install_flags(force_reinstall), self.requester)
+        )
+
+    def remove(
+        self,
+        package: str,
+        autoremove: bool = False,
+        force_essential: bool = False,
+        force_depends: bool = False,
+    ) -> None:
+        """Plan to remove a package."""
+        self.removals.append(
+            _PlannedOperation(
+                package,
+                _remove_flags(autoremove, force_essential, force_depends),
+                self.requester,
+            )
+        )
+
+
+def _group_by_flags(operations: List[_PlannedOperation]) -> Dict[Tuple[str, ...], List[str]]:
+    """Group planned operations into one package list per distinct set of opkg flags."""
+    groups: Dict[Tuple[str, ...], List[str]] = {}
+    for op in operations:
+        packages = groups.setdefault(op.flags, [])
+        if op.package not in packages:
+            packages.append(op.package)
+    return groups
+
+
+def _feed_state(conf: OpkgConf) -> Dict[str, Dict]:
+    """Describe each configured feed by its source line and the mtime of its downloaded index."""
+    state: Dict[str, Dict] = {}
+    for feed in conf.feeds:
+        try:
+            list_mtime: Optional[int] = (conf.lists_dir / feed.name).stat().st_mtime_ns
+        except OSError:
+            list_mtime = None
+        state[feed.name] = {
+            "source": f"{'src/gz' if feed.compressed else 'src'} {feed.url}",
+            "list_mtime": list_mtime,
+        }
+    return state
+
+
+def _feeds_are_fresh(state: Dict[str, Dict], stamp: Dict, max_age: float) -> bool:
+    """Check whether every configured feed index is unchanged since the recorded update.
+
+    Feeds which have been removed from the configuration since do not require a refresh.
+    """
+    if not state or time.time() - stamp.get("time", 0) >= max_age:
+        return False
+    recorded = stamp.get("feeds", {})
+    for name, feed in state.items():
+        if feed["list_mtime"] is None or recorded.get(name) != feed:
+            return False
+    return True
+
+
+class OpkgHelper:  # noqa: D101 - Missing docstring in public class (auto-generated noqa)
+    def __init__(  # noqa: D107 - Missing docstring in __init__ (auto-generated noqa)
+        self,
+        conf_dir: str = OPKG_CONF_DIR,
+        update_stamp: str = OPKG_UPDATE_STAMP,
+    ) -> None:
+        self._conf_dir = conf_dir
+        self._update_stamp = pathlib.Path(update_stamp)
+        self._update_max_age: float = OPKG_UPDATE_MAX_AGE
+        self._offline_feed: Optional[str] = None
+        self._dry_run = False
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        # opkg holds a global lock while it runs, so concurrent callers (e.g. config modules
+        # configured in parallel) take turns here rather than failing on it.
+        self._opkg_lock = threading.RLock()
+        # The installed package index: package name -> database entry, plus the reverse
+        # mapping of virtual package names to the installed packages that provide them.
+        self._packages: Dict[str, OpkgPackage] = {}
+        self._providers: Dict[str, Set[str]] = {}
+
+    def _load(self) -> None:
+        """Build the installed package index on first use.
 
-        packages = self._run(["list-installed"])
+        Loading is deferred so that importing this module (e.g. for `--version` or `--help`)
+        never touches the opkg database.
+        """
+        with self._load_lock:
+            if self._loaded:
+                return
+            self._loaded = True
 
-        for line in packages.split("\n"):
+            # This can run before the prereqs are checked
+            if get_distro() != "nilrt":
+                logger.warning("Not running on nilrt, can't get list of installed packages.")
+                return
+
+            status_file = _find_status_file(self._conf_dir)
+            if status_file is not None:
+                logger.debug(f"Reading installed packages from {status_file}")
+                packages = _read_status_file(status_file)
+            else:
+                logger.debug("opkg status database not found, falling back to opkg list-installed")
+                packages = self._list_installed()
+
+            for package in packages.values():
+                self._index_add(package)
+
+    def _index_add(self, package: OpkgPackage) -> None:
+        self._packages[package.name] = package
+        for virtual in package.provides:
+            self._providers.setdefault(virtual, set()).add(package.name)
+
+    def _index_remove(self, name: str) -> None:
+        package = self._packages.pop(name, None)
+        if package is None:
+            return
+        for virtual in package.provides:
+            providers = self._providers.get(virtual, set())
+            providers.discard(name)
+            if not providers:
+                self._providers.pop(virtual, None)
+
+    def _list_installed(self) -> Dict[str, OpkgPackage]:
+        """Query the installed packages through `opkg list-installed`."""
+        packages: Dict[str, OpkgPackage] = {}
+        for line in self._run(["list-installed"]).split("\n"):
             pkg = line.split(" - ")
             if len(pkg) > 1:
-                self._installed_packages.append(pkg[0])
+                packages[pkg[0]] = OpkgPackage(pkg[0], pkg[1].strip(), "", "installed")
+        return packages
 
     def _run(  # noqa: D102 - Missing docstring in public method (auto-generated noqa)
         self, command: List[str]
     ) -> str:
-        result = subprocess.run(["opkg"] + command, stdout=subprocess.PIPE)
+        # The helper handles dry runs itself.
+        result = executor.run(["opkg"] + command, check=False, capture=True, changes_system=False)
 
         if result.returncode != 0:
             raise RuntimeError(
                 f"Command 'opkg {' '.join(command)}' failed with return code {result.returncode}"
             )
 
-        return result.stdout.decode()
+        return result.stdout
 
     def set_dry_run(  # noqa: D102 - Missing docstring in public method (auto-generated noqa)
         self, dry_run: bool
     ) -> None:
         self._dry_run = dry_run
 
+    @property
+    def conf_dir(self) -> str:
+        """Directory of the opkg configuration files."""
+        return self._conf_dir
+
+    @property
+    def dry_run(self) -> bool:
+        """Whether changes to the system are only logged."""
+        return self._dry_run
+
+    def get_conf(self) -> OpkgConf:
+        """Read the opkg configuration this helper operates on."""
+        return _read_opkg_conf(self._conf_dir)
+
     def install(  # noqa: D102 - Missing docstring in public method (auto-generated noqa)
         self, package: str, force_reinstall: bool = False
     ) -> None:
-        if not self.is_installed(package):
-            cmd = ["opkg", "install"]
-            if force_reinstall:
-                cmd.append("--force-reinstall")
-            cmd.append(package)
-            if not self._dry_run:
-                subprocess.run(cmd, check=True)
-            self._installed_packages.append(package)
-        else:
-            logger.debug(f"{package} already installed")
+        self._load()
+        name = _package_name(package)
+        with self._opkg_lock:
+            if not self.is_installed(name):
+                cmd = ["opkg", "install", *_install_flags(force_reinstall), package]
+                if not self._dry_run:
+                    executor.run(cmd)
+                # The version of a freshly installed package is not known without re-reading the
+                # database, so it is recorded as empty.
+                self._index_add(OpkgPackage(name, "", "", "installed"))
+            else:
+                logger.debug(f"{package} already installed")
 
     def remove(
         self,
@@ -64,39 +450,181 @@ class OpkgHelper:  # noqa: D101 - Missing docstring in public class (auto-genera
         force_depends: bool = False,
     ) -> None:
         """Remove (de-install) packages from the system."""
+        self._load()
 
         logger.info(f"Removing IPK: {package}")
 
-        # Bail out if the package is not installed.
-        if not ignore_installed and not self.is_installed(package):
-            logger.debug(f"{package} already uninstalled")
-            return
+        with self._opkg_lock:
+            # Bail out if the package is not installed.
+            if not ignore_installed and not self.is_installed(package):
+                logger.debug(f"{package} already uninstalled")
+                return
+
+            cmd = ["opkg", "remove", *_remove_flags(autoremove, force_essential, force_depends)]
+            cmd.append(package)
+            if not self._dry_run:
+                executor.run(cmd, check=(not ignore_installed))
+            if not ignore_installed:
+                self._index_remove(package)
+
+    def is_installed(
+        self, package: str, min_version: Optional[str] = None
+    ) -> bool:
+        """Check whether a package is installed.
 
-        cmd = ["opkg", "remove"]
+        Args:
+            package: Name of the package.
+            min_version: If given, the installed version must be at least this version. Packages
+                installed during this run have an unknown version and never satisfy it.
+        """
+        self._load()
+        entry = self._packages.get(package)
+        if entry is None:
+            return False
+        if min_version is not None:
+            return bool(entry.version) and compare_versions(entry.version, min_version) >= 0
+        return True
 
-        if autoremove:
-            cmd.append("--autoremove")
-        if force_essential:
-            cmd.append("--force-removal-of-essential-packages")
-        if force_depends:
-            cmd.append("--force-depends")
+    def is_provided(self, package: str) -> bool:
+        """Check whether a package, or another package which provides it, is installed."""
+        self._load()
+        return package in self._packages or package in self._providers
 
-        cmd.append(package)
-        if not self._dry_run:
-            subprocess.run(cmd, check=(not ignore_installed))
-        if not ignore_installed:
-            self._installed_packages.remove(package)
-            
+    def get_providers(self, package: str) -> List[OpkgPackage]:
+        """Return the installed packages which provide the (possibly virtual) package name."""
+        self._load()
+        names = sorted(self._providers.get(package, set()))
+        if package in self._packages:
+            names.insert(0, package)
+        return [self._packages[name] for name in names]
 
-    def is_installed(  # noqa: D102 - Missing docstring in public method (auto-generated noqa)
-        self, package: str
-    ) -> bool:
-        return package in self._installed_packages
+    def get_package(self, package: str) -> Optional[OpkgPackage]:
+        """Return the database entry for an installed package, if one was read."""
+        self._load()
+        return self._packages.get(package)
 
-    def update(  # noqa: D102 - Missing docstring in public method (auto-generated noqa)
+    @contextlib.contextmanager
+    def transaction(self) -> Iterator[OpkgTransaction]:
+        """Collect package changes and apply them with `commit` when the block exits cleanly."""
+        transaction = OpkgTransaction()
+        yield transaction
+        self.commit(transaction)
+
+    def commit(
         self,
+        transaction: OpkgTransaction,
+        local_ipks: Optional[Dict[str, pathlib.Path]] = None,
+    ) -> None:
+        """Apply a transaction with one `opkg remove` and one `opkg install` per set of flags.
+
+        Removals run first, so that packages which conflict with the removed ones (like
+        nilrt-snac-conflicts) can be installed afterwards. Packages which are already in the
+        requested state are dropped from the batches.
+
+        Args:
+            transaction: The packages to install and remove.
+            local_ipks: Already downloaded IPKs (see `nilrt_snac._feeds.prefetch`), by package
+                name. These are installed from their paths instead of the feeds, including the
+                dependencies which the transaction does not name.
+        """
+        self._load()
+        with self._opkg_lock:
+            self._commit(transaction, local_ipks or {})
+
+    def _commit(
+        self, transaction: OpkgTransaction, local_ipks: Dict[str, pathlib.Path]
     ) -> None:
-        self._run(["update"])
+        wanted = {_package_name(op.package) for op in transaction.installs}
+        unwanted = {op.package for op in transaction.removals}
+        if wanted & unwanted:
+            raise SNACError(
+                f"Packages requested to be both installed and removed: {sorted(wanted & unwanted)}",
+                Errors.EX_ERROR,
+            )
+
+        removals = [op for op in transaction.removals if self.is_installed(op.package)]
+        installs = [
+            op for op in transaction.installs if not self.is_installed(_package_name(op.package))
+        ]
+
+        for op in removals:
+            logger.info(f"{op.requester}: removing IPK {op.package}")
+        for op in installs:
+            logger.info(f"{op.requester}: installing IPK {op.package}")
+
+        for flags, packages in _group_by_flags(removals).items():
+            cmd = ["opkg", "remove", *flags, *packages]
+            logger.debug(f"Running: {' '.join(cmd)}")
+            if not self._dry_run:
+                executor.run(cmd)
+            for package in packages:
+                self._index_remove(package)
+
+        install_groups = _group_by_flags(installs)
+        # Dependencies are installed in the same opkg run as the packages which need them, so that
+        # opkg finds them among its arguments instead of downloading them.
+        dependencies = [name for name in local_ipks if name not in wanted]
+        if dependencies:
+            install_groups.setdefault((), []).extend(dependencies)
+        for flags, packages in install_groups.items():
+            paths = [str(local_ipks.get(package, package)) for package in packages]
+            cmd = ["opkg", "install", *flags, *paths]
+            logger.debug(f"Running: {' '.join(cmd)}")
+            if not self._dry_run:
+                executor.run(cmd)
+            for package in packages:
+                self._index_add(OpkgPackage(_package_name(package), "", "", "installed"))
+
+    def set_update_max_age(self, max_age: float) -> None:
+        """Set the age (in seconds) after which feed indexes are refreshed by `update`."""
+        self._update_max_age = max_age
+
+    @property
+    def offline_feed(self) -> Optional[str]:
+        """Name of the local feed packages are installed from, when working offline."""
+        return self._offline_feed
+
+    def set_offline_feed(self, feed: Optional[str]) -> None:
+        """Skip refreshing the feed indexes while packages are installed from a local feed.
+
+        This only records the feed; the caller is responsible for making it the only index opkg
+        sees (see `nilrt_snac._bundle.load_bundle`).
+        """
+        self._offline_feed = feed
+
+    def update(self, force: bool = False) -> None:
+        """Refresh the feed indexes with `opkg update`.
+
+        The refresh is skipped when the configured feeds and their downloaded indexes are unchanged
+        since the last update run by this tool, and that update is younger than the max age.
+
+        Args:
+            force: Always run `opkg update`.
+        """
+        if self._offline_feed is not None:
+            logger.info(f"Installing from offline feed {self._offline_feed}; skipping opkg update.")
+            return
+
+        conf = _read_opkg_conf(self._conf_dir)
+        if not force:
+            try:
+                stamp = json.loads(self._update_stamp.read_text())
+            except (OSError, ValueError):
+                stamp = {}
+            if _feeds_are_fresh(_feed_state(conf), stamp, self._update_max_age):
+                logger.info("Package feed indexes are up to date; skipping opkg update.")
+                return
+
+        with self._opkg_lock:
+            self._run(["update"])
+
+        try:
+            self._update_stamp.parent.mkdir(parents=True, exist_ok=True)
+            self._update_stamp.write_text(
+                json.dumps({"time": time.time(), "feeds": _feed_state(conf)})
+            )
+        except OSError as e:
+            logger.debug(f"Could not record opkg update state: {e}")
 
 
 opkg_helper = OpkgHelper()
@@ -0,0 +1,63 @@
+"""Test the file metadata checks."""
+
+import grp
+import os
+import pathlib
+import pwd
+import tempfile
+from unittest.mock import patch
+
+from nilrt_snac._common import _read_ids, check_metadata, group_id, user_id
+
+
+class TestCheckMetadata:
+    """Test cases for check_metadata and the identity lookups."""
+
+    def test_read_ids(self):
+        """passwd and group files are parsed once, keeping the first entry of each name."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "passwd"
+            path.write_text(
+                "root:x:0:0:root:/root:/bin/sh\n"
+                "admin:x:500:500::/home/admin:/bin/sh\n"
+                "admin:x:501:501::/home/admin:/bin/sh\n"
+                "broken:x:none\n"
+            )
+            assert _read_ids(path) == {"root": 0, "admin": 500}
+            path.write_text("")
+            assert _read_ids(path) == {"root": 0, "admin": 500}
+
+            with patch("nilrt_snac._common.PASSWD", path), patch(
+                "nilrt_snac._common.GROUP", pathlib.Path(tmpdir) / "missing"
+            ):
+                assert user_id("admin") == 500
+                # Names which aren't in the files fall back to the system's lookups.
+                assert user_id(pwd.getpwuid(os.getuid()).pw_name) == os.getuid()
+                assert group_id(grp.getgrgid(os.getgid()).gr_name) == os.getgid()
+                assert user_id("no-such-user") is None
+
+    def test_check_metadata(self):
+        """Every mismatch is reported, from one stat of the path."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "rules.conf"
+            path.write_text("")
+            path.chmod(0o640)
+            owner = pwd.getpwuid(os.getuid()).pw_name
+            group = grp.getgrgid(os.getgid()).gr_name
+
+            with patch("os.stat", wraps=os.stat) as stat:
+                assert check_metadata(path, owner=owner, group=group, mode=0o640) == []
+            assert stat.call_count == 1
+
+            problems = check_metadata(path, owner="no-such-user", group="no-such-group", mode=0o600)
+            assert problems == [
+                f"ERROR: {path} is not owned by 'no-such-user'.",
+                f"ERROR: {path} is not owned by the 'no-such-group' group.",
+                f"ERROR: {path} does not have 600 permissions.",
+            ]
+            assert check_metadata(path, nonempty=True) == [f"ERROR: {path} is empty."]
+            path.write_text("allow\n")
+            assert check_metadata(path, nonempty=True) == []
+            assert check_metadata(pathlib.Path(tmpdir) / "missing", mode=0o600) == [
+                f"MISSING: {pathlib.Path(tmpdir) / 'missing'} not found"
+            ]
@@ -0,0 +1,330 @@
+"""Test the configuration file helpers."""
+
+import concurrent.futures
+import logging
+import os
+import pathlib
+import tempfile
+from unittest.mock import patch
+
+from nilrt_snac._configs._config_file import (
+    EqualsDelimitedConfigFile,
+    _compile,
+    _ConfigFile,
+    config_files,
+    exact_line,
+)
+
+
+def _count_reads():
+    read_text = pathlib.Path.read_text
+    return patch.object(
+        pathlib.Path, "read_text", autospec=True, side_effect=lambda p, *a, **k: read_text(p)
+    )
+
+
+class TestConfigFileStore:
+    """Test cases for the per-run configuration file cache."""
+
+    def test_read_once(self):
+        """Each path is stat'ed and read once, however many _ConfigFiles are made for it."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "sshd_config"
+            path.write_text("PermitRootLogin no\n")
+            config_files.clear()
+
+            with patch("os.stat", wraps=os.stat) as stat, _count_reads() as read_text:
+                files = [_ConfigFile(path) for _ in range(5)]
+                assert not _ConfigFile(pathlib.Path(tmpdir) / "missing").exists()
+
+            assert stat.call_count == 2
+            assert read_text.call_count == 1
+            assert all(f.exists() and f.contains("PermitRootLogin no") for f in files)
+
+    def test_edits_are_private(self):
+        """Edits to one _ConfigFile are not seen by others until saved."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "ntp.conf"
+            config_files.clear()
+
+            first = _ConfigFile(path)
+            first.add("server 0.us.pool.ntp.mil iburst maxpoll 16\n")
+            assert not _ConfigFile(path).exists()
+            assert not _ConfigFile(path).contains("pool.ntp.mil")
+
+            first.save(dry_run=False)
+            assert first.exists()
+            saved = _ConfigFile(path)
+            assert saved.exists()
+            assert saved.contains("pool.ntp.mil")
+
+    def test_concurrent_access(self):
+        """Concurrent modules share one read of each file."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            paths = [pathlib.Path(tmpdir) / f"{i}.conf" for i in range(4)]
+            for path in paths:
+                path.write_text(f"{path.name}\n")
+            config_files.clear()
+
+            with _count_reads() as read_text:
+                with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+                    files = list(executor.map(_ConfigFile, paths * 16))
+
+            assert read_text.call_count == len(paths)
+            assert all(f.contains(f.path.name) for f in files)
+
+
+class TestConfigFileSave:
+    """Test cases for saving configuration files."""
+
+    def test_unchanged_file_not_written(self):
+        """Saving a file which wasn't changed writes nothing."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "snac.conf"
+            path.write_text("option autoremove 1\n")
+            path.chmod(0o644)
+            config_files.clear()
+
+            config_file = _ConfigFile(path)
+            config_file.update("^option autoremove 1$", "option autoremove 1")
+            config_file.chmod(0o644)
+            with patch("os.replace") as replace, patch("os.chmod") as chmod:
+                assert not config_file.save(dry_run=False)
+
+            assert not replace.called
+            assert not chmod.called
+            assert config_files.files_written == 0
+
+    def test_atomic_write(self):
+        """Changes are written to a temporary file which is renamed over the original."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "sshd_config"
+            path.write_text("PermitRootLogin yes\n")
+            config_files.clear()
+
+            config_file = _ConfigFile(path)
+            config_file.update("yes", "no")
+            config_file.chmod(0o600)
+            with patch("os.replace", wraps=os.replace) as replace:
+                assert config_file.save(dry_run=False)
+
+            assert replace.call_args.args[1] == path
+            assert path.read_text() == "PermitRootLogin no\n"
+            assert path.stat().st_mode & 0o777 == 0o600
+            assert os.listdir(tmpdir) == ["sshd_config"]
+            assert (config_files.files_written, config_files.bytes_written) == (1, 19)
+
+            # Saving again is a no-op, as is a new _ConfigFile for the same path.
+            assert not config_file.save(dry_run=False)
+            assert not _ConfigFile(path).save(dry_run=False)
+            assert config_files.files_written == 1
+
+    def test_symlink_followed(self):
+        """A symlinked file is replaced at its target, and the link is kept."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            (tmp / "real").mkdir()
+            target = tmp / "real" / "ntp.conf"
+            target.write_text("server 0.pool.ntp.org\n")
+            link = tmp / "ntp.conf"
+            link.symlink_to(target)
+            config_files.clear()
+
+            config_file = _ConfigFile(link)
+            config_file.add("server time.nist.gov iburst\n")
+            assert config_file.save(dry_run=False)
+
+            assert link.is_symlink()
+            assert target.read_text() == "server 0.pool.ntp.org\nserver time.nist.gov iburst\n"
+            assert sorted(os.listdir(tmp / "real")) == ["ntp.conf"]
+
+    def test_mode_change_only(self):
+        """A change to only the mode is applied in place."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "opasswd"
+            path.write_text("")
+            path.chmod(0o644)
+            config_files.clear()
+
+            config_file = _ConfigFile(path)
+            config_file.chmod(0o600)
+            with patch("os.replace") as replace:
+                assert config_file.save(dry_run=False)
+
+            assert not replace.called
+            assert path.stat().st_mode & 0o777 == 0o600
+            assert config_files.files_written == 0
+
+    def test_dry_run(self):
+        """A dry run reports the change without writing it."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "ntp.conf"
+            config_files.clear()
+
+            config_file = _ConfigFile(path)
+            config_file.add("server 0.us.pool.ntp.mil iburst maxpoll 16\n")
+            assert config_file.save(dry_run=True)
+            assert not path.exists()
+
+
+class TestConfigFileMatch:
+    """Test cases for pattern matching in configuration files."""
+
+    CONTENT = "ClientAliveInterval 15\n  ClientAliveCountMax 4  \nTMOUT=600\nabcabc\n"
+
+    def _config_file(self, tmpdir):
+        path = pathlib.Path(tmpdir) / "sshd_config"
+        path.write_text(self.CONTENT)
+        config_files.clear()
+        return _ConfigFile(path)
+
+    def test_match_all(self):
+        """match_all gives the same answers as contains and contains_exact."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_file = self._config_file(tmpdir)
+            patterns = [
+                exact_line("ClientAliveInterval 15"),
+                exact_line("ClientAliveCountMax 4"),
+                exact_line("ClientAliveCountMax"),
+                "^TMOUT=[0-9]+$",
+                "(?m)^TMOUT=[0-9]+$",
+                "natinst.pool.ntp.org",
+                # Overlaps with the next pattern's match, and so is only found on its own.
+                "bca",
+                "abc",
+                # Backreferences can't be combined with other patterns.
+                r"(abc)\1",
+            ]
+
+            found = config_file.match_all(patterns)
+
+            assert found == {pattern: config_file.contains(pattern) for pattern in patterns}
+            assert [found[pattern] for pattern in patterns] == [
+                True, True, False, False, True, False, True, True, True
+            ]
+            assert config_file.contains_exact("TMOUT=600")
+            assert not config_file.contains_exact("TMOUT")
+
+    def test_patterns_are_cached(self):
+        """Patterns are compiled once, across _ConfigFile instances."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            _compile.cache_clear()
+            for _ in range(3):
+                config_file = self._config_file(tmpdir)
+                config_file.contains("TMOUT")
+                config_file.update("TMOUT.*", "TMOUT=900")
+                assert config_file.contains_exact("TMOUT=900")
+
+            info = _compile.cache_info()
+            assert info.misses == 3
+            assert info.hits == 6
+
+
+class TestEqualsDelimitedConfigFile:
+    """Test cases for key=value configuration files."""
+
+    CONTENT = (
+        "#\n"
+        "# This file controls the configuration of the audit daemon\n"
+        "#\n"
+        "\n"
+        "log_file = /var/log/audit/audit.log\n"
+        "action_mail_acct = root\n"
+        "space_left\t=  75\n"
+        "action_mail_acct = nobody\n"
+    )
+
+    def _config_file(self, tmpdir, content=CONTENT):
+        path = pathlib.Path(tmpdir) / "auditd.conf"
+        path.write_text(content)
+        config_files.clear()
+        return EqualsDelimitedConfigFile(path)
+
+    def test_get(self):
+        """get returns the first value for a key, and the file is saved back unchanged."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_file = self._config_file(tmpdir)
+
+            assert config_file.get("action_mail_acct") == "root"
+            assert config_file.get("space_left") == "75"
+            assert config_file.get("missing") == ""
+            assert config_file.contains_exact("log_file = /var/log/audit/audit.log")
+            assert not config_file.save(dry_run=False)
+
+    def test_set(self):
+        """set changes only the lines of its key, keeping their spacing."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_file = self._config_file(tmpdir)
+
+            config_file.set("space_left", "100")
+            config_file.set("action_mail_acct", "admin@example.com")
+            config_file.set("log_format", "ENRICHED")
+            assert config_file.get("action_mail_acct") == "admin@example.com"
+            assert config_file.save(dry_run=False)
+
+            assert (pathlib.Path(tmpdir) / "auditd.conf").read_text() == (
+                "#\n"
+                "# This file controls the configuration of the audit daemon\n"
+                "#\n"
+                "\n"
+                "log_file = /var/log/audit/audit.log\n"
+                "action_mail_acct = admin@example.com\n"
+                "space_left\t=  100\n"
+                "log_format = ENRICHED\n"
+            )
+
+    def test_set_appends(self):
+        """A missing key is appended on its own line, in the style of the file."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_file = self._config_file(tmpdir, "RuleFile=/etc/usbguard/rules.conf")
+
+            config_file.set("ImplicitPolicyTarget", "block")
+            config_file.set("RuleFile", "/etc/usbguard/rules.conf")
+
+            assert config_file._config == (
+                "RuleFile=/etc/usbguard/rules.conf\nImplicitPolicyTarget=block\n"
+            )
+
+    def test_delete(self):
+        """delete removes every line of its key."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_file = self._config_file(tmpdir)
+
+            assert config_file.delete("action_mail_acct")
+            assert not config_file.delete("action_mail_acct")
+            assert config_file.get("action_mail_acct") == ""
+            assert "action_mail_acct" not in config_file._config
+            assert config_file.get("space_left") == "75"
+
+    def test_regex_update(self):
+        """Edits through the _ConfigFile methods are seen by get."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_file = self._config_file(tmpdir)
+            assert config_file.get("log_file") == "/var/log/audit/audit.log"
+
+            config_file.update(r"^log_file\s*=.*$", "log_file = /data/audit.log")
+            config_file.add("num_logs = 5\n")
+
+            assert config_file.get("log_file") == "/data/audit.log"
+            assert config_file.get("num_logs") == "5"
+
+
+class TestConfigFileDebugLog:
+    """Test cases for logging saved configuration files."""
+
+    def test_large_file_not_logged(self, caplog):
+        """Only small files are logged in full when saved."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_files.clear()
+            small = _ConfigFile(pathlib.Path(tmpdir) / "small")
+            small.add("small file\n")
+            large = _ConfigFile(pathlib.Path(tmpdir) / "large")
+            large.add("x" * 100000)
+
+            with caplog.at_level(logging.DEBUG):
+                small.save(dry_run=True)
+                large.save(dry_run=True)
+
+            assert "small file\n" in caplog.messages
+            assert any("100000 characters, not shown" in m for m in caplog.messages)
+            assert not any("x" * 100 in m for m in caplog.messages)
@@ -0,0 +1,83 @@
+"""Test the subprocess executor."""
+
+import io
+import subprocess
+import sys
+import threading
+from contextlib import redirect_stdout
+
+import pytest
+
+from nilrt_snac import SNACError
+from nilrt_snac._executor import Executor
+
+PYTHON = sys.executable
+
+
+class TestExecutor:
+    """Test cases for running and timing commands."""
+
+    def test_run(self):
+        """Commands are run in text mode, with their output captured on request."""
+        executor = Executor()
+        result = executor.run(
+            [PYTHON, "-c", "import sys; print(sys.stdin.read().upper())"],
+            capture=True,
+            input="key",
+        )
+        assert result.stdout == "KEY\n"
+
+        result = executor.run([PYTHON, "-c", "raise SystemExit(3)"], check=False)
+        assert result.returncode == 3
+        with pytest.raises(subprocess.CalledProcessError):
+            executor.run([PYTHON, "-c", "raise SystemExit(3)"])
+
+        assert [record.returncode for record in executor.records] == [0, 3, 3]
+        assert all(record.wall > 0 and record.cpu is not None for record in executor.records)
+
+    def test_timeout(self):
+        """A command which times out is killed, recorded and reported as a SNACError."""
+        executor = Executor()
+        with pytest.raises(SNACError, match="timed out"):
+            executor.run([PYTHON, "-c", "import time; time.sleep(10)"], timeout=0.5)
+        (record,) = executor.records
+        assert record.returncode is None
+        assert 0.5 <= record.wall < 10
+
+    def test_dry_run(self):
+        """A dry run only runs the commands which don't change the system."""
+        executor = Executor()
+        executor.set_dry_run(True)
+        output = io.StringIO()
+        with redirect_stdout(output):
+            result = executor.run([PYTHON, "-c", "raise SystemExit(1)"], capture=True)
+        assert result.returncode == 0 and result.stdout == ""
+        assert output.getvalue().startswith("dry-run: Not running: ")
+
+        result = executor.run([PYTHON, "-c", "print(1)"], capture=True, changes_system=False)
+        assert result.stdout == "1\n"
+        assert len(executor.records) == 1
+
+    def test_summary(self):
+        """The summary lists the slowest commands first; overlapping commands have no CPU time."""
+        executor = Executor()
+        executor.run([PYTHON, "-c", "pass"])
+        threads = [
+            threading.Thread(
+                target=executor.run, args=([PYTHON, "-c", f"import time; time.sleep({delay})"],)
+            )
+            for delay in (0.3, 0.4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        lines = executor.summary(limit=2).splitlines()
+        assert len(lines) == 3
+        assert lines[1].endswith("time.sleep(0.4)") and lines[2].endswith("time.sleep(0.3)")
+        assert lines[1].split()[1] == "-"
+        assert executor.total() == pytest.approx(sum(r.wall for r in executor.records))
+
+        executor.clear()
+        assert executor.records == [] and executor.total() == 0
@@ -0,0 +1,237 @@
+"""Test resolving and prefetching packages from a local file:// feed."""
+
+import hashlib
+import io
+import pathlib
+import tarfile
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from nilrt_snac import SNACError
+from nilrt_snac._bundle import create_bundle, load_bundle, unload_bundle
+from nilrt_snac._feeds import FeedIndex, fetch_packages, prefetch
+from nilrt_snac.opkg import OpkgHelper, OpkgPackage, OpkgTransaction
+
+
+def _make_feed(feed_dir: pathlib.Path) -> str:
+    """Create a feed with a few IPKs and return its Packages index."""
+    packages = {
+        "firewalld": ("2.1.1-r0", "python3-firewall, nftables | iptables"),
+        "python3-firewall": ("2.1.1-r0", "python3-core"),
+        "nftables": ("1.0.9-r0", ""),
+        "iptables": ("1.8.10-r0", ""),
+        "python3-core": ("3.12.3-r0", ""),
+    }
+    stanzas = []
+    for name, (version, depends) in packages.items():
+        filename = f"core2-64/{name}_{version}_core2-64.ipk"
+        ipk = feed_dir / filename
+        ipk.parent.mkdir(parents=True, exist_ok=True)
+        ipk.write_bytes(f"{name} {version}".encode())
+        stanza = [
+            f"Package: {name}",
+            f"Version: {version}",
+            "Architecture: core2-64",
+            f"Filename: {filename}",
+            f"Size: {ipk.stat().st_size}",
+            f"SHA256sum: {hashlib.sha256(ipk.read_bytes()).hexdigest()}",
+        ]
+        if depends:
+            stanza.insert(2, f"Depends: {depends}")
+        stanzas.append("\n".join(stanza))
+    return "\n\n".join(stanzas) + "\n"
+
+
+class TestFeeds:
+    """Test cases for the feed index and package prefetch."""
+
+    def _setup(self, tmp: pathlib.Path) -> OpkgHelper:
+        conf_dir = tmp / "opkg"
+        conf_dir.mkdir()
+        feed_dir = tmp / "feed"
+        feed_dir.mkdir()
+        lists_dir = tmp / "lists"
+        lists_dir.mkdir()
+        (lists_dir / "snac").write_text(_make_feed(feed_dir))
+        (conf_dir / "opkg.conf").write_text(
+            f"option lists_dir {lists_dir}\n"
+            f"src snac file://{feed_dir}\n"
+        )
+        helper = OpkgHelper(conf_dir=str(conf_dir), update_stamp=str(tmp / "stamp.json"))
+        helper._loaded = True
+        helper._index_add(OpkgPackage("python3-core", "3.12.3-r0", "core2-64", "installed"))
+        return helper
+
+    def test_resolve_closure(self):
+        """Dependencies are followed, skipping installed packages and satisfied alternatives."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            helper = self._setup(pathlib.Path(tmpdir))
+            index = FeedIndex.from_conf(helper.get_conf())
+
+            packages = index.resolve(["firewalld"], helper.is_provided)
+
+        assert [p.name for p in packages] == ["firewalld", "python3-firewall", "nftables"]
+
+    def test_prefetch(self):
+        """Every package to be installed is downloaded, and its file returned by name."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            helper = self._setup(tmp)
+            transaction = OpkgTransaction()
+            transaction.install("firewalld")
+            transaction.install("/usr/share/nilrt-snac/nilrt-snac-conflicts.ipk")
+
+            ipks = prefetch(helper, transaction, jobs=2, dest_dir=tmp / "ipks")
+
+            assert ipks == {
+                "firewalld": tmp / "ipks" / "firewalld_2.1.1-r0_core2-64.ipk",
+                "python3-firewall": tmp / "ipks" / "python3-firewall_2.1.1-r0_core2-64.ipk",
+                "nftables": tmp / "ipks" / "nftables_1.0.9-r0_core2-64.ipk",
+            }
+            assert sorted(p.name for p in (tmp / "ipks").iterdir()) == sorted(
+                p.name for p in ipks.values()
+            )
+
+    def test_checksum_mismatch(self):
+        """A corrupted download fails the prefetch and leaves nothing behind."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            helper = self._setup(tmp)
+            (tmp / "feed" / "core2-64" / "nftables_1.0.9-r0_core2-64.ipk").write_bytes(b"bad")
+            index = FeedIndex.from_conf(helper.get_conf())
+
+            with pytest.raises(SNACError, match="Checksum mismatch"):
+                fetch_packages([index.find("nftables")], tmp / "ipks")
+
+            assert list((tmp / "ipks").iterdir()) == []
+
+
+def _make_ipk(path: pathlib.Path, control: str) -> None:
+    """Build an IPK the way src/nilrt-snac-conflicts/Makefile does (an ar archive)."""
+
+    def tar_gz(files):
+        buf = io.BytesIO()
+        with tarfile.open(fileobj=buf, mode="w:gz") as tar:
+            for name, data in files.items():
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tar.addfile(info, io.BytesIO(data))
+        return buf.getvalue()
+
+    members = {
+        "control.tar.gz": tar_gz({"control": control.encode()}),
+        "data.tar.gz": tar_gz({}),
+    }
+    out = b"!<arch>\n"
+    for name, data in members.items():
+        out += f"{name + '/':<16}{0:<12}{0:<6}{0:<6}{644:<8}{len(data):<10}`\n".encode()
+        out += data + (b"\n" if len(data) % 2 else b"")
+    path.write_bytes(out)
+
+
+class TestBundle:
+    """Test cases for offline package bundles."""
+
+    def test_bundle_round_trip(self):
+        """A bundle holds the full closure and is installed as a local feed."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            helper = TestFeeds()._setup(tmp)
+            conflicts = tmp / "nilrt-snac-conflicts.ipk"
+            _make_ipk(
+                conflicts,
+                "Package: nilrt-snac-conflicts\nArchitecture: all\nVersion: 0.1\n"
+                "Conflicts: ni-auth, niacctbase-sudo\n",
+            )
+            transaction = OpkgTransaction()
+            transaction.install("firewalld")
+            archive = tmp / "bundle.tar"
+
+            with patch("nilrt_snac._bundle.CONFLICTS_IPK", conflicts):
+                create_bundle(helper, transaction, archive)
+
+            with tarfile.open(archive) as tar:
+                # Installed packages are bundled too, for use on other targets.
+                assert sorted(tar.getnames()) == [
+                    "Packages.gz",
+                    "SHA256SUMS",
+                    "firewalld_2.1.1-r0_core2-64.ipk",
+                    "nftables_1.0.9-r0_core2-64.ipk",
+                    "nilrt-snac-conflicts.ipk",
+                    "python3-core_3.12.3-r0_core2-64.ipk",
+                    "python3-firewall_2.1.1-r0_core2-64.ipk",
+                ]
+
+            # Load it on a "target" with no feeds of its own.
+            target = tmp / "target"
+            target.mkdir()
+            target_helper = TestFeeds()._setup(target)
+            (target / "lists" / "snac").unlink()
+            bundle_dir = target / "bundle"
+            load_bundle(target_helper, archive, bundle_dir=str(bundle_dir))
+
+            assert target_helper.offline_feed == "nilrt-snac-bundle"
+            index = FeedIndex.from_conf(target_helper.get_conf(), only="nilrt-snac-bundle")
+            assert index.find("nilrt-snac-conflicts").version == "0.1"
+            firewalld = index.find("firewalld")
+            assert firewalld.url == f"file://{bundle_dir}/firewalld_2.1.1-r0_core2-64.ipk"
+
+            with patch.object(OpkgHelper, "_run") as run:
+                target_helper.update()
+            assert not run.called
+
+            ipks = prefetch(target_helper, transaction, dest_dir=target / "ipks")
+            assert ipks["firewalld"].exists()
+
+            unload_bundle(target_helper, bundle_dir=str(bundle_dir))
+            assert not (target / "opkg" / "nilrt-snac-bundle.conf").exists()
+            assert not bundle_dir.exists()
+
+    def test_bundle_hides_other_feeds(self):
+        """While a bundle is loaded, opkg sees no other feed, even one with newer versions."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            helper = TestFeeds()._setup(tmp)
+            lists_dir = tmp / "lists"
+            conflicts = tmp / "nilrt-snac-conflicts.ipk"
+            _make_ipk(conflicts, "Package: nilrt-snac-conflicts\nArchitecture: all\nVersion: 0.1\n")
+            transaction = OpkgTransaction()
+            transaction.install("firewalld")
+            archive = tmp / "bundle.tar"
+            with patch("nilrt_snac._bundle.CONFLICTS_IPK", conflicts):
+                create_bundle(helper, transaction, archive)
+            # The target has another feed, with a newer firewalld than the bundle's.
+            (lists_dir / "newer").write_text(
+                "Package: firewalld\nVersion: 9.9.9-r0\nArchitecture: core2-64\n"
+                "Filename: core2-64/firewalld_9.9.9-r0_core2-64.ipk\n"
+            )
+            (tmp / "opkg" / "newer.conf").write_text(f"src newer file://{tmp / 'newer'}\n")
+
+            bundle_dir = tmp / "bundle"
+            load_bundle(helper, archive, bundle_dir=str(bundle_dir))
+
+            assert sorted(p.name for p in lists_dir.iterdir()) == ["nilrt-snac-bundle"]
+            index = FeedIndex.from_conf(helper.get_conf())
+            assert index.find("firewalld").version == "2.1.1-r0"
+
+            unload_bundle(helper, bundle_dir=str(bundle_dir))
+            assert sorted(p.name for p in lists_dir.iterdir()) == ["newer", "snac"]
+            assert not (tmp / "lists.snac-aside").exists()
+            assert FeedIndex.from_conf(helper.get_conf()).find("firewalld").version == "9.9.9-r0"
+
+    def test_tampered_bundle(self):
+        """A bundle whose files don't match the manifest is rejected."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            (tmp / "Packages.gz").write_bytes(b"")
+            (tmp / "SHA256SUMS").write_text(f"{'0' * 64}  Packages.gz\n")
+            archive = tmp / "bundle.tar"
+            with tarfile.open(archive, "w") as tar:
+                tar.add(tmp / "Packages.gz", arcname="Packages.gz")
+                tar.add(tmp / "SHA256SUMS", arcname="SHA256SUMS")
+
+            helper = OpkgHelper(conf_dir=str(tmp), update_stamp=str(tmp / "stamp.json"))
+            with pytest.raises(SNACError, match="does not match"):
+                load_bundle(helper, archive, bundle_dir=str(tmp / "bundle"))
@@ -0,0 +1,548 @@
+"""Test the declarative firewalld configuration."""
+
+import argparse
+import functools
+import pathlib
+import subprocess
+import tempfile
+import textwrap
+import xml.etree.ElementTree as ET
+from unittest.mock import patch
+
+from nilrt_snac import SNACError
+from nilrt_snac._configs._firewall_config import (
+    SNAC_FIREWALL,
+    SNAC_POLICIES,
+    SNAC_ZONES,
+    _FirewallConfig,
+)
+from nilrt_snac._firewalld import (
+    _parse_list_all,
+    diff_config,
+    load_config,
+    load_runtime,
+    runtime_delta,
+    write_policies,
+    write_zones,
+)
+
+# The firewall-offline-cmd calls `configure` used to make, after --reset-to-defaults.
+OFFLINE_COMMANDS = [
+    ["--zone=work", "--add-interface=wglv0"],
+    ["--zone=work", "--remove-forward"],
+    ["--zone=public", "--remove-forward"],
+    ["--new-policy=work-in"],
+    ["--policy=work-in", "--add-ingress-zone=work"],
+    ["--policy=work-in", "--add-egress-zone=HOST"],
+    ["--policy=work-in", "--add-protocol=icmp"],
+    ["--policy=work-in", "--add-protocol=ipv6-icmp"],
+    ["--policy=work-in", "--add-service=ssh", "--add-service=mdns"],
+    ["--new-policy=work-out"],
+    ["--policy=work-out", "--add-ingress-zone=HOST"],
+    ["--policy=work-out", "--add-egress-zone=work"],
+    ["--policy=work-out", "--add-protocol=icmp"],
+    ["--policy=work-out", "--add-protocol=ipv6-icmp"],
+    [
+        "--policy=work-out",
+        "--add-service=ssh",
+        "--add-service=http",
+        "--add-service=https",
+        "--add-service=syslog",
+        "--add-service=ni-logos-xt",
+    ],
+    ["--policy=work-out", "--set-target=REJECT"],
+    ["--new-policy=public-in"],
+    ["--policy=public-in", "--add-ingress-zone=public"],
+    ["--policy=public-in", "--add-egress-zone=HOST"],
+    ["--policy=public-in", "--add-protocol=icmp"],
+    ["--policy=public-in", "--add-protocol=ipv6-icmp"],
+    ["--policy=public-in", "--add-service=ssh", "--add-service=wireguard"],
+    ["--new-policy=public-out"],
+    ["--policy=public-out", "--add-ingress-zone=HOST"],
+    ["--policy=public-out", "--add-egress-zone=public"],
+    ["--policy=public-out", "--add-protocol=icmp"],
+    ["--policy=public-out", "--add-protocol=ipv6-icmp"],
+    [
+        "--policy=public-out",
+        "--add-service=dhcp",
+        "--add-service=dhcpv6",
+        "--add-service=http",
+        "--add-service=https",
+        "--add-service=wireguard",
+        "--add-service=dns",
+        "--add-service=ntp",
+    ],
+    ["--policy=public-out", "--set-target=REJECT"],
+    [
+        "--policy=work-in",
+        "--add-service=ni-labview-realtime",
+        "--add-service=ni-labview-viserver",
+        "--add-service=ni-logos-xt",
+        "--add-service=ni-mxs",
+        "--add-service=ni-rpc-server",
+        "--add-service=ni-service-locator",
+    ],
+    ["--policy=work-in", "--add-port=55184/tcp"],
+    ["--policy=work-out", "--add-service=amqp", "--add-service=salt-master"],
+]
+
+WORK_ZONE = textwrap.dedent(
+    """\
+    <?xml version="1.0" encoding="utf-8"?>
+    <zone>
+      <short>Work</short>
+      <description>For use in work areas.</description>
+      <service name="ssh"/>
+      <service name="dhcpv6-client"/>
+      <forward/>
+    </zone>
+    """
+)
+
+
+def _run_offline_commands(commands):
+    """Interpret firewall-offline-cmd arguments into {("policy"|"zone", name): {item, ...}}."""
+    state = {}
+    for command in commands:
+        option, _, name = command[0].partition("=")
+        if option == "--new-policy":
+            state[("policy", name)] = {("target", "CONTINUE")}
+            continue
+        items = state.setdefault((option.lstrip("-"), name), set())
+        for arg in command[1:]:
+            action, _, value = arg.lstrip("-").partition("=")
+            verb, _, kind = action.partition("-")
+            if kind == "target":
+                items = {i for i in items if i[0] != "target"} | {("target", value)}
+                state[(option.lstrip("-"), name)] = items
+            elif verb == "add":
+                items.add((kind, value))
+            elif verb == "remove":
+                items.add((f"no-{kind}", value))
+    return state
+
+
+def _read_xml(path):
+    """Read a policy or zone file into the same form as `_run_offline_commands`."""
+    root = ET.parse(path).getroot()
+    items = set()
+    if "target" in root.attrib:
+        items.add(("target", root.get("target")))
+    for element in root:
+        if element.tag == "port":
+            items.add(("port", f"{element.get('port')}/{element.get('protocol')}"))
+        elif element.tag == "protocol":
+            items.add(("protocol", element.get("value")))
+        elif element.get("name"):
+            items.add((element.tag, element.get("name")))
+        elif element.tag == "forward":
+            items.add(("forward", ""))
+    return items
+
+
+class TestFirewalldXml:
+    """Test cases for writing the SNAC firewall configuration as XML."""
+
+    def test_matches_offline_commands(self):
+        """The policies and zones written match what the firewall-offline-cmd calls produced."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            (tmp / "system" / "zones").mkdir(parents=True)
+            (tmp / "system" / "zones" / "work.xml").write_text(WORK_ZONE)
+            (tmp / "system" / "zones" / "public.xml").write_text(
+                WORK_ZONE.replace("Work", "Public")
+            )
+            config_dir = str(tmp / "etc")
+
+            write_zones(SNAC_ZONES, config_dir=config_dir, system_dir=str(tmp / "system"))
+            write_policies(SNAC_POLICIES, config_dir=config_dir)
+
+            expected = _run_offline_commands(OFFLINE_COMMANDS)
+            policies = {p.stem for p in (tmp / "etc" / "policies").glob("*.xml")}
+            assert policies == {name for kind, name in expected if kind == "policy"}
+            for (kind, name), items in expected.items():
+                subdir = {"policy": "policies", "zone": "zones"}[kind]
+                actual = _read_xml(tmp / "etc" / subdir / f"{name}.xml")
+                if kind == "policy":
+                    assert actual == items, name
+                else:
+                    # Zones keep the rest of their system defaults.
+                    default = _read_xml(tmp / "system" / "zones" / f"{name}.xml")
+                    added = {i for i in items if not i[0].startswith("no-")}
+                    removed = {(i[0][3:], "") for i in items if i[0].startswith("no-")}
+                    assert actual == (default | added) - removed, name
+
+            work = ET.parse(tmp / "etc" / "zones" / "work.xml").getroot()
+            tags = [e.tag for e in work]
+            assert tags == ["short", "description", "interface", "service", "service"]
+
+
+SERVICE = textwrap.dedent(
+    """\
+    <?xml version="1.0" encoding="utf-8"?>
+    <service>
+      <short>{name}</short>
+      <port port="{port}" protocol="tcp"/>
+    </service>
+    """
+)
+
+
+def _snac_tree(tmp: pathlib.Path) -> None:
+    """Create system defaults, plus the SNAC configuration as `configure` writes it."""
+    system = tmp / "system"
+    (system / "zones").mkdir(parents=True)
+    (system / "services").mkdir(parents=True)
+    for zone in ("work", "public", "trusted"):
+        (system / "zones" / f"{zone}.xml").write_text(WORK_ZONE.replace("Work", zone))
+    services = {p.services for p in SNAC_POLICIES}
+    for port, name in enumerate(sorted(set().union(*services) | {"dhcpv6-client"})):
+        (system / "services" / f"{name}.xml").write_text(SERVICE.format(name=name, port=port))
+    (system / "services" / "ni-labview-realtime.xml").write_text(
+        SERVICE.format(name="ni-labview-realtime", port=3079)
+    )
+    write_zones(SNAC_ZONES, config_dir=str(tmp / "etc"), system_dir=str(system))
+    write_policies(SNAC_POLICIES, config_dir=str(tmp / "etc"))
+
+
+class TestFirewalldModel:
+    """Test cases for reading the permanent firewalld configuration."""
+
+    def test_load_config(self):
+        """Files in /etc override the system defaults, and are read into the model."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            _snac_tree(tmp)
+
+            config = load_config(str(tmp / "etc"), str(tmp / "system"))
+
+        assert {p.name: p for p in SNAC_POLICIES} == config.policies
+        assert config.zones["work"].interfaces == {"wglv0"}
+        assert not config.zones["work"].forward
+        assert config.zones["trusted"].forward
+        assert config.zones["public"].services == {"ssh", "dhcpv6-client"}
+        assert config.services["ni-labview-realtime"].ports == {"3079/tcp"}
+
+    def test_verify(self):
+        """verify answers every check from one read of the configuration."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            _snac_tree(tmp)
+            args = argparse.Namespace(dry_run=False)
+            loader = functools.partial(load_config, str(tmp / "etc"), str(tmp / "system"))
+
+            with patch(
+                "nilrt_snac._configs._firewall_config.load_config", side_effect=loader
+            ) as load, patch(
+                "subprocess.run",
+                return_value=subprocess.CompletedProcess(["pidof"], 0, "123\n"),
+            ) as run:
+                assert _FirewallConfig().verify(args)
+
+                public_in = tmp / "etc" / "policies" / "public-in.xml"
+                public_in.write_text(
+                    public_in.read_text().replace(
+                        '<service name="ssh" />',
+                        '<service name="ssh" /><service name="ni-labview-realtime" />',
+                    )
+                )
+                assert not _FirewallConfig().verify(args)
+
+                public_in.write_text(public_in.read_text().replace("ssh", "telnet"))
+                assert not _FirewallConfig().verify(args)
+
+            assert load.call_count == 3
+            # Only `pidof` is run.
+            assert run.call_count == 3
+            assert run.call_args.args[0][0] == "pidof"
+
+    def test_diff_config(self):
+        """Every missing and unexpected setting is reported in one pass."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            _snac_tree(tmp)
+            config = load_config(str(tmp / "etc"), str(tmp / "system"))
+            assert diff_config(config, SNAC_FIREWALL) == []
+
+            work_out = config.policies["work-out"]
+            config.policies["work-out"] = work_out._replace(
+                target="ACCEPT", services=work_out.services - {"ssh"} | {"telnet"}
+            )
+            del config.policies["public-in"]
+            public = config.zones["public"]
+            config.zones["public"] = public._replace(
+                forward=True, services=public.services | {"ni-mxs"}
+            )
+            work = config.zones["work"]
+            config.zones["work"] = work._replace(interfaces=frozenset(), forward=True)
+
+            assert diff_config(config, SNAC_FIREWALL) == [
+                "MISSING: policy work-out service ssh",
+                "MISSING: policy work-out target REJECT",
+                "FOUND: policy work-out service telnet",
+                "FOUND: policy work-out target ACCEPT",
+                "MISSING: policy public-in",
+                "MISSING: zone work interface wglv0",
+                "FOUND: zone work forward yes",
+                "FOUND: zone public forward yes",
+                "FOUND: zone public service ni-mxs",
+            ]
+
+
+LIST_ALL_ZONES = """\
+public (active)
+  target: default
+  icmp-block-inversion: no
+  interfaces: eth0 wglv0
+  sources: 
+  services: dhcpv6-client ssh
+  ports: 
+  protocols: 
+  forward: yes
+  masquerade: no
+  forward-ports: 
+  source-ports: 
+  icmp-blocks: 
+  rich rules: 
+
+work
+  target: default
+  icmp-block-inversion: no
+  interfaces: 
+  sources: 
+  services: dhcpv6-client ssh
+  ports: 
+  protocols: 
+  forward: yes
+  masquerade: no
+  forward-ports: 
+  source-ports: 
+  icmp-blocks: 
+  rich rules: 
+\trule family="ipv4" source address="10.0.0.0/8" accept
+"""
+
+
+# The stock firewalld defaults: the allow-host-ipv6 policy, and zones with and without rich rules.
+ALLOW_HOST_IPV6 = textwrap.dedent(
+    """\
+    <?xml version="1.0" encoding="utf-8"?>
+    <policy target="CONTINUE" priority="-15000">
+      <short>Allow host IPv6</short>
+      <description>Allows basic IPv6 functionality for hosts.</description>
+      <ingress-zone name="ANY" />
+      <egress-zone name="HOST" />
+      <rule family="ipv6">
+        <icmp-type name="neighbour-advertisement" />
+        <accept />
+      </rule>
+      <rule family="ipv6">
+        <icmp-type name="neighbour-solicitation" />
+        <accept />
+      </rule>
+      <rule family="ipv6">
+        <icmp-type name="router-advertisement" />
+        <accept />
+      </rule>
+      <rule family="ipv6">
+        <icmp-type name="redirect" />
+        <accept />
+      </rule>
+    </policy>
+    """
+)
+
+DMZ_ZONE = textwrap.dedent(
+    """\
+    <?xml version="1.0" encoding="utf-8"?>
+    <zone>
+      <short>DMZ</short>
+      <service name="ssh"/>
+      <forward-port port="8080" protocol="tcp" to-port="80"/>
+      <rule family="ipv4">
+        <source address="10.0.0.0/8" invert="true"/>
+        <log prefix="dmz" level="info"><limit value="1/m"/></log>
+        <drop/>
+      </rule>
+      <forward/>
+    </zone>
+    """
+)
+
+LIST_ALL_DEFAULT_POLICIES = """\
+allow-host-ipv6 (active)
+  priority: -15000
+  target: CONTINUE
+  ingress-zones: ANY
+  egress-zones: HOST
+  services: 
+  ports: 
+  protocols: 
+  masquerade: no
+  forward-ports: 
+  source-ports: 
+  icmp-blocks: 
+  rich rules: 
+\trule family="ipv6" icmp-type name="neighbour-advertisement" accept
+\trule family="ipv6" icmp-type name="neighbour-solicitation" accept
+\trule family="ipv6" icmp-type name="router-advertisement" accept
+\trule family="ipv6" icmp-type name="redirect" accept
+"""
+
+LIST_ALL_DEFAULT_ZONES = """\
+dmz
+  target: default
+  icmp-block-inversion: no
+  interfaces: 
+  sources: 
+  services: ssh
+  ports: 
+  protocols: 
+  forward: yes
+  masquerade: no
+  forward-ports: 
+\tport=8080:proto=tcp:toport=80:toaddr=
+  source-ports: 
+  icmp-blocks: 
+  rich rules: 
+\trule family="ipv4" source NOT address="10.0.0.0/8" log prefix="dmz" level="info" limit value="1/m" drop
+
+public (active)
+  target: default
+  icmp-block-inversion: no
+  interfaces: eth0
+  sources: 
+  services: dhcpv6-client ssh
+  ports: 
+  protocols: 
+  forward: yes
+  masquerade: no
+  forward-ports: 
+  source-ports: 
+  icmp-blocks: 
+  rich rules: 
+"""
+
+
+class TestFirewalldRuntime:
+    """Test cases for applying the permanent configuration to the running firewall."""
+
+    def _configs(self, tmp: pathlib.Path):
+        _snac_tree(tmp)
+        permanent = load_config(str(tmp / "etc"), str(tmp / "system"))
+        del permanent.zones["trusted"]
+        zones = {
+            name: zone._replace(interfaces=frozenset(), forward=True)
+            for name, zone in permanent.zones.items()
+        }
+        zones["public"] = zones["public"]._replace(interfaces=frozenset({"eth0", "wglv0"}))
+        policies = dict(permanent.policies)
+        policies["work-in"] = policies["work-in"]._replace(
+            services=policies["work-in"].services - {"ni-mxs"} | {"telnet"}
+        )
+        return permanent, permanent._replace(policies=policies, zones=zones, services={})
+
+    def test_parse_list_all(self):
+        """`firewall-cmd --list-all-zones` output is parsed per zone, including rich rules."""
+        zones = _parse_list_all(LIST_ALL_ZONES)
+        assert zones["public"]["interfaces"] == "eth0 wglv0"
+        assert zones["work"]["forward"] == "yes"
+        assert zones["work"]["rich rules"] == 'rule family="ipv4" source address="10.0.0.0/8" accept'
+
+    def test_delta(self):
+        """Only the changed settings are applied, with one firewall-cmd call per policy or zone."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            permanent, runtime = self._configs(pathlib.Path(tmpdir))
+
+        assert runtime_delta(permanent, runtime) == [
+            ["--zone=public", "--remove-forward"],
+            ["--zone=work", "--remove-forward", "--change-interface=wglv0"],
+            ["--policy=work-in", "--remove-service=telnet", "--add-service=ni-mxs"],
+        ]
+        assert runtime_delta(permanent, permanent) == []
+
+    def test_reload_fallback(self):
+        """Changes which can't be made at runtime need a full reload."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            permanent, runtime = self._configs(pathlib.Path(tmpdir))
+
+        policies = dict(runtime.policies)
+        del policies["work-in"]
+        assert runtime_delta(permanent, runtime._replace(policies=policies)) is None
+
+        policies = dict(runtime.policies)
+        policies["work-out"] = policies["work-out"]._replace(target="CONTINUE")
+        assert runtime_delta(permanent, runtime._replace(policies=policies)) is None
+
+        unmodeled = runtime._replace(unmodeled=frozenset({"zone work"}))
+        assert runtime_delta(permanent, unmodeled) is None
+
+    def test_failed_delta_reloads(self, caplog):
+        """If a runtime change fails in any way, firewalld is reloaded instead."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            permanent, runtime = self._configs(pathlib.Path(tmpdir))
+
+        errors = [
+            subprocess.CalledProcessError(1, "firewall-cmd"),
+            SNACError("Command timed out after 10s: firewall-cmd"),
+            FileNotFoundError("firewall-cmd"),
+        ]
+        for error in errors:
+
+            def cmd(*args):
+                if args[0] == "--policy=work-in":
+                    raise error
+
+            caplog.clear()
+            with patch(
+                "nilrt_snac._configs._firewall_config.load_config", return_value=permanent
+            ), patch(
+                "nilrt_snac._configs._firewall_config.load_runtime", return_value=runtime
+            ), patch(
+                "nilrt_snac._configs._firewall_config._cmd", side_effect=cmd
+            ) as run:
+                _FirewallConfig()._apply_runtime(reload=False)
+
+            assert run.call_args_list[-1].args == ("--reload",)
+            assert run.call_count == 4
+            assert any("reloading firewalld" in m for m in caplog.messages)
+
+    def test_default_unmodeled_settings(self):
+        """Stock policies and zones with rich rules don't force a reload unless they changed."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            system = pathlib.Path(tmpdir)
+            (system / "policies").mkdir()
+            (system / "zones").mkdir()
+            (system / "policies" / "allow-host-ipv6.xml").write_text(ALLOW_HOST_IPV6)
+            (system / "zones" / "dmz.xml").write_text(DMZ_ZONE)
+            (system / "zones" / "public.xml").write_text(WORK_ZONE.replace("Work", "Public"))
+            permanent = load_config(str(system / "etc"), str(system))
+
+        def firewall_cmd(argv, **kwargs):
+            outputs = {
+                "--list-all-policies": LIST_ALL_DEFAULT_POLICIES,
+                "--list-all-zones": LIST_ALL_DEFAULT_ZONES,
+            }
+            return subprocess.CompletedProcess(argv, 0, outputs[argv[1]])
+
+        with patch("subprocess.run", side_effect=firewall_cmd):
+            runtime = load_runtime()
+
+        assert permanent.unmodeled == runtime.unmodeled == {"policy allow-host-ipv6", "zone dmz"}
+        assert permanent.unmodeled_settings == runtime.unmodeled_settings
+        assert runtime_delta(permanent, runtime) == []
+
+        # A change to a modeled setting of another zone is still applied at runtime.
+        zones = dict(permanent.zones)
+        zones["public"] = zones["public"]._replace(services=frozenset({"ssh"}))
+        assert runtime_delta(permanent._replace(zones=zones), runtime) == [
+            ["--zone=public", "--remove-service=dhcpv6-client"]
+        ]
+
+        # A change to an object with unmodeled settings needs a reload.
+        zones = dict(permanent.zones)
+        zones["dmz"] = zones["dmz"]._replace(services=frozenset())
+        assert runtime_delta(permanent._replace(zones=zones), runtime) is None
+        settings = dict(runtime.unmodeled_settings)
+        settings["policy allow-host-ipv6"] -= {next(iter(settings["policy allow-host-ipv6"]))}
+        assert runtime_delta(permanent, runtime._replace(unmodeled_settings=settings)) is None
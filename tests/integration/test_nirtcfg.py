@@ -0,0 +1,154 @@
+"""Test the in-process reader and writer of NI system settings."""
+
+import os
+import pathlib
+import subprocess
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from nilrt_snac._configs._config_file import config_files
+from nilrt_snac._configs._nirtcfg import Nirtcfg, NirtcfgTransaction
+
+NI_RT_INI = """\
+[systemsettings]
+host_name = "NI-cRIO-9049-01C1B2C3"
+ConsoleOut.enabled = "True"
+ui.enabled=True
+comment = "say \\"hi\\""
+
+[LVRT]
+RTTarget.IPAccess = "+*"
+"""
+
+
+@pytest.fixture
+def ni_rt_ini():
+    """A sample ni-rt.ini, as written by nirtcfg."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = pathlib.Path(tmpdir) / "ni-rt.ini"
+        path.write_text(NI_RT_INI)
+        config_files.clear()
+        yield path
+
+
+def _nirtcfg_output(stdout):
+    return subprocess.CompletedProcess([], 0, stdout=stdout)
+
+
+class TestNirtcfg:
+    """Test cases for reading and writing ni-rt.ini."""
+
+    def test_get(self, ni_rt_ini):
+        """Tokens are read from one parse of the file, case-insensitively and unquoted."""
+        nirtcfg = Nirtcfg(ni_rt_ini)
+        with patch("subprocess.run") as run, patch.object(
+            pathlib.Path, "read_text", autospec=True, side_effect=lambda p: NI_RT_INI
+        ) as read_text:
+            assert nirtcfg.get("systemsettings", "consoleout.enabled") == "True"
+            assert nirtcfg.get("SystemSettings", "UI.enabled") == "True"
+            assert nirtcfg.get("lvrt", "RTTarget.IPAccess") == "+*"
+            assert not run.called
+            assert read_text.call_count == 1
+
+    def test_get_fallback(self, ni_rt_ini):
+        """Unset tokens and escaped values are read with nirtcfg."""
+        nirtcfg = Nirtcfg(ni_rt_ini)
+        with patch("subprocess.run", return_value=_nirtcfg_output("False\n")) as run:
+            assert nirtcfg.get("systemsettings", "PersistentLogs.enabled") == "False"
+            nirtcfg.get("systemsettings", "comment")
+
+        assert [call.args[0] for call in run.call_args_list] == [
+            ["nirtcfg", "--get", "section=systemsettings,token=PersistentLogs.enabled"],
+            ["nirtcfg", "--get", "section=systemsettings,token=comment"],
+        ]
+
+    def test_commit(self, ni_rt_ini):
+        """All settings are written in one rewrite, which only touches their lines."""
+        nirtcfg = Nirtcfg(ni_rt_ini)
+        transaction = NirtcfgTransaction()
+        transaction.set("systemsettings", "consoleout.enabled", "False")
+        transaction.set("systemsettings", "ui.enabled", "False")
+        transaction.set("SystemSettings", "PersistentLogs.enabled", "True")
+        transaction.set("snac", "enabled", "True")
+
+        with patch("subprocess.run") as run, patch("os.replace", wraps=os.replace) as replace:
+            nirtcfg.commit(transaction)
+            assert nirtcfg.get("systemsettings", "persistentlogs.enabled") == "True"
+
+        assert not run.called
+        assert replace.call_count == 1
+        assert ni_rt_ini.read_text() == """\
+[systemsettings]
+host_name = "NI-cRIO-9049-01C1B2C3"
+ConsoleOut.enabled = "False"
+ui.enabled="False"
+comment = "say \\"hi\\""
+PersistentLogs.enabled = "True"
+
+[LVRT]
+RTTarget.IPAccess = "+*"
+
+[snac]
+enabled = "True"
+"""
+
+        assert nirtcfg.changed("systemsettings", "PERSISTENTLOGS.enabled")
+        assert not nirtcfg.changed("systemsettings", "host_name")
+
+        # Setting the same values again doesn't write the file.
+        with patch("os.replace") as replace:
+            nirtcfg.commit(transaction)
+        assert not replace.called
+
+    def test_set_fallback(self, ni_rt_ini):
+        """Values which need escaping, and a missing file, are left to nirtcfg."""
+        with patch("subprocess.run", return_value=_nirtcfg_output("\n")) as run:
+            Nirtcfg(ni_rt_ini).set("systemsettings", "comment", 'say "bye"')
+            Nirtcfg(ni_rt_ini.parent / "missing.ini").set("systemsettings", "ui.enabled", "False")
+
+        assert [call.args[0] for call in run.call_args_list] == [
+            ["nirtcfg", "--get", "section=systemsettings,token=comment"],
+            ["nirtcfg", "--set", 'section=systemsettings,token=comment,value=say "bye"'],
+            ["nirtcfg", "--get", "section=systemsettings,token=ui.enabled"],
+            ["nirtcfg", "--set", "section=systemsettings,token=ui.enabled,value=False"],
+        ]
+        assert ni_rt_ini.read_text() == NI_RT_INI
+        assert not (ni_rt_ini.parent / "missing.ini").exists()
+
+    def test_fallback_only_when_changed(self):
+        """Fallback values already set aren't set again, and the file is reread after a set."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "ni-rt.ini"
+            config_files.clear()
+            nirtcfg = Nirtcfg(path)
+            transaction = NirtcfgTransaction()
+            transaction.set("systemsettings", "ui.enabled", "False")
+
+            def run(argv, **kwargs):
+                if argv[1] == "--set":
+                    path.write_text('[systemsettings]\nui.enabled = "False"\n')
+                return _nirtcfg_output("")
+
+            with patch("subprocess.run", side_effect=run) as mock:
+                assert nirtcfg.get("systemsettings", "ui.enabled") == ""
+                nirtcfg.commit(transaction)
+                assert nirtcfg.changed("systemsettings", "ui.enabled")
+                # Read from the file nirtcfg wrote, not with nirtcfg.
+                assert nirtcfg.get("systemsettings", "ui.enabled") == "False"
+                nirtcfg.commit(transaction)
+
+            assert [call.args[0][1] for call in mock.call_args_list] == ["--get", "--get", "--set"]
+
+    def test_dry_run(self, ni_rt_ini):
+        """A dry run changes nothing; it only reads the current values."""
+        nirtcfg = Nirtcfg(ni_rt_ini)
+        nirtcfg.set_dry_run(True)
+        with patch("subprocess.run", return_value=_nirtcfg_output('say "hi"\n')) as run:
+            nirtcfg.set("systemsettings", "ui.enabled", "False")
+            nirtcfg.set("systemsettings", "comment", '"')
+
+        assert [call.args[0][1] for call in run.call_args_list] == ["--get"]
+        assert nirtcfg.changed("systemsettings", "comment")
+        assert ni_rt_ini.read_text() == NI_RT_INI
@@ -0,0 +1,335 @@
+"""Test the opkg package database helpers."""
+
+import pathlib
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+from unittest.mock import patch
+
+import pytest
+
+from nilrt_snac import SNACError
+from nilrt_snac.opkg import (
+    OpkgHelper,
+    OpkgPackage,
+    OpkgTransaction,
+    _find_status_file,
+    _read_status_file,
+    compare_versions,
+)
+
+REPO_ROOT = pathlib.Path(__file__).resolve().parents[2]
+# Where opkg keeps its configuration and package database.
+OPKG_PATHS = ("/etc/opkg", "/var/lib/opkg", "/usr/lib/opkg")
+
+
+STATUS_FILE = textwrap.dedent(
+    """\
+    Package: busybox
+    Version: 1.36.1-r0
+    Depends: libc6 (>= 2.38)
+    Status: install user installed
+    Architecture: core2-64
+    Conffiles:
+     /etc/busybox.links.nosuid 2b5ee3e37e46ff6a4d4a02c7a6e01b1d
+     /etc/busybox.links.suid 9cbd5b7e6ba2d1b66ebe6bdd57c8f5f6
+    Installed-Time: 1718200000
+
+    Package: ni-auth
+    Version: 24.0.0-r0
+    Status: deinstall ok not-installed
+    Architecture: core2-64
+
+    Package: ntp
+    Version: 4.2.8p17-r0
+    Status: install ok unpacked
+    Architecture: core2-64
+    """
+)
+
+
+class TestOpkgStatusFile:
+    """Test cases for reading the opkg status database."""
+
+    def test_read_status_file(self):
+        """Installed and unpacked packages are indexed with their fields."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            status = pathlib.Path(tmpdir) / "status"
+            status.write_text(STATUS_FILE)
+
+            packages = _read_status_file(status)
+
+        assert sorted(packages) == ["busybox", "ntp"]
+        assert packages["busybox"].version == "1.36.1-r0"
+        assert packages["busybox"].architecture == "core2-64"
+        assert packages["busybox"].status == "installed"
+        assert packages["ntp"].status == "unpacked"
+
+    def test_find_configured_status_file(self):
+        """The status_file option from the opkg configuration is honored."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conf_dir = pathlib.Path(tmpdir) / "opkg"
+            conf_dir.mkdir()
+            status = pathlib.Path(tmpdir) / "status"
+            status.write_text(STATUS_FILE)
+            (conf_dir / "opkg.conf").write_text(f"option status_file {status}\n")
+
+            assert _find_status_file(str(conf_dir)) == status
+
+    def test_find_status_file_from_lists_dir(self):
+        """The status database is found next to a configured lists_dir."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            conf_dir = pathlib.Path(tmpdir) / "opkg"
+            conf_dir.mkdir()
+            lists_dir = pathlib.Path(tmpdir) / "lib" / "lists"
+            lists_dir.mkdir(parents=True)
+            status = lists_dir.parent / "status"
+            status.write_text(STATUS_FILE)
+            (conf_dir / "opkg.conf").write_text(f"lists_dir ext {lists_dir}\n")
+
+            assert _find_status_file(str(conf_dir)) == status
+
+
+class TestOpkgHelperStartup:
+    """The package index must not be loaded unless a package query is made."""
+
+    def test_version_does_not_load_index(self, record_property):
+        """`nilrt-snac --version` never touches the opkg database, from import to exit."""
+        # Run the real entry point in a fresh interpreter, which fails on any access to the opkg
+        # configuration or database, or on running any command. The distro check, which would
+        # skip loading the index off NILRT, is bypassed.
+        script = textwrap.dedent(
+            f"""\
+            import runpy, sys
+
+            def hook(event, args):
+                if event == "subprocess.Popen":
+                    raise AssertionError(f"ran {{args[1]}}")
+                if event in ("open", "os.scandir", "os.listdir") and args and isinstance(args[0], str):
+                    if args[0].startswith({OPKG_PATHS!r}):
+                        raise AssertionError(f"accessed {{args[0]}}")
+
+            sys.addaudithook(hook)
+            import nilrt_snac.opkg
+
+            nilrt_snac.opkg.get_distro = lambda: "nilrt"
+            sys.argv = ["nilrt-snac", "--version"]
+            runpy.run_module("nilrt_snac", run_name="__main__")
+            """
+        )
+        start = time.monotonic()
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+        )
+        record_property("version_seconds", time.monotonic() - start)
+
+        assert result.returncode == 0, result.stderr
+        assert result.stdout.startswith("nilrt-snac ")
+
+    def test_index_loaded_on_first_query(self):
+        """The index is built once, on the first package query."""
+        helper = OpkgHelper()
+        with patch("nilrt_snac.opkg.get_distro", return_value="nilrt"), patch(
+            "nilrt_snac.opkg._find_status_file", return_value=None
+        ), patch.object(
+            OpkgHelper, "_run", return_value="busybox - 1.36.1-r0\nntp - 4.2.8p17-r0\n"
+        ) as run:
+            assert not run.called
+            assert helper.is_installed("ntp")
+            assert not helper.is_installed("ni-auth")
+
+        run.assert_called_once_with(["list-installed"])
+
+
+class TestOpkgIndex:
+    """Test cases for the installed package index."""
+
+    def _helper(self, packages):
+        helper = OpkgHelper()
+        helper._loaded = True
+        for package in packages:
+            helper._index_add(package)
+        helper.set_dry_run(True)
+        return helper
+
+    def test_compare_versions(self):
+        """Versions are ordered the way opkg orders them."""
+        assert compare_versions("4.2.8p17-r0", "4.2.8p15-r0") > 0
+        assert compare_versions("1.0-r1", "1.0-r10") < 0
+        assert compare_versions("1.0~rc1", "1.0") < 0
+        assert compare_versions("1:0.1", "2.0") > 0
+        assert compare_versions("1.02", "1.2") == 0
+
+    def test_min_version(self):
+        """is_installed can require a minimum version."""
+        helper = self._helper([OpkgPackage("ntp", "4.2.8p17-r0", "core2-64", "installed")])
+        assert helper.is_installed("ntp")
+        assert helper.is_installed("ntp", min_version="4.2.8p15")
+        assert not helper.is_installed("ntp", min_version="4.2.9")
+
+    def test_provides(self):
+        """Virtual package names resolve to the packages providing them."""
+        syslog = OpkgPackage("syslog-ng", "4.6.0-r0", "core2-64", "installed", ("virtual-syslog",))
+        helper = self._helper([syslog])
+        assert not helper.is_installed("virtual-syslog")
+        assert helper.is_provided("virtual-syslog")
+        assert helper.get_providers("virtual-syslog") == [syslog]
+
+        helper.remove("syslog-ng")
+        assert not helper.is_provided("virtual-syslog")
+
+    def test_install_remove_keep_index(self):
+        """install and remove update the index without re-reading the database."""
+        helper = self._helper([])
+        helper.install("/usr/share/nilrt-snac/nilrt-snac-conflicts.ipk")
+        assert helper.is_installed("nilrt-snac-conflicts")
+        helper.remove("nilrt-snac-conflicts")
+        assert not helper.is_installed("nilrt-snac-conflicts")
+
+
+class TestOpkgTransaction:
+    """Test cases for batched opkg transactions."""
+
+    def test_batched_commands(self):
+        """Declared packages are applied in one opkg run per command and set of flags."""
+        helper = OpkgHelper()
+        helper._loaded = True
+        for name in ("ni-auth", "niacctbase-sudo", "packagegroup-core-x11", "tmux"):
+            helper._index_add(OpkgPackage(name, "1.0", "core2-64", "installed"))
+
+        with patch("subprocess.run") as run:
+            with helper.transaction() as transaction:
+                transaction.requester = "niauth"
+                transaction.remove("ni-auth", force_essential=True, force_depends=True)
+                transaction.remove("niacctbase-sudo")
+                transaction.install("/usr/share/nilrt-snac/nilrt-snac-conflicts.ipk")
+                transaction.requester = "graphical"
+                transaction.remove("packagegroup-ni-graphical", autoremove=True)
+                transaction.remove("packagegroup-core-x11", autoremove=True)
+                transaction.requester = "firewall"
+                transaction.install("firewalld")
+                transaction.install("firewalld-offline-cmd")
+                transaction.requester = "tmux"
+                transaction.install("tmux")
+
+        commands = [call.args[0] for call in run.call_args_list]
+        assert commands == [
+            [
+                "opkg",
+                "remove",
+                "--force-removal-of-essential-packages",
+                "--force-depends",
+                "ni-auth",
+            ],
+            ["opkg", "remove", "niacctbase-sudo"],
+            ["opkg", "remove", "--autoremove", "packagegroup-core-x11"],
+            [
+                "opkg",
+                "install",
+                "/usr/share/nilrt-snac/nilrt-snac-conflicts.ipk",
+                "firewalld",
+                "firewalld-offline-cmd",
+            ],
+        ]
+        assert not helper.is_installed("ni-auth")
+        assert helper.is_installed("nilrt-snac-conflicts")
+        assert helper.is_installed("firewalld")
+
+    def test_local_ipks(self):
+        """Prefetched packages, and their dependencies, are installed from their files."""
+        helper = OpkgHelper()
+        helper._loaded = True
+        transaction = OpkgTransaction()
+        transaction.install("/usr/share/nilrt-snac/nilrt-snac-conflicts.ipk")
+        transaction.install("firewalld")
+        transaction.install("tmux")
+        local_ipks = {
+            "firewalld": pathlib.Path("/cache/firewalld_2.1.1-r0_core2-64.ipk"),
+            "nftables": pathlib.Path("/cache/nftables_1.0.9-r0_core2-64.ipk"),
+        }
+
+        with patch("subprocess.run") as run:
+            helper.commit(transaction, local_ipks=local_ipks)
+
+        assert [call.args[0] for call in run.call_args_list] == [
+            [
+                "opkg",
+                "install",
+                "/usr/share/nilrt-snac/nilrt-snac-conflicts.ipk",
+                "/cache/firewalld_2.1.1-r0_core2-64.ipk",
+                "tmux",
+                "/cache/nftables_1.0.9-r0_core2-64.ipk",
+            ],
+        ]
+        assert helper.is_installed("nftables")
+
+    def test_conflicting_requests(self):
+        """A package cannot be both installed and removed by one transaction."""
+        helper = OpkgHelper()
+        helper._loaded = True
+        transaction = OpkgTransaction()
+        transaction.install("tmux")
+        transaction.remove("tmux")
+        with pytest.raises(SNACError):
+            helper.commit(transaction)
+
+
+class TestOpkgUpdate:
+    """Test cases for skipping redundant feed index updates."""
+
+    def _fake_update(self, lists_dir, feeds_dir):
+        """Stand-in for `opkg update` which copies the file:// feed index into the lists dir."""
+
+        def run(command):
+            assert command == ["update"]
+            lists_dir.mkdir(exist_ok=True)
+            (lists_dir / "snac").write_bytes((feeds_dir / "Packages").read_bytes())
+            return ""
+
+        return run
+
+    def test_second_update_is_noop(self):
+        """A second update against unchanged feeds does not run opkg."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            conf_dir = tmp / "opkg"
+            conf_dir.mkdir()
+            feeds_dir = tmp / "feed"
+            feeds_dir.mkdir()
+            (feeds_dir / "Packages").write_text("Package: tmux\nVersion: 3.4-r0\n")
+            lists_dir = tmp / "lists"
+            (conf_dir / "opkg.conf").write_text(
+                f"option lists_dir {lists_dir}\nsrc snac file://{feeds_dir}\n"
+            )
+            (conf_dir / "NI-dist.conf").write_text(f"src extra file://{feeds_dir}/extra\n")
+
+            helper = OpkgHelper(conf_dir=str(conf_dir), update_stamp=str(tmp / "stamp.json"))
+            with patch.object(
+                OpkgHelper, "_run", side_effect=self._fake_update(lists_dir, feeds_dir)
+            ) as run:
+                # The "extra" feed has no index yet, so the first update always runs.
+                helper.update()
+                assert run.call_count == 1
+
+                # Removing a feed doesn't invalidate the indexes of the remaining ones.
+                (conf_dir / "NI-dist.conf").unlink()
+                helper.update()
+                assert run.call_count == 1
+
+                helper.update(force=True)
+                assert run.call_count == 2
+
+                # Adding a feed requires a refresh.
+                (conf_dir / "snac.conf").write_text(f"src/gz other file://{feeds_dir}\n")
+                helper.update()
+                assert run.call_count == 3
+
+                # So does an index which is older than the max age.
+                helper.set_update_max_age(0)
+                helper.update()
+                assert run.call_count == 4
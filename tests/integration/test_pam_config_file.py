@@ -0,0 +1,121 @@
+"""Test the PAM configuration file model."""
+
+import pathlib
+import tempfile
+
+from nilrt_snac._configs._config_file import config_files
+from nilrt_snac._configs._pam_config_file import PamConfigFile, PamExpectation
+
+COMMON_PASSWORD = """\
+#
+# /etc/pam.d/common-password - password-related modules common to all services
+#
+
+# here are the per-package modules (the "Primary" block)
+password	[success=1 default=ignore]	pam_unix.so obscure sha512 remember=3
+# here's the fallback if no module succeeds
+password	requisite			pam_deny.so
+# prime the stack with a positive return value if there isn't one already;
+password	required			pam_permit.so
+"""
+
+EXPECTED = [
+    PamExpectation(
+        "password", "pam_pwquality.so", control="requisite", args=("retry=3",), before="pam_unix.so"
+    ),
+    PamExpectation("password", "pam_unix.so", args=("remember=5",)),
+]
+
+
+def _write_pam(tmpdir, name, content):
+    path = pathlib.Path(tmpdir) / name
+    path.write_text(content)
+    config_files.clear()
+    return path
+
+
+class TestPamConfigFile:
+    """Test cases for parsing and editing PAM files."""
+
+    def test_parse(self):
+        """Rules are parsed with bracketed controls; comments are skipped."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            config_file = PamConfigFile(_write_pam(tmpdir, "common-password", COMMON_PASSWORD))
+
+            rules = config_file.rules()
+            assert [rule.module for rule in rules] == ["pam_unix.so", "pam_deny.so", "pam_permit.so"]
+            assert rules[0].control == "[success=1 default=ignore]"
+            assert rules[0].args == ("obscure", "sha512", "remember=3")
+            assert config_file.find("password", "pam_deny.so").line == 7
+            assert config_file.find("auth", "pam_deny.so") is None
+
+    def test_include(self):
+        """The stack expands @include lines in place."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            _write_pam(tmpdir, "common-password", COMMON_PASSWORD)
+            path = _write_pam(
+                tmpdir, "passwd", "auth required pam_env.so\n@include common-password\n"
+            )
+            config_file = PamConfigFile(path)
+
+            assert [rule.module for rule in config_file.stack()] == [
+                "pam_env.so",
+                "pam_unix.so",
+                "pam_deny.so",
+                "pam_permit.so",
+            ]
+            assert [rule.module for rule in config_file.stack("auth")] == ["pam_env.so"]
+            assert config_file.check([PamExpectation("password", "pam_unix.so")]) == []
+
+    def test_ensure(self):
+        """ensure_rule and ensure_arg edit only their rules, and only once."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = _write_pam(tmpdir, "common-password", COMMON_PASSWORD)
+            config_file = PamConfigFile(path)
+            assert config_file.check(EXPECTED) == [
+                f"MISSING: password pam_pwquality.so rule in {path}",
+                "MISSING: 'remember=5' for pam_unix.so configuration",
+            ]
+
+            for _ in range(2):
+                config_file.ensure_rule(
+                    "password",
+                    "requisite",
+                    "pam_pwquality.so",
+                    ["retry=3"],
+                    before="pam_unix.so",
+                    comment="check for password complexity",
+                )
+                assert config_file.ensure_arg("password", "pam_unix.so", "remember=5")
+
+            assert config_file.check(EXPECTED) == []
+            assert config_file._config == COMMON_PASSWORD.replace(
+                "password	[success=1 default=ignore]	pam_unix.so obscure sha512 remember=3\n",
+                "# check for password complexity\n"
+                "password	requisite	pam_pwquality.so retry=3\n"
+                "password	[success=1 default=ignore]	pam_unix.so obscure sha512 remember=5\n",
+            )
+            assert not config_file.ensure_arg("auth", "pam_unix.so", "nullok")
+
+    def test_ensure_moves_rule(self):
+        """A rule in the wrong place or with the wrong control is fixed."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = _write_pam(
+                tmpdir,
+                "common-password",
+                COMMON_PASSWORD + "password optional pam_pwquality.so minlen=8 retry=1",
+            )
+            config_file = PamConfigFile(path)
+            assert config_file.check(EXPECTED[:1]) == [
+                "MISSING: 'requisite' control for pam_pwquality.so configuration",
+                "MISSING: 'retry=3' for pam_pwquality.so configuration",
+                f"FOUND: pam_pwquality.so after pam_unix.so in {path}",
+            ]
+
+            config_file.ensure_rule(
+                "password", "requisite", "pam_pwquality.so", ["retry=3"], before="pam_unix.so"
+            )
+
+            assert config_file.check(EXPECTED[:1]) == []
+            assert config_file.find("password", "pam_pwquality.so").args == ("minlen=8", "retry=3")
+            assert config_file._config.endswith("pam_permit.so\n")
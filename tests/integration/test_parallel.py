@@ -0,0 +1,217 @@
+"""Test running config modules concurrently."""
+
+import argparse
+import io
+import logging
+import threading
+import time
+from contextlib import redirect_stdout
+
+import pytest
+
+from nilrt_snac import SNACError, logger
+from nilrt_snac._configs import CONFIGS, _BaseConfig, _PackagesConfig, _SettingsConfig
+from nilrt_snac._configs._nirtcfg import NirtcfgTransaction
+from nilrt_snac._parallel import run_grouped, run_scheduled, schedule_order
+from nilrt_snac.opkg import OpkgTransaction
+
+
+class _SlowConfig(_BaseConfig):
+    """Config module whose verify blocks for a while, like a subprocess query."""
+
+    def __init__(self, name: str, delay: float, valid: bool = True, depends=(), resources=()):
+        super().__init__(name, depends=depends, resources=resources)
+        self.delay = delay
+        self.valid = valid
+
+    def configure(self, args: argparse.Namespace) -> None:
+        pass
+
+    def verify(self, args: argparse.Namespace) -> bool:
+        print(f"Verifying {self.name}...")
+        time.sleep(self.delay)
+        if not self.valid:
+            logger.error(f"MISSING: {self.name}")
+        print(f"Done {self.name}")
+        return self.valid
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def emit(self, record):
+        self.stream.write(f"LOG {record.getMessage()}\n")
+
+
+class TestRunGrouped:
+    """Test cases for run_grouped."""
+
+    def _run(self, configs, jobs):
+        output = io.StringIO()
+        root = logging.getLogger()
+        handler = _ListHandler(output)
+        root.addHandler(handler)
+        try:
+            with redirect_stdout(output):
+                start = time.perf_counter()
+                results = run_grouped(configs, lambda config: config.verify(None), jobs)
+                elapsed = time.perf_counter() - start
+        finally:
+            root.removeHandler(handler)
+        return results, output.getvalue(), elapsed
+
+    def test_output_matches_sequential_run(self):
+        """Output is grouped per module and in order, regardless of which module ends first."""
+        configs = [
+            _SlowConfig("a", 0.3, valid=False),
+            _SlowConfig("b", 0.1),
+            _SlowConfig("c", 0.2, valid=False),
+        ]
+        sequential = self._run(configs, jobs=1)
+        concurrent = self._run(configs, jobs=3)
+
+        assert concurrent[0] == sequential[0] == [False, True, False]
+        assert concurrent[1] == sequential[1]
+        assert sequential[1].splitlines()[:3] == ["Verifying a...", "LOG MISSING: a", "Done a"]
+        # The slowest module sets the latency, rather than the sum of all of them.
+        assert concurrent[2] < 0.5 < sequential[2]
+
+    def test_jobs_bound(self):
+        """No more than `jobs` modules run at a time."""
+        running, peak, lock = [0], [0], threading.Lock()
+
+        def func(config):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return config.name
+
+        configs = [_SlowConfig(str(i), 0) for i in range(6)]
+        assert run_grouped(configs, func, 2) == [str(i) for i in range(6)]
+        assert peak[0] == 2
+
+    def test_error_after_earlier_output(self):
+        """An exception is raised once the output of the modules before it has been printed."""
+
+        def func(config):
+            print(f"Verifying {config.name}...")
+            if config.name == "b":
+                raise RuntimeError("boom")
+            return True
+
+        configs = [_SlowConfig(name, 0) for name in "abc"]
+        output = io.StringIO()
+        with redirect_stdout(output), pytest.raises(RuntimeError):
+            run_grouped(configs, func, 3)
+
+        assert output.getvalue().startswith("Verifying a...\nVerifying b...\n")
+
+
+class TestRunScheduled:
+    """Test cases for the dependency-aware configure scheduler."""
+
+    def test_configs_order(self):
+        """The modules' dependencies are all satisfiable, and opkg is set up before installs."""
+        pseudo = [_PackagesConfig(OpkgTransaction()), _SettingsConfig(NirtcfgTransaction())]
+        order = [c.name for c in schedule_order(pseudo + CONFIGS)]
+        assert order[:2] == ["opkg", "packages"]
+        assert order.index("settings") < min(order.index(n) for n in ("console", "syslog"))
+        assert order.index("wireguard") < order.index("firewall")
+        assert order.index("niauth") < order.index("sudo")
+
+    def test_nothing_runs_before_prefetch(self):
+        """No module changes the system while the packages are still being downloaded."""
+        events, lock = [], threading.Lock()
+
+        def func(config):
+            with lock:
+                events.append(("start", config.name))
+            if config.name == "packages":
+                time.sleep(0.1)
+            with lock:
+                events.append(("end", config.name))
+
+        pseudo = [_PackagesConfig(OpkgTransaction()), _SettingsConfig(NirtcfgTransaction())]
+        run_scheduled(pseudo + CONFIGS, func, 8)
+
+        # Only the feeds are set up first, as the downloads need them.
+        prefetched = events.index(("end", "packages"))
+        assert {name for kind, name in events[:prefetched] if kind == "start"} == {
+            "opkg",
+            "packages",
+        }
+
+    def test_circular_dependencies(self):
+        """Circular dependencies are rejected before anything runs."""
+        configs = [_SlowConfig("a", 0, depends=["b"]), _SlowConfig("b", 0, depends=["a"])]
+        with pytest.raises(SNACError, match="Circular"):
+            run_scheduled(configs, lambda config: None, 2)
+
+    def test_dependencies_and_resources(self):
+        """Dependents wait for their dependencies, and modules sharing a resource never overlap."""
+        events, lock = [], threading.Lock()
+
+        def func(config):
+            with lock:
+                events.append(("start", config.name))
+            time.sleep(0.05)
+            with lock:
+                events.append(("end", config.name))
+            return config.name
+
+        configs = [
+            _SlowConfig("auditd", 0, resources=["update-rc.d"]),
+            _SlowConfig("firewall", 0, depends=["wireguard", "disabled"]),
+            _SlowConfig("wireguard", 0, resources=["update-rc.d"]),
+            _SlowConfig("ssh", 0),
+        ]
+        assert run_scheduled(configs, func, 4) == [c.name for c in configs]
+
+        def span(name):
+            return events.index(("start", name)), events.index(("end", name))
+
+        assert span("wireguard")[1] < span("firewall")[0]
+        auditd, wireguard = span("auditd"), span("wireguard")
+        assert auditd[1] < wireguard[0] or wireguard[1] < auditd[0]
+        # Independent modules did run concurrently.
+        assert span("ssh")[0] < span("auditd")[1]
+
+    def test_failure_stops_scheduling(self):
+        """No module starts after one fails, and the failure is raised."""
+        started = []
+
+        def func(config):
+            started.append(config.name)
+            if config.name == "opkg":
+                raise RuntimeError("opkg failed")
+
+        configs = [_SlowConfig("opkg", 0), _SlowConfig("ntp", 0, depends=["opkg"])]
+        with pytest.raises(RuntimeError):
+            run_scheduled(configs, func, 2)
+        assert started == ["opkg"]
+
+    def test_failure_skips_dependents(self):
+        """A module whose dependency failed never starts, even if the failure isn't replayed yet."""
+        started, lock = [], threading.Lock()
+
+        def func(config):
+            with lock:
+                started.append(config.name)
+            if config.name == "slow":
+                time.sleep(0.2)
+            if config.name == "wireguard":
+                raise RuntimeError("wireguard failed")
+
+        configs = [
+            _SlowConfig("slow", 0),
+            _SlowConfig("wireguard", 0),
+            _SlowConfig("firewall", 0, depends=["wireguard"]),
+        ]
+        with pytest.raises(RuntimeError, match="wireguard failed"):
+            run_scheduled(configs, func, 4)
+        assert sorted(started) == ["slow", "wireguard"]
@@ -0,0 +1,69 @@
+"""Test the prerequisite checks."""
+
+import pathlib
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+from nilrt_snac import SNACError
+from nilrt_snac._common import read_os_release
+from nilrt_snac._pre_reqs import PREREQS, kernel_module_loaded, verify_prereqs
+
+PROC_MODULES = """\
+iptable_filter 16384 1 - Live 0xffffffffc0a1e000
+ip_tables 32768 1 iptable_filter, Live 0xffffffffc0a0c000
+x_tables 53248 2 iptable_filter,ip_tables, Live 0xffffffffc09f3000
+"""
+
+
+class TestPrereqs:
+    """Test cases for the prerequisite checks."""
+
+    def test_kernel_module_loaded(self):
+        """Modules are found in sysfs (which lists built-in modules) or in /proc/modules."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            tmp = pathlib.Path(tmpdir)
+            sys_module = tmp / "module"
+            (sys_module / "nf_tables").mkdir(parents=True)
+            proc_modules = tmp / "modules"
+            proc_modules.write_text(PROC_MODULES)
+
+            assert kernel_module_loaded("nf_tables", sys_module, proc_modules)
+            assert kernel_module_loaded("ip_tables", sys_module, proc_modules)
+            assert not kernel_module_loaded("ip_table", sys_module, proc_modules)
+            assert not kernel_module_loaded("ip_tables", sys_module, tmp / "missing")
+
+    def test_os_release(self):
+        """os-release is parsed once, with its quotes removed."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = pathlib.Path(tmpdir) / "os-release"
+            path.write_text('# comment\nID=nilrt\nNAME="NI Linux Real-Time"\n')
+
+            assert read_os_release(path) == {"ID": "nilrt", "NAME": "NI Linux Real-Time"}
+            path.write_text("ID=other\n")
+            assert read_os_release(path)["ID"] == "nilrt"
+            assert read_os_release(pathlib.Path(tmpdir) / "missing") == {}
+
+    def test_checks_per_subcommand(self):
+        """Only the checks of the subcommand run, in order, stopping at the first failure."""
+        calls = []
+
+        def check(name, fail=False):
+            def run():
+                calls.append(name)
+                if fail:
+                    raise SNACError(f"{name} failed")
+
+            return run
+
+        table = {
+            "configure": [("a", check("a")), ("b", check("b", fail=True)), ("c", check("c"))],
+            "verify": [("a", check("a"))],
+        }
+        with patch.dict(PREREQS, table, clear=True):
+            verify_prereqs("verify")
+            assert calls == ["a"]
+            with pytest.raises(SNACError, match="b failed"):
+                verify_prereqs("configure")
+            assert calls == ["a", "a", "b"]
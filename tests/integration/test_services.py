@@ -0,0 +1,102 @@
+"""Test the service restart queue."""
+
+import io
+import pathlib
+import subprocess
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from unittest.mock import patch
+
+import pytest
+
+from nilrt_snac import SNACError
+from nilrt_snac._services import RestartQueue, start_priority
+
+
+def _rc_dir(tmpdir, links):
+    rc_dir = pathlib.Path(tmpdir) / "rc5.d"
+    rc_dir.mkdir()
+    for link in links:
+        (rc_dir / link).touch()
+    return rc_dir
+
+
+class TestRestartQueue:
+    """Test cases for the deferred service restarts."""
+
+    def test_start_priority(self):
+        """The priority comes from the service's start link."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            rc_dir = _rc_dir(tmpdir, ["S03ni-wireguard-labview", "S20syslog", "K20syslog"])
+
+            assert start_priority("syslog", rc_dir) == 20
+            assert start_priority("ni-wireguard-labview", rc_dir) == 3
+            assert start_priority("ntpd", rc_dir) > 20
+            assert start_priority("ntpd", rc_dir / "missing") > 20
+
+    def test_run(self):
+        """Each service restarts once, in boot order, with equal priorities in parallel."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            rc_dir = _rc_dir(tmpdir, ["S20auditd", "S20syslog", "S03ni-wireguard-labview"])
+            queue = RestartQueue(pathlib.Path("/etc/init.d"), rc_dir)
+            queue.request("ntpd", "/etc/ntp.conf changed")
+            queue.request("auditd", "/etc/audit/auditd.conf changed")
+            queue.request("syslog", "PersistentLogs.enabled changed")
+            queue.request("auditd", "enabled at boot")
+            queue.request("ni-wireguard-labview", "/etc/wireguard/wglv0.conf changed")
+
+            events, lock = [], threading.Lock()
+
+            def restart(argv, **kwargs):
+                with lock:
+                    events.append(("start", argv[0]))
+                time.sleep(0.05)
+                with lock:
+                    events.append(("end", argv[0]))
+                return subprocess.CompletedProcess(argv, 0)
+
+            with patch("subprocess.run", side_effect=restart) as run:
+                queue.run(dry_run=False)
+
+            assert run.call_count == 4
+            assert events[:2] == [
+                ("start", "/etc/init.d/ni-wireguard-labview"),
+                ("end", "/etc/init.d/ni-wireguard-labview"),
+            ]
+            # auditd and syslog overlap.
+            assert {event[0] for event in events[2:4]} == {"start"}
+            assert events[-2:] == [("start", "/etc/init.d/ntpd"), ("end", "/etc/init.d/ntpd")]
+            assert queue.pending() == {}
+
+    def test_failure(self):
+        """A failed restart doesn't stop the others, but fails the run."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = RestartQueue(pathlib.Path("/etc/init.d"), _rc_dir(tmpdir, []))
+            queue.request("auditd", "changed")
+            queue.request("ntpd", "changed")
+
+            def restart(argv, **kwargs):
+                if "auditd" in argv[0]:
+                    raise subprocess.CalledProcessError(1, argv)
+                return subprocess.CompletedProcess(argv, 0)
+
+            with patch("subprocess.run", side_effect=restart) as run:
+                with pytest.raises(SNACError, match="Failed to restart: auditd"):
+                    queue.run(dry_run=False)
+            assert run.call_count == 2
+
+    def test_dry_run(self):
+        """A dry run only reports the restarts; an empty queue does nothing."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            queue = RestartQueue(pathlib.Path("/etc/init.d"), _rc_dir(tmpdir, []))
+            queue.request("ntpd", "/etc/ntp.conf changed")
+
+            output = io.StringIO()
+            with patch("subprocess.run") as run, redirect_stdout(output):
+                queue.run(dry_run=True)
+                queue.run(dry_run=False)
+
+            assert not run.called
+            assert output.getvalue() == "dry-run: Not restarting ntpd (/etc/ntp.conf changed)\n"
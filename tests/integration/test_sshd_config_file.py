@@ -0,0 +1,126 @@
+"""Test the sshd_config model."""
+
+import pathlib
+import subprocess
+import tempfile
+from unittest.mock import patch
+
+from nilrt_snac._configs._config_file import config_files
+from nilrt_snac._configs._sshd_config_file import SshdConfigFile, _sshd_test
+
+SSHD_CONFIG = """\
+#	$OpenBSD: sshd_config,v 1.104 2021/07/02 05:11:21 dtucker Exp $
+
+Include sshd_config.d/*.conf
+#ClientAliveInterval 0
+PermitRootLogin=no
+clientalivecountmax 3
+
+# Example of overriding settings on a per-user basis
+Match User anoncvs
+	ClientAliveInterval 0
+	X11Forwarding no
+"""
+
+
+def _write_config(tmpdir, main=SSHD_CONFIG, included=None):
+    path = pathlib.Path(tmpdir) / "sshd_config"
+    path.write_text(main)
+    if included is not None:
+        (pathlib.Path(tmpdir) / "sshd_config.d").mkdir()
+        (pathlib.Path(tmpdir) / "sshd_config.d" / "10-snac.conf").write_text(included)
+    config_files.clear()
+    _sshd_test.cache_clear()
+    return path
+
+
+class TestSshdConfigFile:
+    """Test cases for parsing and editing sshd_config."""
+
+    def test_scopes(self):
+        """Global values follow first-match-wins; Match blocks and comments are not global."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = _write_config(tmpdir, included="PermitRootLogin yes\n")
+            config_file = SshdConfigFile(path)
+
+            assert config_file.get("PermitRootLogin") == "yes"
+            assert config_file.get("ClientAliveCountMax") == "3"
+            assert config_file.get("ClientAliveInterval") is None
+            assert config_file.get("X11Forwarding") is None
+            [directive] = config_file.directives("clientaliveinterval")
+            assert directive.match == "User anoncvs"
+            assert directive.value == "0"
+
+    def test_line_without_keyword(self):
+        """A line which has no keyword (e.g. "=foo") is skipped, not fatal."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = _write_config(tmpdir, main="=foo\n  = \nPermitRootLogin no\n")
+            config_file = SshdConfigFile(path)
+
+            assert config_file.get("PermitRootLogin") == "no"
+            assert [d.keyword for d in config_file.directives("permitrootlogin")] == [
+                "PermitRootLogin"
+            ]
+
+    def test_set(self):
+        """set edits the effective global line, or adds one where it takes precedence."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = _write_config(tmpdir, included="PermitRootLogin yes\n")
+            config_file = SshdConfigFile(path)
+
+            config_file.set("ClientAliveCountMax", "4")
+            config_file.set("ClientAliveInterval", "15")
+            config_file.set("PermitRootLogin", "no")
+            assert config_file.save(dry_run=False)
+
+            assert path.read_text() == """\
+#	$OpenBSD: sshd_config,v 1.104 2021/07/02 05:11:21 dtucker Exp $
+
+PermitRootLogin no
+Include sshd_config.d/*.conf
+#ClientAliveInterval 0
+PermitRootLogin=no
+ClientAliveCountMax 4
+ClientAliveInterval 15
+
+# Example of overriding settings on a per-user basis
+Match User anoncvs
+	ClientAliveInterval 0
+	X11Forwarding no
+"""
+            assert SshdConfigFile(path).get("ClientAliveInterval") == "15"
+            assert SshdConfigFile(path).get("PermitRootLogin") == "no"
+
+    def test_set_unchanged(self):
+        """Setting the current values doesn't change the file."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = _write_config(tmpdir, main="PermitRootLogin no\nClientAliveInterval 15")
+            config_file = SshdConfigFile(path)
+
+            config_file.set("PermitRootLogin", "no")
+            assert not config_file.save(dry_run=False)
+
+            config_file.set("ClientAliveCountMax", "4")
+            assert config_file._config == (
+                "PermitRootLogin no\nClientAliveInterval 15\nClientAliveCountMax 4\n"
+            )
+
+    def test_effective(self):
+        """The effective value comes from one cached sshd -T run, if sshd can report it."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = _write_config(tmpdir)
+            output = "port 22\nclientaliveinterval 15\nclientalivecountmax 4\n"
+            with patch("subprocess.run") as run:
+                run.return_value = subprocess.CompletedProcess([], 0, stdout=output)
+                config_file = SshdConfigFile(path)
+                assert config_file.effective("ClientAliveInterval") == "15"
+                assert SshdConfigFile(path).effective("ClientAliveCountMax") == "4"
+                assert run.call_count == 1
+
+                # Unsaved edits aren't seen by sshd.
+                config_file.set("ClientAliveInterval", "30")
+                assert config_file.effective("ClientAliveInterval") == "30"
+
+            _sshd_test.cache_clear()
+            with patch("subprocess.run", side_effect=FileNotFoundError("sshd")):
+                assert SshdConfigFile(path).effective("ClientAliveCountMax") == "3"